@@ -0,0 +1,231 @@
+"""
+Answer cache for repeated first-turn questions.
+
+Keys combine the normalized words of the question (normalization.py, so
+English, Filipino and Taglish spellings of the same words share an entry) with
+a fingerprint of everything else that shapes the answer (PDF contents, system
+instruction, model, context mode), so a changed PDF or prompt never serves old
+answers. Unlike the term set retrieval and the router match on, the key keeps
+word order, question words and direction: "When is enrollment?" and "How do I
+enroll?", or "STEM to ABM" and "ABM to STEM", are different questions. Two backends share
+the same interface: an in-process LRU and a SQLite table that lets every worker
+on the machine reuse the same hits.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from normalization import STOPWORDS, normalize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 24 * 3600
+
+# Question words that change what is being asked; a question without one is a "what" question
+QUESTION_WORDS = ("who", "when", "where", "why", "how", "which")
+# Question words the shared normalizer leaves as Filipino stopwords
+QUESTION_SYNONYMS = {"bakit": "why", "alin": "which"}
+# Terms that carry their own question word: "magkano" and "how much" both ask how much
+IMPLIED_QUESTION_WORDS = {"cost": "how"}
+# Words whose order matters: "STEM to ABM" is not "ABM to STEM"
+DIRECTION_WORDS = frozenset(("to", "from", "into"))
+
+
+def normalize_question(text):
+    """Cache form of a question: its question word, then its content terms sorted within each direction
+
+    "When is enrollment?" and "Kailan ang enrollment?" share 'when enrollment';
+    "How do I enroll?" gets 'how enrollment' and "Where is the registrar?" is
+    not "Who is the registrar?". Terms are sorted (word order rarely matters in
+    these FAQ-style questions) except across to/from/into.
+    """
+    normalized = normalize(text)
+    asking = None
+    segments = [set()]
+    for word in normalized.words:
+        word = QUESTION_SYNONYMS.get(word, word)
+        if word in QUESTION_WORDS:
+            asking = asking or word
+        elif word in DIRECTION_WORDS:
+            segments.append(word)
+            segments.append(set())
+        elif word not in STOPWORDS:
+            segments[-1].add(word)
+    for term, implied in IMPLIED_QUESTION_WORDS.items():
+        if asking is None and term in segments[0]:
+            asking = implied
+    parts = [asking or "what"]
+    for segment in segments:
+        parts.extend([segment] if isinstance(segment, str) else sorted(segment))
+    # A direction word with nothing after it ("what to bring") says nothing about order
+    while parts[-1] in DIRECTION_WORDS:
+        parts.pop()
+    return ' '.join(parts)
+
+
+def context_fingerprint(*parts):
+    """Short hash of everything besides the question that shapes an answer"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def make_key(question, fingerprint):
+    """Cache key for a question (text or NormalizedText)"""
+    return f"{fingerprint}:{normalize_question(question)}"
+
+
+class MemoryAnswerCache:
+    """In-process LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def contains(self, key):
+        """Whether key has a live answer, without counting a lookup or touching its recency"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.time()
+
+    def set(self, key, answer, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (answer, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class SQLiteAnswerCache:
+    """LRU cache with a per-entry TTL, shared by workers through SQLite"""
+
+    def __init__(self, db_path, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY, answer TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT answer, expires_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def contains(self, key):
+        row = self._connect().execute("SELECT 1 FROM answers WHERE key = ? AND expires_at > ?",
+                                      (key, time.time())).fetchone()
+        return row is not None
+
+    def set(self, key, answer, ttl=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                (key, answer, now + (ttl or self.ttl), now)
+            )
+            count = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                evicted = conn.execute(
+                    "DELETE FROM answers WHERE key IN"
+                    " (SELECT key FROM answers ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+                self.evictions += evicted
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM answers")
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def create_answer_cache(backend, data_dir, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+    """Build the configured cache backend, or None when caching is off"""
+    if backend == 'memory':
+        return MemoryAnswerCache(max_entries, ttl)
+    if backend == 'sqlite':
+        return SQLiteAnswerCache(os.path.join(data_dir, 'answer_cache.sqlite3'), max_entries, ttl)
+    if backend not in ('off', 'none', ''):
+        logger.warning(f"Unknown ANSWER_CACHE backend '{backend}', caching disabled")
+    return None
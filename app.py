@@ -1,12 +1,41 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-import google.generativeai as genai
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g, has_request_context, send_from_directory
 import os
+import json
+import re
+import sqlite3
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 import uuid
 import logging
+import hmac
+import math
+import mimetypes
+import tempfile
+import threading
+from contextlib import nullcontext
 from functools import wraps
-from authlib.integrations.flask_client import OAuth
+import batch
+import knowledge_base
+import retrieval
+from file_handles import FileHandleManager, FileHandleStore
+from model_backend import RecordingBackend, TrafficRecorder, create_model_backend
+from resilience import CLOSED, CircuitBreaker, CircuitOpen, ResilientModel, STATE_VALUES, is_retryable
+from rate_limits import Limits, RateLimited, create_rate_limiter, usage_day
+from scheduler import GenerationScheduler, Overloaded, parse_weights
+from single_flight import FlightFailed, contents_key, create_single_flight
+from answer_cache import create_answer_cache, context_fingerprint, make_key
+from follow_ups import suggest_follow_ups
+from prefetch import Prefetcher, create_prefetch_ledger
+from history_store import Message, create_history_store
+from conversation_store import MAX_PAGE_SIZE, InvalidCursor, create_conversation_store
+from context_builder import RollingSummarizer, build_history_window
+from intent_router import IntentRouter, parse_thresholds
+from normalization import normalize
+import knowledge_tables
+import metrics
+import oidc_discovery
+import static_assets
 
 # Load environment variables
 load_dotenv()
@@ -20,15 +49,14 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+request_logger = logging.getLogger(f"{__name__}.requests")
 
-# Configure the Gemini API
+# Gemini API key (not needed when benchmarking with MODEL_BACKEND=fake); the SDK is configured on first use
 api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
+if not api_key and os.getenv('MODEL_BACKEND', 'gemini') == 'gemini':
     logger.error("GEMINI_API_KEY not found in environment variables")
     raise ValueError("GEMINI_API_KEY must be set in environment variables")
 
-genai.configure(api_key=api_key)
-
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', str(uuid.uuid4()))
 
@@ -36,20 +64,159 @@ app.secret_key = os.getenv('SECRET_KEY', str(uuid.uuid4()))
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
 
-# OAuth Configuration
-oauth = OAuth(app)
-google = oauth.register(
-    name='google',
-    client_id=os.getenv('GOOGLE_CLIENT_ID'),
-    client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-    client_kwargs={
-        'scope': 'openid email profile'
-    }
-)
-
-# Store conversation histories per session
-conversation_histories = {}
+# Model backend: 'gemini', or 'fake' for local benchmarks and load tests (see model_backend.py)
+app.config['MODEL_BACKEND'] = os.getenv('MODEL_BACKEND', 'gemini')
+# Append every incoming message and model call (contents hash, answer, timing, tokens) to this NDJSON
+# file, for offline replay with MODEL_BACKEND=replay; empty disables recording
+app.config['MODEL_RECORD'] = os.getenv('MODEL_RECORD', '')
+
+# Prompt context configuration
+# 'retrieval' sends only the most relevant PDF passages, 'file' attaches the whole PDF
+app.config['CONTEXT_MODE'] = os.getenv('CONTEXT_MODE', 'retrieval')
+app.config['RETRIEVAL_TOP_K'] = int(os.getenv('RETRIEVAL_TOP_K', '4'))
+
+# Recent history is sent verbatim up to this many tokens; older turns are summarized
+app.config['HISTORY_TOKEN_BUDGET'] = int(os.getenv('HISTORY_TOKEN_BUDGET', '1500'))
+app.config['HISTORY_SUMMARY_ENABLED'] = os.getenv('HISTORY_SUMMARY_ENABLED', '1') == '1'
+
+# Local state shared by workers on the same machine (Vercel only allows writes under /tmp)
+app.config['DATA_DIR'] = os.getenv('DATA_DIR', os.path.join(tempfile.gettempdir(), 'ask_lagronian'))
+app.config['WARM_UP_ON_STARTUP'] = os.getenv('WARM_UP_ON_STARTUP', '1') == '1'
+
+# Stream replies as NDJSON when the client asks for it (set to 0 where responses are buffered)
+app.config['STREAMING_ENABLED'] = os.getenv('STREAMING_ENABLED', '1') == '1'
+
+# Under asgi.py, /send_message awaits the model on the event loop instead of holding a thread;
+# store, cache and rate-limit calls run on a pool of this many threads
+app.config['ASYNC_CHAT'] = os.getenv('ASYNC_CHAT', '1') == '1'
+app.config['ASYNC_BLOCKING_THREADS'] = int(os.getenv('ASYNC_BLOCKING_THREADS', '32'))
+
+# Answer cache for first-turn questions: 'sqlite' (shared by workers), 'memory' or 'off'
+app.config['ANSWER_CACHE'] = os.getenv('ANSWER_CACHE', 'sqlite')
+app.config['ANSWER_CACHE_SIZE'] = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+app.config['ANSWER_CACHE_TTL'] = int(os.getenv('ANSWER_CACHE_TTL', str(24 * 3600)))
+
+# Suggested follow-up questions per reply (0 disables). The top PREFETCH_FOLLOW_UPS are answered in the
+# background into the answer cache while more than PREFETCH_SPARE_SLOTS generation slots are idle;
+# a prefetched answer not clicked within PREFETCH_USE_WINDOW seconds counts as wasted quota
+app.config['FOLLOW_UP_SUGGESTIONS'] = int(os.getenv('FOLLOW_UP_SUGGESTIONS', '3'))
+app.config['PREFETCH_FOLLOW_UPS'] = int(os.getenv('PREFETCH_FOLLOW_UPS', '2'))
+app.config['PREFETCH_SPARE_SLOTS'] = int(os.getenv('PREFETCH_SPARE_SLOTS', '2'))
+app.config['PREFETCH_USE_WINDOW'] = float(os.getenv('PREFETCH_USE_WINDOW', '1800'))
+
+# Conversation history backend: 'memory' (per process), 'sqlite' or 'file' (shared by workers)
+app.config['HISTORY_STORE'] = os.getenv('HISTORY_STORE', 'memory')
+app.config['HISTORY_MAX_MESSAGES'] = int(os.getenv('HISTORY_MAX_MESSAGES', '40'))
+app.config['HISTORY_MAX_SESSIONS'] = int(os.getenv('HISTORY_MAX_SESSIONS', '10000'))
+app.config['HISTORY_MAX_BYTES'] = int(os.getenv('HISTORY_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Saved conversations of logged-in users, listed in the sidebar: 'sqlite' (shared by workers), 'memory' or 'off'
+app.config['CONVERSATION_STORE'] = os.getenv('CONVERSATION_STORE', 'sqlite')
+app.config['CONVERSATION_PAGE_SIZE'] = int(os.getenv('CONVERSATION_PAGE_SIZE', '20'))
+
+# Local intent router for canned replies: 'on', 'shadow' (log only) or 'off'
+app.config['INTENT_ROUTER'] = os.getenv('INTENT_ROUTER', 'on')
+app.config['INTENT_ROUTER_THRESHOLD'] = float(os.getenv('INTENT_ROUTER_THRESHOLD', '0.9'))
+app.config['INTENT_ROUTER_THRESHOLDS'] = parse_thresholds(os.getenv('INTENT_ROUTER_THRESHOLDS', ''))
+
+# Directory of knowledge documents (one PDF per topic, or .txt/.md); the school PDF is used if it's empty.
+# Up to KNOWLEDGE_MAX_DOCUMENTS matching documents are used per question, and changed documents
+# are picked up without a restart (checked every KNOWLEDGE_RELOAD_INTERVAL seconds, 0 disables)
+app.config['KNOWLEDGE_DIR'] = os.getenv('KNOWLEDGE_DIR', knowledge_base.DEFAULT_KNOWLEDGE_DIR)
+app.config['KNOWLEDGE_MAX_DOCUMENTS'] = int(os.getenv('KNOWLEDGE_MAX_DOCUMENTS', '2'))
+app.config['KNOWLEDGE_RELOAD_INTERVAL'] = float(os.getenv('KNOWLEDGE_RELOAD_INTERVAL', '30'))
+
+# Structured tables extracted from the PDF: matching rows are added as grounding and
+# lookups at or above the threshold are answered from a template without a model call
+app.config['KNOWLEDGE_TABLES'] = os.getenv('KNOWLEDGE_TABLES', '1') == '1'
+app.config['KNOWLEDGE_ANSWER_THRESHOLD'] = float(os.getenv('KNOWLEDGE_ANSWER_THRESHOLD', '0.9'))
+
+# Model calls running at once per process, and how many more may wait (and for how long, in seconds)
+# before requests are turned away with 429/503 and a Retry-After header
+app.config['GENERATION_MAX_CONCURRENCY'] = int(os.getenv('GENERATION_MAX_CONCURRENCY', '8'))
+app.config['GENERATION_MAX_QUEUE'] = int(os.getenv('GENERATION_MAX_QUEUE', '32'))
+app.config['GENERATION_QUEUE_TIMEOUT'] = float(os.getenv('GENERATION_QUEUE_TIMEOUT', '10'))
+
+# Waiting model calls take turns per user (weighted by kind of caller), and one user may hold
+# at most GENERATION_MAX_QUEUE_PER_USER places in the queue
+app.config['FAIR_QUEUE_WEIGHTS'] = parse_weights(os.getenv('FAIR_QUEUE_WEIGHTS', 'user:1,anonymous:0.5,batch:0.25'))
+app.config['GENERATION_MAX_QUEUE_PER_USER'] = int(os.getenv('GENERATION_MAX_QUEUE_PER_USER', '4'))
+
+# Per-user budgets for messages and model tokens, keyed by login email (or the session when anonymous):
+# 'sqlite' (shared by workers), 'memory' (per process) or 'off'; a limit of 0 is disabled
+app.config['RATE_LIMITS'] = os.getenv('RATE_LIMITS', 'sqlite')
+app.config['RATE_LIMIT_REQUESTS_PER_MINUTE'] = int(os.getenv('RATE_LIMIT_REQUESTS_PER_MINUTE', '10'))
+app.config['RATE_LIMIT_REQUESTS_PER_DAY'] = int(os.getenv('RATE_LIMIT_REQUESTS_PER_DAY', '300'))
+app.config['RATE_LIMIT_TOKENS_PER_MINUTE'] = int(os.getenv('RATE_LIMIT_TOKENS_PER_MINUTE', '60000'))
+app.config['RATE_LIMIT_TOKENS_PER_DAY'] = int(os.getenv('RATE_LIMIT_TOKENS_PER_DAY', '600000'))
+
+# Coalesce identical in-flight model calls: 'sqlite' (across workers), 'memory' (per process) or 'off'
+app.config['COALESCE_REQUESTS'] = os.getenv('COALESCE_REQUESTS', 'sqlite')
+app.config['COALESCE_WAIT_TIMEOUT'] = float(os.getenv('COALESCE_WAIT_TIMEOUT', '60'))
+
+# Model call deadline (seconds), retries for rate limits/timeouts/5xx, and optional hedged second requests
+app.config['UPSTREAM_TIMEOUT'] = float(os.getenv('UPSTREAM_TIMEOUT', '30'))
+app.config['UPSTREAM_RETRIES'] = int(os.getenv('UPSTREAM_RETRIES', '2'))
+app.config['HEDGE_REQUESTS'] = os.getenv('HEDGE_REQUESTS', '0') == '1'
+
+# Circuit breaker: stop calling the model after this many consecutive failures, probe again after the timeout
+app.config['CIRCUIT_FAILURE_THRESHOLD'] = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+app.config['CIRCUIT_RESET_TIMEOUT'] = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+# While the model is unreachable, answer with the best-matching PDF passage and the school's contacts
+app.config['DEGRADED_ANSWERS'] = os.getenv('DEGRADED_ANSWERS', '1') == '1'
+
+# Batch answering (/send_messages): allowed for these admin emails or with the bearer token
+app.config['ADMIN_EMAILS'] = {e.strip().lower() for e in os.getenv('ADMIN_EMAILS', '').split(',') if e.strip()}
+app.config['BATCH_API_TOKEN'] = os.getenv('BATCH_API_TOKEN')
+app.config['BATCH_MAX_QUESTIONS'] = int(os.getenv('BATCH_MAX_QUESTIONS', '500'))
+app.config['BATCH_MAX_CONCURRENCY'] = int(os.getenv('BATCH_MAX_CONCURRENCY', '4'))
+
+# Optional bearer token required to read /metrics
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+
+# Seconds Google's OpenID discovery document is reused from DATA_DIR before fetching it again
+app.config['OIDC_DISCOVERY_TTL'] = float(os.getenv('OIDC_DISCOVERY_TTL', str(24 * 3600)))
+
+# OAuth Configuration (the client is created on first login so public pages never import authlib)
+GOOGLE_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+oauth_client = None
+oauth_lock = threading.Lock()
+
+
+def get_oauth_client():
+    """Google OAuth client, using the cached discovery document when it is fresh"""
+    global oauth_client
+    if oauth_client is None:
+        with oauth_lock:
+            if oauth_client is None:
+                from authlib.integrations.flask_client import OAuth
+
+                metadata = oidc_discovery.load_metadata(
+                    GOOGLE_DISCOVERY_URL, os.path.join(app.config['DATA_DIR'], 'oidc_google.json'),
+                    ttl=app.config['OIDC_DISCOVERY_TTL'])
+                # Marked as loaded, so authlib doesn't fetch the document again
+                server_metadata = dict(metadata, _loaded_at=time.time()) if metadata else {}
+                oauth = OAuth(app)
+                oauth_client = oauth.register(
+                    name='google',
+                    client_id=os.getenv('GOOGLE_CLIENT_ID'),
+                    client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
+                    server_metadata_url=GOOGLE_DISCOVERY_URL,
+                    client_kwargs={
+                        'scope': 'openid email profile'
+                    },
+                    **server_metadata
+                )
+    return oauth_client
+
+# Store conversation histories per session (idle sessions expire with the login session)
+history_store = create_history_store(app.config['HISTORY_STORE'], app.config['DATA_DIR'],
+                                     idle_ttl=app.config['PERMANENT_SESSION_LIFETIME'],
+                                     max_sessions=app.config['HISTORY_MAX_SESSIONS'],
+                                     max_bytes=app.config['HISTORY_MAX_BYTES'])
+
+# Every conversation of a logged-in user, kept after the session ends so it can be resumed
+conversation_store = create_conversation_store(app.config['CONVERSATION_STORE'], app.config['DATA_DIR'])
 
 
 def login_required(f):
@@ -61,9 +228,269 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def has_bearer_token(token):
+    """Whether the request's Authorization header carries token (constant-time comparison)"""
+    header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(header.encode('utf-8'), f"Bearer {token}".encode('utf-8'))
+
+
+def is_admin():
+    """Whether the request comes from an admin session or carries the batch API token"""
+    token = app.config['BATCH_API_TOKEN']
+    if token and has_bearer_token(token):
+        return True
+    email = (session.get('user') or {}).get('email', '').lower()
+    return bool(email) and email in app.config['ADMIN_EMAILS']
+
+
+def admin_required(f):
+    """Decorator to restrict routes to admins"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_admin():
+            return jsonify({"error": "Admin access required"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Path to your PDF file (adjust as needed)
 import sys
 PDF_FILE_PATH = os.path.join(os.path.dirname(__file__), 'Lagro High School - Data .pdf')
+# Committed knowledge index, read only; runtime reindexing writes to DATA_DIR instead
+KNOWLEDGE_INDEX_DIR = os.path.join(os.path.dirname(__file__), 'index', 'knowledge')
+KNOWLEDGE_DB_PATH = os.path.join(os.path.dirname(__file__), 'index', 'knowledge.sqlite3')
+
+GEMINI_MODEL_NAME = 'models/gemini-2.5-flash'
+
+
+
+def record_resilience_event(kind, value):
+    """Export retries, hedges and breaker transitions from the resilient model wrapper"""
+    if kind == 'retry':
+        UPSTREAM_RETRIES.inc(reason=value)
+    elif kind == 'hedge':
+        HEDGED_REQUESTS.inc(result=value)
+    elif kind == 'breaker':
+        CIRCUIT_TRANSITIONS.inc(state=value)
+    elif kind == 'replay':
+        REPLAY_LOOKUPS.inc(result=value)
+
+
+def record_prefetch_event(kind, value, amount=1):
+    """Export prefetch results and the tokens prefetches spent, and later used or wasted"""
+    if kind == 'prefetch':
+        PREFETCHES.inc(result=value)
+    elif kind == 'prefetch_tokens':
+        PREFETCH_TOKENS.inc(amount, outcome=value)
+
+
+# Recording sits inside the retries, so each attempt (and its failure) is replayed as it happened
+traffic_recorder = TrafficRecorder(app.config['MODEL_RECORD']) if app.config['MODEL_RECORD'] else None
+upstream_backend = create_model_backend(app.config['MODEL_BACKEND'], GEMINI_MODEL_NAME, api_key,
+                                        listener=record_resilience_event)
+if traffic_recorder is not None:
+    logger.warning(f"Recording model traffic to {app.config['MODEL_RECORD']}")
+    upstream_backend = RecordingBackend(upstream_backend, traffic_recorder)
+
+# Deadlines, retries and a circuit breaker around every model call
+model_backend = ResilientModel(
+    upstream_backend,
+    timeout=app.config['UPSTREAM_TIMEOUT'],
+    retries=app.config['UPSTREAM_RETRIES'],
+    hedge=app.config['HEDGE_REQUESTS'],
+    breaker=CircuitBreaker(app.config['CIRCUIT_FAILURE_THRESHOLD'], app.config['CIRCUIT_RESET_TIMEOUT'],
+                           listener=record_resilience_event),
+    listener=record_resilience_event
+)
+
+# Caps concurrent model calls so bursts queue briefly or get a fast 429/503 instead of hitting the API limit
+generation_scheduler = GenerationScheduler(app.config['GENERATION_MAX_CONCURRENCY'],
+                                           app.config['GENERATION_MAX_QUEUE'],
+                                           app.config['GENERATION_QUEUE_TIMEOUT'],
+                                           app.config['GENERATION_MAX_QUEUE_PER_USER'])
+
+# Per-user request and token budgets, so one user can't spend everyone's Gemini quota
+rate_limiter = create_rate_limiter(app.config['RATE_LIMITS'], app.config['DATA_DIR'], Limits(
+    app.config['RATE_LIMIT_REQUESTS_PER_MINUTE'], app.config['RATE_LIMIT_REQUESTS_PER_DAY'],
+    app.config['RATE_LIMIT_TOKENS_PER_MINUTE'], app.config['RATE_LIMIT_TOKENS_PER_DAY']))
+# Identity batch questions are queued (and their tokens counted) under
+BATCH_IDENTITY = 'batch'
+# Identity whose token usage counts prefetched follow-up answers
+PREFETCH_IDENTITY = 'prefetch'
+
+# Uploaded document handles, shared by all workers and reused until shortly before they expire
+file_handle_store = FileHandleStore(os.path.join(
+    app.config['DATA_DIR'],
+    'file_handles.sqlite3' if model_backend.name == 'gemini' else f'file_handles_{model_backend.name}.sqlite3'
+))
+document_handles = {}
+document_handles_lock = threading.Lock()
+
+# Identical requests in flight at the same time (e.g. right after an announcement) share one model call
+single_flight = create_single_flight(app.config['COALESCE_REQUESTS'], app.config['DATA_DIR'],
+                                     app.config['COALESCE_WAIT_TIMEOUT'])
+
+# Answers to context-free first-turn questions
+answer_cache = create_answer_cache(app.config['ANSWER_CACHE'], app.config['DATA_DIR'],
+                                   app.config['ANSWER_CACHE_SIZE'], app.config['ANSWER_CACHE_TTL'])
+answer_fingerprint = None
+
+# Canned replies for greetings, feedback and out-of-scope questions, answered without a model call
+intent_router = None
+if app.config['INTENT_ROUTER'] in ('on', 'shadow'):
+    intent_router = IntentRouter(app.config['INTENT_ROUTER_THRESHOLD'], app.config['INTENT_ROUTER_THRESHOLDS'])
+
+# Per-process metrics, exposed on /metrics
+REQUEST_LATENCY = metrics.REGISTRY.histogram(
+    'ask_lagronian_request_latency_ms', 'End-to-end request latency in milliseconds', ['endpoint', 'status'])
+STAGE_LATENCY = metrics.REGISTRY.histogram(
+    'ask_lagronian_stage_latency_ms', 'Latency of hot-path stages in milliseconds', ['stage'])
+TIME_TO_FIRST_TOKEN = metrics.REGISTRY.histogram(
+    'ask_lagronian_time_to_first_token_ms', 'Time from request start to the first streamed chunk')
+PROMPT_TOKENS = metrics.REGISTRY.histogram(
+    'ask_lagronian_prompt_tokens', 'Prompt tokens per model call', buckets=metrics.TOKEN_BUCKETS)
+RESPONSE_TOKENS = metrics.REGISTRY.histogram(
+    'ask_lagronian_response_tokens', 'Response tokens per model call', buckets=metrics.TOKEN_BUCKETS)
+ANSWER_CACHE_LOOKUPS = metrics.REGISTRY.counter(
+    'ask_lagronian_answer_cache_lookups_total', 'Answer cache lookups by result', ['result'])
+KNOWLEDGE_LOOKUPS = metrics.REGISTRY.counter(
+    'ask_lagronian_knowledge_lookups_total', 'Knowledge table lookups by table and result', ['table', 'result'])
+INTENT_ROUTES = metrics.REGISTRY.counter(
+    'ask_lagronian_intent_routes_total', 'Messages the intent router answered (or would answer in shadow mode)',
+    ['intent', 'source', 'mode'])
+IN_FLIGHT_REQUESTS = metrics.REGISTRY.gauge(
+    'ask_lagronian_in_flight_requests', 'Chat requests currently being processed')
+GENERATION_QUEUE_WAIT = metrics.REGISTRY.histogram(
+    'ask_lagronian_generation_queue_wait_ms', 'Time spent waiting for a generation slot in milliseconds')
+KNOWLEDGE_DOCUMENTS_SELECTED = metrics.REGISTRY.counter(
+    'ask_lagronian_knowledge_documents_selected_total', 'Knowledge documents used to answer a question', ['document'])
+KNOWLEDGE_RELOADS = metrics.REGISTRY.counter(
+    'ask_lagronian_knowledge_reloads_total', 'Knowledge base loads and hot reloads by result', ['result'])
+COALESCED_REQUESTS = metrics.REGISTRY.counter(
+    'ask_lagronian_coalesced_requests_total', 'Model requests by single-flight role', ['role'])
+UPSTREAM_RETRIES = metrics.REGISTRY.counter(
+    'ask_lagronian_upstream_retries_total', 'Model calls retried, by error type', ['reason'])
+HEDGED_REQUESTS = metrics.REGISTRY.counter(
+    'ask_lagronian_hedged_requests_total', 'Hedged second model requests launched and won', ['result'])
+CIRCUIT_TRANSITIONS = metrics.REGISTRY.counter(
+    'ask_lagronian_circuit_breaker_transitions_total', 'Circuit breaker state changes', ['state'])
+REPLAY_LOOKUPS = metrics.REGISTRY.counter(
+    'ask_lagronian_replay_lookups_total', 'Replayed model calls by how they matched a recording', ['result'])
+DEGRADED_ANSWERS = metrics.REGISTRY.counter(
+    'ask_lagronian_degraded_answers_total', 'Local fallback answers served instead of an error', ['reason'])
+RATE_LIMITED_REQUESTS = metrics.REGISTRY.counter(
+    'ask_lagronian_rate_limited_requests_total', 'Messages refused by a per-user budget', ['bucket'])
+GENERATION_REJECTIONS = metrics.REGISTRY.counter(
+    'ask_lagronian_generation_rejections_total', 'Requests turned away before reaching the model', ['reason'])
+SUGGESTION_CLICKS = metrics.REGISTRY.counter(
+    'ask_lagronian_suggestion_clicks_total', 'Suggested follow-ups sent by students, by how they were answered',
+    ['result'])
+PREFETCHES = metrics.REGISTRY.counter(
+    'ask_lagronian_prefetches_total', 'Suggested follow-ups queued for prefetching, by result', ['result'])
+PREFETCH_TOKENS = metrics.REGISTRY.counter(
+    'ask_lagronian_prefetch_tokens_total', 'Model tokens of prefetched answers, spent and later used or wasted',
+    ['outcome'])
+
+metrics.REGISTRY.gauge('ask_lagronian_coalescing_ratio', 'Share of model requests answered by another request\'s call',
+                        function=lambda: single_flight.stats()['coalescing_ratio'] if single_flight else 0)
+metrics.REGISTRY.gauge('ask_lagronian_circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)',
+                        function=lambda: STATE_VALUES[model_backend.breaker.state])
+metrics.REGISTRY.gauge('ask_lagronian_generation_queue_depth', 'Requests waiting for a generation slot',
+                        function=lambda: generation_scheduler.stats()['queued'])
+metrics.REGISTRY.gauge('ask_lagronian_generation_active', 'Model calls currently running',
+                        function=lambda: generation_scheduler.stats()['active'])
+
+metrics.REGISTRY.gauge('ask_lagronian_knowledge_documents', 'Documents in the loaded knowledge base',
+                        function=lambda: len(knowledge_loader.current.documents) if knowledge_loader.current else 0)
+metrics.REGISTRY.gauge('ask_lagronian_history_sessions', 'Sessions held by the history store',
+                        function=lambda: history_store.stats().get('sessions', 0))
+metrics.REGISTRY.gauge('ask_lagronian_history_resident_bytes', 'Approximate bytes held by the in-memory history store',
+                        function=lambda: history_store.stats().get('resident_bytes', 0))
+metrics.REGISTRY.gauge('ask_lagronian_saved_conversations', 'Conversations kept by the conversation store',
+                        function=lambda: conversation_store.stats().get('conversations', 0) if conversation_store else 0)
+metrics.REGISTRY.gauge('ask_lagronian_answer_cache_hit_ratio', 'Answer cache hit ratio since startup',
+                        function=lambda: answer_cache.stats()['hit_rate'] if answer_cache else 0)
+metrics.REGISTRY.gauge('ask_lagronian_prefetch_hit_ratio', 'Share of finished prefetches that were clicked in time',
+                        function=lambda: prefetcher.stats()['hit_rate'] if prefetcher else 0)
+
+# Endpoints that get a per-request trace and structured log record
+TRACED_ENDPOINTS = {'send_message', 'clear_history'}
+
+
+def trace_stage(name):
+    """Time a hot-path stage of the current request (no-op outside traced requests)"""
+    trace = g.get('trace') if has_request_context() else None
+    return trace.stage(name) if trace is not None else nullcontext()
+
+
+def trace_field(name, value):
+    """Attach a field to the current request's log record"""
+    trace = g.get('trace') if has_request_context() else None
+    if trace is not None:
+        trace.fields[name] = value
+
+
+def current_rate_identity():
+    """Rate identity of the current request, or None outside one"""
+    return g.get('rate_identity') if has_request_context() else None
+
+
+def record_usage(response):
+    """Record Gemini's token usage for the current request"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    trace_field('prompt_tokens', usage.prompt_token_count)
+    trace_field('response_tokens', usage.candidates_token_count)
+    identity = current_rate_identity()
+    if identity is not None:
+        charge_tokens(identity, response)
+
+
+def current_user_email():
+    """Logged-in user's email (lowercased), or None"""
+    email = (session.get('user') or {}).get('email')
+    return email.lower() if email else None
+
+
+def request_identity():
+    """Who a request counts against: the logged-in user's email, else the anonymous session"""
+    email = current_user_email()
+    if email:
+        return f"user:{email}"
+    return f"anonymous:{get_session_id()}"
+
+
+def identity_weight(identity):
+    """Fair-queue weight for an identity, by its kind (user, anonymous or batch)"""
+    return app.config['FAIR_QUEUE_WEIGHTS'].get(identity.partition(':')[0], 1.0)
+
+
+def check_rate_limit(identity):
+    """Spend one message from the identity's budget; raises RateLimited when it is used up"""
+    g.rate_identity = identity
+    if rate_limiter is None:
+        return
+    try:
+        with trace_stage('rate_limit'):
+            rate_limiter.take(identity)
+    except RateLimited as e:
+        RATE_LIMITED_REQUESTS.inc(bucket=e.bucket)
+        trace_field('rate_limited', e.bucket)
+        raise
+    except sqlite3.Error as e:
+        # A broken store shouldn't lock everyone out
+        logger.warning(f"Rate limit store unavailable, not limiting: {str(e)}")
+
+
+def charge_tokens(identity, response):
+    """Charge a model call's prompt and response tokens to the identity's token budget"""
+    usage = getattr(response, 'usage_metadata', None)
+    if rate_limiter is None or usage is None:
+        return
+    try:
+        rate_limiter.charge(identity, (usage.prompt_token_count or 0) + (usage.candidates_token_count or 0))
+    except sqlite3.Error as e:
+        logger.warning(f"Could not charge tokens to {identity}: {str(e)}")
 
 # System instruction for the chatbot
 SYSTEM_INSTRUCTION = """
@@ -349,30 +776,52 @@ Track specific user details mentioned earlier:
 - When in doubt about what the user is asking, reference the most recent clear question
 """
 
-# Sample conversations for the right panel
-sample_conversations = [
-    {"title": "About STEM strand", "timestamp": "10:30 AM"},
-    {"title": "Enrollment requirements", "timestamp": "Yesterday"},
-    {"title": "Grading system", "timestamp": "2 days ago"},
-]
 
 
-def get_initial_contents():
-    """Load initial contents including the PDF file"""
+def extract_contact_lines(text):
+    """Official website, telephone and email lines from the system instruction"""
+    lines = []
+    for label in ("Official Website", "Telephone", "Email Address"):
+        match = re.search(rf"{label}\**:\s*(\S.*)", text)
+        if match:
+            lines.append(f"{label}: {match.group(1).strip()}")
+    return lines
+
+
+# Official contacts, repeated in answers given while the model is unavailable
+CONTACT_LINES = extract_contact_lines(SYSTEM_INSTRUCTION)
+
+def get_document_handle(document):
+    """Upload manager for one knowledge document, keyed by content so an edited file gets a new upload"""
+    key = (document["path"], document["sha256"])
+    handles = document_handles.get(key)
+    if handles is None:
+        with document_handles_lock:
+            handles = document_handles.get(key)
+            if handles is None:
+                handles = FileHandleManager(document["path"], file_handle_store, mime_type=document["mime_type"],
+                                            upload=model_backend.upload_file)
+                document_handles[key] = handles
+    return handles
+
+
+def get_initial_contents(documents=None):
+    """Load initial contents attaching the knowledge documents (all of them unless some are selected)"""
     try:
-        if os.path.exists(PDF_FILE_PATH):
-            logger.info(f"Loading PDF file: {PDF_FILE_PATH}")
-            # Upload the PDF file to Gemini
-            uploaded_file = genai.upload_file(PDF_FILE_PATH)
-            logger.info(f"PDF file uploaded successfully: {uploaded_file.uri}")
+        corpus = get_knowledge_base()
+        names = documents or list(corpus.documents)
+        if names:
+            # Reuse the shared uploads; only the first caller after a change or expiry uploads again
+            with trace_stage('pdf_upload'):
+                uploaded_files = [get_document_handle(corpus.documents[name]).get() for name in names]
 
             return [
                 {
                     "role": "user",
                     "parts": [
-                        {"file_data": {"mime_type": uploaded_file.mime_type, "file_uri": uploaded_file.uri}},
-                        {"text": "Hi"}
-                    ]
+                        {"file_data": {"mime_type": uploaded_file["mime_type"], "file_uri": uploaded_file["uri"]}}
+                        for uploaded_file in uploaded_files
+                    ] + [{"text": "Hi"}]
                 },
                 {
                     "role": "model",
@@ -381,15 +830,242 @@ def get_initial_contents():
                 }
             ]
         else:
-            logger.warning(f"PDF file not found at {PDF_FILE_PATH}. Starting without PDF context.")
+            logger.warning(f"No knowledge documents in {app.config['KNOWLEDGE_DIR']} or at {PDF_FILE_PATH}. "
+                           f"Starting without PDF context.")
             return []
     except Exception as e:
         logger.error(f"Error loading initial contents: {str(e)}")
         return []
 
 
-# Initialize contents (will be loaded on first request if needed)
-initial_contents = []
+def on_knowledge_event(kind, value):
+    """Count knowledge base reloads; a new version also changes the answer cache fingerprint"""
+    global answer_fingerprint
+    if kind == 'reload':
+        answer_fingerprint = None
+        KNOWLEDGE_RELOADS.inc(result='ok')
+        with document_handles_lock:
+            for key in [key for key in document_handles if key[1] not in value.passages_by_hash]:
+                del document_handles[key]
+    else:
+        KNOWLEDGE_RELOADS.inc(result='error')
+
+
+# Passages of every knowledge document (loaded on first request, swapped when documents change)
+knowledge_loader = knowledge_base.KnowledgeBaseLoader(
+    app.config['KNOWLEDGE_DIR'], os.path.join(app.config['DATA_DIR'], 'knowledge_index'), PDF_FILE_PATH,
+    check_interval=app.config['KNOWLEDGE_RELOAD_INTERVAL'], listener=on_knowledge_event,
+    seed_dir=KNOWLEDGE_INDEX_DIR)
+
+
+def get_knowledge_base():
+    """Current knowledge base, built by knowledge_base.py (and rebuilt here for changed documents)"""
+    return knowledge_loader.get()
+
+
+def retrieval_query(query, conversation_history):
+    """The normalized message plus the previous user turn, so follow-ups like "how about grade 12?" still match"""
+    query = normalize(query)
+    previous_user = [m.content for m in conversation_history if m.role == "user"][-1:]
+    if previous_user:
+        return normalize(previous_user[0]) + query
+    return query
+
+
+def record_selected_documents(names):
+    for name in names:
+        KNOWLEDGE_DOCUMENTS_SELECTED.inc(document=name)
+    trace_field('documents', names)
+
+
+def select_documents(query, conversation_history):
+    """Names of the knowledge documents to attach in whole-file mode (None attaches all of them)"""
+    corpus = get_knowledge_base()
+    if len(corpus.documents) <= 1:
+        return None
+    with trace_stage('retrieval'):
+        names = corpus.select(retrieval_query(query, conversation_history),
+                                       app.config['KNOWLEDGE_MAX_DOCUMENTS'])
+    record_selected_documents(names)
+    return names or None
+
+
+def get_retrieval_contents(query, conversation_history):
+    """Build grounding contents from the passages most relevant to the message"""
+    corpus = get_knowledge_base()
+    if not corpus.documents:
+        return None
+
+    with trace_stage('retrieval'):
+        names, results = corpus.retrieve(retrieval_query(query, conversation_history),
+                                                  app.config['RETRIEVAL_TOP_K'], app.config['KNOWLEDGE_MAX_DOCUMENTS'])
+    record_selected_documents(names)
+    if not results:
+        passages_text = "No matching passages were found in the school data file."
+    else:
+        passages_text = retrieval.format_passages(results, show_document=len(corpus.documents) > 1)
+
+    return [
+        {
+            "role": "user",
+            "parts": [{"text": f"Relevant excerpts from the Lagro High School data PDF:\n\n{passages_text}"}]
+        },
+        {
+            "role": "model",
+            "parts": [{"text": "Got it! I'll answer using these excerpts from the school's PDF."}]
+        }
+    ]
+
+
+def degraded_answer(user_message, reason):
+    """Local answer for when the model can't be reached: closest PDF passage plus official contacts"""
+    if not app.config['DEGRADED_ANSWERS']:
+        return None
+    try:
+        corpus = get_knowledge_base()
+        results = corpus.retrieve(user_message, 1)[1]
+    except Exception as e:
+        logger.error(f"Degraded answer without retrieval: {str(e)}")
+        results = []
+
+    lines = ["⚠️ I can't reach my AI service right now, so here is the closest match from the school's information file:", '']
+    if results:
+        passage = results[0][1]
+        lines.append(f"📄 ({retrieval.passage_source(passage, len(corpus.documents) > 1)}) {passage['text']}")
+    else:
+        lines.append("📄 I couldn't find a matching section for your question.")
+    lines.append('')
+    lines.append("For the most accurate information, please contact Lagro High School:")
+    lines.extend(f"• {line}" for line in CONTACT_LINES)
+    DEGRADED_ANSWERS.inc(reason=reason)
+    trace_field('degraded', reason)
+    return '\n'.join(lines)
+
+
+def degraded_reason(error):
+    """Why a failed model call may be answered locally, or None if it should fail normally"""
+    if isinstance(error, CircuitOpen):
+        return 'circuit_open'
+    if isinstance(error, FlightFailed):
+        return 'coalesced_failure'
+    if is_retryable(error):
+        return 'upstream_error'
+    return None
+
+
+# Structured knowledge tables (opened on first request if needed)
+knowledge = None
+knowledge_lock = threading.Lock()
+
+
+def get_knowledge_tables():
+    """Open the tables built by knowledge_tables.py, rebuilding them if the PDF changed"""
+    global knowledge
+    if knowledge is None and app.config['KNOWLEDGE_TABLES']:
+        with knowledge_lock:
+            if knowledge is None:
+                knowledge = knowledge_tables.load_tables(
+                    KNOWLEDGE_DB_PATH, PDF_FILE_PATH,
+                    fallback_path=os.path.join(app.config['DATA_DIR'], 'knowledge.sqlite3'))
+    return knowledge
+
+
+def lookup_knowledge(user_message, conversation_history):
+    """Rows of the knowledge tables that answer the message, or None"""
+    try:
+        tables = get_knowledge_tables()
+    except Exception as e:
+        logger.error(f"Knowledge tables unavailable: {str(e)}")
+        return None
+    if tables is None:
+        return None
+
+    previous_user = [m.content for m in conversation_history if m.role == "user"][-1:]
+    with trace_stage('knowledge_lookup'):
+        lookup = tables.lookup(user_message, previous_user[0] if previous_user else None)
+    if lookup is None:
+        KNOWLEDGE_LOOKUPS.inc(table='none', result='miss')
+        return None
+
+    answered = lookup.answer is not None and lookup.confidence >= app.config['KNOWLEDGE_ANSWER_THRESHOLD']
+    KNOWLEDGE_LOOKUPS.inc(table=lookup.table, result='answer' if answered else 'grounding')
+    trace_field('knowledge', lookup.table)
+    if not answered:
+        lookup.answer = None
+    return lookup
+
+
+def summarize_history(previous_summary, messages, identity=None):
+    """Fold older turns into the running conversation summary (runs in the background)
+
+    identity is the rate identity of the request that scheduled the refresh; the call
+    queues in that user's flow and its tokens count against their budget.
+    """
+    transcript = '\n'.join(
+        f"{'Student' if m.role == 'user' else 'Ask Lagronian'}: {m.content}" for m in messages
+    )
+    prompt = (
+        "Update the running summary of this Lagro High School chatbot conversation in at most 80 words. "
+        "Keep the student's name, grade level, strand, and the topics and open questions discussed. "
+        "Reply with the summary only.\n\n"
+        f"Current summary: {previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+    )
+    slot = acquire_generation_slot(identity)
+    try:
+        response = model_backend.generate_content(prompt)
+    finally:
+        slot.release()
+    if identity is not None:
+        charge_tokens(identity, response)
+    return response.text.strip()
+
+
+# Running summaries of turns that no longer fit the history token budget
+history_summarizer = (RollingSummarizer(summarize_history, capture=current_rate_identity)
+                      if app.config['HISTORY_SUMMARY_ENABLED'] else None)
+
+
+def build_contents(user_message, conversation_history, session_id=None, grounding=None, query=None):
+    """Assemble the Gemini contents for a turn in the configured context mode"""
+    query = normalize(user_message) if query is None else query
+    contents = None
+    if app.config['CONTEXT_MODE'] == 'retrieval':
+        contents = get_retrieval_contents(query, conversation_history)
+
+    if contents is None:
+        # Whole-file mode: attach the uploaded documents that match the question
+        contents = get_initial_contents(select_documents(query, conversation_history))
+
+    if grounding:
+        # Exact rows from the knowledge tables take precedence over the excerpts
+        contents.append({"role": "user", "parts": [{"text": grounding}]})
+        contents.append({"role": "model", "parts": [{"text": "Got it! I'll use these exact facts in my answer."}]})
+
+    # Recent history within the token budget; older turns and user details as a summary
+    window, context_text, stats = build_history_window(
+        conversation_history, app.config['HISTORY_TOKEN_BUDGET'], history_summarizer, session_id)
+    trace_field('history_tokens_saved', stats['saved_tokens'])
+    if conversation_history:
+        logger.info(f"Session {session_id}: History {stats['history_tokens']} -> {stats['sent_tokens']} tokens "
+                    f"(saved {stats['saved_tokens']}, {stats['folded_messages']} messages summarized)")
+
+    if context_text:
+        contents.append({"role": "user", "parts": [{"text": context_text}]})
+        contents.append({"role": "model", "parts": [{"text": "Noted! I'll keep that context in mind."}]})
+
+    # Add conversation history
+    for hist_msg in window:
+        contents.append({
+            "role": hist_msg.role,
+            "parts": [{"text": hist_msg.content}]
+        })
+
+    # Add current user message
+    contents.append({
+        "role": "user",
+        "parts": [{"text": user_message}]
+    })
+    return contents
 
 
 def get_session_id():
@@ -400,12 +1076,419 @@ def get_session_id():
     return session['session_id']
 
 
+def open_conversation(payload):
+    """Saved conversation a logged-in user's message belongs to, or None for anonymous users
+
+    The client names it with "conversation_id" (null starts a new one); without
+    it the session's current conversation continues.
+    """
+    email = current_user_email()
+    if conversation_store is None or email is None:
+        return None
+    conversation_id = payload['conversation_id'] if 'conversation_id' in payload else session.get('conversation_id')
+    conversation = None
+    if isinstance(conversation_id, str):
+        conversation = conversation_store.get(email, conversation_id)
+    if conversation is None:
+        conversation = conversation_store.create(email)
+        logger.info(f"New conversation {conversation['id']}")
+    session['conversation_id'] = conversation['id']
+    g.conversation_id = conversation['id']
+    return conversation['id']
+
+
 def get_conversation_history(session_id):
     """Get conversation history for a session"""
-    if session_id not in conversation_histories:
-        conversation_histories[session_id] = []
-        logger.info(f"New conversation history created for session: {session_id}")
-    return conversation_histories[session_id]
+    history = history_store.get(session_id)
+    conversation_id = g.get('conversation_id')
+    if not history and conversation_id and conversation_store is not None:
+        # Resuming a saved conversation whose context window expired or lives on another worker
+        history, _ = conversation_store.messages(current_user_email(), conversation_id,
+                                                 app.config['HISTORY_MAX_MESSAGES'])
+        if history:
+            history_store.append(session_id, history, max_messages=app.config['HISTORY_MAX_MESSAGES'])
+    return history
+
+
+def get_answer_cache_key(query, conversation_history):
+    """Cache key for a first-turn question (text or normalized), or None when the answer depends on history"""
+    global answer_fingerprint
+    if answer_cache is None or conversation_history:
+        return None
+    if answer_fingerprint is None:
+        answer_fingerprint = context_fingerprint(get_knowledge_base().version, SYSTEM_INSTRUCTION, GEMINI_MODEL_NAME,
+                                                 app.config['CONTEXT_MODE'], app.config['RETRIEVAL_TOP_K'],
+                                                 app.config['KNOWLEDGE_MAX_DOCUMENTS'])
+    return make_key(query, answer_fingerprint)
+
+
+def route_intent(session_id, query, conversation_history):
+    """Canned reply from the intent router, or None to ask the model"""
+    if intent_router is None:
+        return None
+    with trace_stage('intent_router'):
+        decision = intent_router.route(query, conversation_history)
+    if decision is None:
+        return None
+
+    mode = app.config['INTENT_ROUTER']
+    INTENT_ROUTES.inc(intent=decision.intent, source=decision.source, mode=mode)
+    trace_field('intent', decision.intent)
+    if mode == 'shadow':
+        logger.info(f"Session {session_id}: Intent router would answer '{decision.intent}' "
+                    f"({decision.source}, confidence {decision.confidence:.2f})")
+        return None
+    return decision
+
+
+def acquire_generation_slot(identity=None):
+    """Wait for a generation slot, taking turns with other users; raises Overloaded when the queue is full or too slow"""
+    if identity is None and has_request_context():
+        identity = g.get('rate_identity')
+    try:
+        with trace_stage('queue_wait'):
+            slot = generation_scheduler.acquire(flow=identity,
+                                                weight=identity_weight(identity) if identity else 1.0)
+    except Overloaded as e:
+        GENERATION_REJECTIONS.inc(reason=e.reason)
+        raise
+    GENERATION_QUEUE_WAIT.observe(slot.wait_ms)
+    return slot
+
+
+def join_flight(contents):
+    """Single-flight membership for a model call, or None when coalescing is off"""
+    if single_flight is None:
+        return None
+    with trace_stage('coalesce'):
+        flight = single_flight.join(contents_key(contents, SYSTEM_INSTRUCTION, GEMINI_MODEL_NAME))
+    COALESCED_REQUESTS.inc(role=flight.role)
+    trace_field('coalesced', flight.role)
+    return flight
+
+
+def rate_limited_response(error):
+    """429 for a user who is over their own budget, with a Retry-After header"""
+    wait = f"{error.retry_after} seconds" if error.retry_after < 120 else f"{math.ceil(error.retry_after / 60)} minutes"
+    response = jsonify({
+        "error": f"You're sending messages faster than Ask Lagronian can answer. Please try again in {wait}.",
+        "timestamp": datetime.now().strftime("%H:%M")
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def overloaded_response(retry_after, status=503):
+    """Fast "try again shortly" reply with a Retry-After header"""
+    response = jsonify({
+        "error": "Ask Lagronian is busy helping many students right now. Please try again in a few seconds.",
+        "timestamp": datetime.now().strftime("%H:%M")
+    })
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def wait_for_generation_slot(max_wait=300, identity=None):
+    """Generation slot for background work: waits out rejections instead of failing"""
+    deadline = time.time() + max_wait
+    while True:
+        try:
+            return acquire_generation_slot(identity)
+        except Overloaded as e:
+            if time.time() + e.retry_after > deadline:
+                raise
+            time.sleep(e.retry_after)
+
+
+def answer_batch_question(question, warm_cache=False, refresh=False):
+    """Answer one batch question as a first turn without history; returns (response, source)"""
+    query = normalize(question)
+    cache_key = get_answer_cache_key(query, [])
+    if cache_key and not refresh:
+        cached_response = answer_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response, 'cache'
+
+    lookup = lookup_knowledge(question, [])
+    if lookup is not None and lookup.answer:
+        return lookup.answer, 'knowledge'
+
+    contents = build_contents(question, [], grounding=lookup.grounding() if lookup is not None else None,
+                              query=query)
+
+    def generate():
+        slot = wait_for_generation_slot(identity=BATCH_IDENTITY)
+        try:
+            response = model_backend.generate_content(contents, SYSTEM_INSTRUCTION)
+        finally:
+            slot.release()
+        charge_tokens(BATCH_IDENTITY, response)
+        return response.text
+
+    if single_flight is not None:
+        assistant_response, _ = single_flight.do(contents_key(contents, SYSTEM_INSTRUCTION, GEMINI_MODEL_NAME),
+                                                 generate)
+    else:
+        assistant_response = generate()
+    if warm_cache and cache_key and assistant_response:
+        answer_cache.set(cache_key, assistant_response)
+    return assistant_response, 'model'
+
+
+def prefetch_answer(question):
+    """Answer a suggested follow-up as a first-turn question into the answer cache, using only idle capacity
+
+    Returns (result, cache key, tokens spent) for the Prefetcher.
+    """
+    query = normalize(question)
+    cache_key = get_answer_cache_key(query, [])
+    if answer_cache.contains(cache_key):
+        return 'cached', cache_key, 0
+    lookup = lookup_knowledge(question, [])
+    if lookup is not None and lookup.answer:
+        return 'local', cache_key, 0
+    if model_backend.breaker.state != CLOSED:
+        return 'unavailable', cache_key, 0
+
+    contents = build_contents(question, [], grounding=lookup.grounding() if lookup is not None else None,
+                              query=query)
+    slot = generation_scheduler.try_acquire(app.config['PREFETCH_SPARE_SLOTS'])
+    if slot is None:
+        return 'busy', cache_key, 0
+    try:
+        response = model_backend.generate_content(contents, SYSTEM_INSTRUCTION)
+    finally:
+        slot.release()
+    charge_tokens(PREFETCH_IDENTITY, response)
+    usage = getattr(response, 'usage_metadata', None)
+    tokens = (usage.prompt_token_count or 0) + (usage.candidates_token_count or 0) if usage is not None else 0
+    if not response.text:
+        return 'empty', cache_key, tokens
+    answer_cache.set(cache_key, response.text)
+    return 'generated', cache_key, tokens
+
+
+# Suggested follow-ups answered before they are clicked; they are kept in the answer cache
+prefetcher = None
+if answer_cache is not None and app.config['FOLLOW_UP_SUGGESTIONS'] > 0 and app.config['PREFETCH_FOLLOW_UPS'] > 0:
+    prefetcher = Prefetcher(prefetch_answer,
+                            create_prefetch_ledger(app.config['ANSWER_CACHE'], app.config['DATA_DIR'],
+                                                   app.config['PREFETCH_USE_WINDOW']),
+                            listener=record_prefetch_event)
+
+
+def offer_follow_ups(user_message, conversation_history):
+    """Likely next questions to offer with the reply to user_message; the top ones are prefetched"""
+    if app.config['FOLLOW_UP_SUGGESTIONS'] <= 0:
+        return []
+    with trace_stage('follow_ups'):
+        suggestions = suggest_follow_ups(conversation_history + [Message("user", user_message)],
+                                         app.config['FOLLOW_UP_SUGGESTIONS'])
+    # Kept in the session cookie, so any worker recognises a click on one of them
+    if session.get('suggestions', []) != suggestions:
+        session['suggestions'] = suggestions
+    if prefetcher is not None:
+        for question in suggestions[:app.config['PREFETCH_FOLLOW_UPS']]:
+            prefetcher.submit(question)
+    return suggestions
+
+
+def with_suggestions(reply, suggestions):
+    """Add the suggested follow-ups to a JSON reply or a stream's closing line"""
+    if suggestions:
+        reply["suggestions"] = suggestions
+    return reply
+
+
+def append_exchange(session_id, user_message, assistant_response):
+    """Store a completed user/model exchange in the conversation history"""
+    messages = [Message("user", user_message), Message("model", assistant_response)]
+    # Keep only the last HISTORY_MAX_MESSAGES messages (20 exchanges by default)
+    history_store.append(session_id, messages, max_messages=app.config['HISTORY_MAX_MESSAGES'])
+    conversation_id = g.get('conversation_id') if has_request_context() else None
+    if conversation_id is not None:
+        try:
+            conversation_store.append(conversation_id, messages)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save exchange to conversation {conversation_id}: {str(e)}")
+
+
+# Streamed NDJSON has to reach the browser chunk by chunk, not buffered by a proxy
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def stream_chunk_line(chunks, text, started, session_id):
+    """NDJSON line for a streamed chunk; the first one records the time to first token"""
+    if not chunks:
+        ttft_ms = (time.perf_counter() - started) * 1000
+        TIME_TO_FIRST_TOKEN.observe(ttft_ms)
+        trace_field('ttft_ms', round(ttft_ms, 1))
+        logger.info(f"Session {session_id}: Time to first token {ttft_ms:.0f} ms")
+    chunks.append(text)
+    return json.dumps({"type": "chunk", "text": text}) + "\n"
+
+
+def stream_error_lines(turn, error, chunks):
+    """Closing NDJSON lines for a failed stream: a local answer if nothing was sent yet, else an error"""
+    if turn.flight is not None:
+        turn.flight.fail(error)
+    reason = degraded_reason(error)
+    fallback = degraded_answer(turn.user_message, reason) if reason and not chunks else None
+    if fallback is not None:
+        logger.warning(f"Session {turn.session_id}: Model unavailable ({str(error)}), streaming a local answer")
+        return [json.dumps({"type": "chunk", "text": fallback}) + "\n",
+                json.dumps({"type": "done", "timestamp": datetime.now().strftime("%H:%M"),
+                            "degraded": True}) + "\n"]
+    logger.error(f"Error streaming message: {str(error)}", exc_info=error)
+    return [json.dumps({
+        "type": "error",
+        "error": "Sorry, I encountered an error while processing your request.",
+        "timestamp": datetime.now().strftime("%H:%M")
+    }) + "\n"]
+
+
+def stream_done_line(turn, chunks, started):
+    """Store a finished streamed answer and return the closing NDJSON line"""
+    # Only a finished answer goes into the history
+    assistant_response = ''.join(chunks)
+    if turn.flight is not None:
+        turn.flight.publish(assistant_response)
+    append_exchange(turn.session_id, turn.user_message, assistant_response)
+    if turn.cache_key and assistant_response:
+        answer_cache.set(turn.cache_key, assistant_response)
+    total_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Session {turn.session_id}: Response streamed successfully in {total_ms:.0f} ms")
+    return json.dumps(with_suggestions({"type": "done", "timestamp": datetime.now().strftime("%H:%M")},
+                                       turn.suggestions)) + "\n"
+
+
+def stream_response(turn, slot=None):
+    """Forward Gemini's streamed chunks to the browser as NDJSON lines
+
+    The generation slot is held until the model stream ends or the client goes away.
+    Requests coalesced onto this one receive the finished answer.
+    """
+    trace = g.get('trace')
+    started = trace.started if trace is not None else time.perf_counter()
+
+    def generate():
+        chunks = []
+        try:
+            with trace_stage('generate'):
+                response = model_backend.generate_content(turn.contents, SYSTEM_INSTRUCTION, stream=True)
+                for chunk in response:
+                    text = chunk.text
+                    if not text:
+                        continue
+                    yield stream_chunk_line(chunks, text, started, turn.session_id)
+            record_usage(response)
+        except Exception as e:
+            yield from stream_error_lines(turn, e, chunks)
+            return
+        finally:
+            if slot is not None:
+                slot.release()
+
+        yield stream_done_line(turn, chunks, started)
+
+    streamed = Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                        headers=STREAM_HEADERS)
+    if slot is not None:
+        streamed.call_on_close(slot.release)
+    if turn.flight is not None:
+        # No-op after publish; frees waiting followers if the client left mid-stream
+        streamed.call_on_close(lambda: turn.flight.fail(FlightFailed("The leading request ended early")))
+    return streamed
+
+
+def coalesced_stream_lines(turn, assistant_response=None, error=None):
+    """NDJSON lines for a coalesced follower once the leader's call finished (or failed with error)"""
+    if error is not None:
+        logger.warning(f"Session {turn.session_id}: Coalesced call failed: {str(error)}")
+        fallback = degraded_answer(turn.user_message, 'coalesced_failure')
+        if fallback is not None:
+            return [json.dumps({"type": "chunk", "text": fallback}) + "\n",
+                    json.dumps({"type": "done", "timestamp": datetime.now().strftime("%H:%M"),
+                                "degraded": True}) + "\n"]
+        return [json.dumps({
+            "type": "error",
+            "error": "Sorry, I encountered an error while processing your request.",
+            "timestamp": datetime.now().strftime("%H:%M")
+        }) + "\n"]
+
+    append_exchange(turn.session_id, turn.user_message, assistant_response)
+    logger.info(f"Session {turn.session_id}: Response shared from an identical in-flight request")
+    return [json.dumps({"type": "chunk", "text": assistant_response}) + "\n",
+            json.dumps(with_suggestions({"type": "done", "timestamp": datetime.now().strftime("%H:%M")},
+                                        turn.suggestions)) + "\n"]
+
+
+def stream_coalesced(turn):
+    """Stream another request's answer to a coalesced follower as a single chunk"""
+
+    def generate():
+        try:
+            with trace_stage('coalesce_wait'):
+                assistant_response = turn.flight.wait()
+        except FlightFailed as e:
+            yield from coalesced_stream_lines(turn, error=e)
+            return
+        yield from coalesced_stream_lines(turn, assistant_response)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers=STREAM_HEADERS)
+
+
+def warm_up_documents():
+    """Load the knowledge base and, in whole-file mode, upload (or reuse) every document"""
+    try:
+        corpus = get_knowledge_base()
+        if app.config['CONTEXT_MODE'] == 'file':
+            for document in corpus.documents.values():
+                get_document_handle(document).get()
+    except Exception as e:
+        logger.error(f"Knowledge warm-up failed: {str(e)}")
+
+
+def warm_up():
+    """Prepare PDF context in the background so the first user doesn't wait for it"""
+    threading.Thread(target=warm_up_documents, name='retrieval-warmup', daemon=True).start()
+    if app.config['KNOWLEDGE_TABLES']:
+        threading.Thread(target=get_knowledge_tables, name='knowledge-warmup', daemon=True).start()
+
+
+if app.config['WARM_UP_ON_STARTUP']:
+    warm_up()
+
+
+# Hashed, precompressed static files built by static_assets.py
+asset_manifest = static_assets.AssetManifest()
+
+
+@app.template_global()
+def asset_url(filename):
+    """Hashed URL for a static file, or the plain /static URL if it hasn't been built"""
+    return asset_manifest.url(filename) or url_for('static', filename=filename)
+
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """Serve a fingerprinted static file, precompressed when the client accepts it"""
+    entry = asset_manifest.hashed_entry(filename)
+    if entry is None:
+        return jsonify({"error": "Resource not found"}), 404
+    encoding = static_assets.choose_encoding(request.accept_encodings, entry['encodings'])
+    suffix = static_assets.ENCODING_SUFFIXES[encoding] if encoding else ''
+    response = send_from_directory(asset_manifest.dist_dir, filename + suffix,
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    # The name changes whenever the content does
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 
 @app.route('/')
@@ -418,14 +1501,14 @@ def home():
 def login():
     """Login page"""
     redirect_uri = url_for('authorize', _external=True)
-    return google.authorize_redirect(redirect_uri)
+    return get_oauth_client().authorize_redirect(redirect_uri)
 
 
 @app.route('/authorize')
 def authorize():
     """OAuth callback"""
     try:
-        token = google.authorize_access_token()
+        token = get_oauth_client().authorize_access_token()
         user_info = token.get('userinfo')
 
         if user_info:
@@ -449,6 +1532,7 @@ def logout():
     """Logout user"""
     session.pop('user', None)
     session.pop('session_id', None)
+    session.pop('conversation_id', None)
     logger.info("User logged out")
     return redirect(url_for('home'))
 
@@ -458,113 +1542,462 @@ def logout():
 def chatbot():
     """Protected chatbot page - requires login"""
     return render_template('chatbot.html',
-                         conversations=sample_conversations,
+                         conversations_enabled=conversation_store is not None,
                          user=session.get('user'))
 
 
-@app.route('/send_message', methods=['POST'])
-def send_message():
-    try:
-        # Input validation
-        if not request.json:
-            logger.warning("Request with no JSON data")
-            return jsonify({"error": "Invalid request format"}), 400
-
-        user_message = request.json.get('message', '').strip()
-
-        if not user_message:
-            logger.warning("Empty message received")
-            return jsonify({"error": "Empty message"}), 400
-
-        # Check message length (prevent abuse)
-        if len(user_message) > 2000:
-            logger.warning(f"Message too long: {len(user_message)} characters")
-            return jsonify({"error": "Message too long. Please keep it under 2000 characters."}), 400
-
-        # Get session and conversation history
-        session_id = get_session_id()
-        conversation_history = get_conversation_history(session_id)
-
-        logger.info(f"Session {session_id}: Processing message of {len(user_message)} characters")
-
-        # Initialize PDF content if not already loaded
-        global initial_contents
-        if not initial_contents:
-            initial_contents = get_initial_contents()
-
-        # Build conversation contents with history
-        contents = initial_contents.copy() if initial_contents else []
-
-        # Add conversation history
-        for hist_msg in conversation_history:
-            contents.append({
-                "role": hist_msg["role"],
-                "parts": [{"text": hist_msg["content"]}]
-            })
-
-        # Add current user message
-        contents.append({
-            "role": "user",
-            "parts": [{"text": user_message}]
+class PendingTurn:
+    """A message that needs a model call, between prepare_turn() and the reply
+
+    Shared by the threaded /send_message view and the async endpoint in asgi.py.
+    """
+    __slots__ = ('session_id', 'user_message', 'contents', 'cache_key', 'flight', 'streaming', 'suggestions')
+
+    def __init__(self, session_id, user_message, contents, cache_key, flight, streaming, suggestions=()):
+        self.session_id = session_id
+        self.user_message = user_message
+        self.contents = contents
+        self.cache_key = cache_key
+        self.flight = flight
+        self.streaming = streaming
+        self.suggestions = suggestions
+
+
+def prepare_turn():
+    """Everything before the model call for the current /send_message request
+
+    Returns the reply when the message is answered without the model (invalid
+    input, canned reply, knowledge table, answer cache), else a PendingTurn.
+    Raises RateLimited, and CircuitOpen while the model is known to be down.
+    """
+    # Input validation
+    if not request.json:
+        logger.warning("Request with no JSON data")
+        return jsonify({"error": "Invalid request format"}), 400
+
+    user_message = request.json.get('message', '').strip()
+
+    if not user_message:
+        logger.warning("Empty message received")
+        return jsonify({"error": "Empty message"}), 400
+
+    # Check message length (prevent abuse)
+    if len(user_message) > 2000:
+        logger.warning(f"Message too long: {len(user_message)} characters")
+        return jsonify({"error": "Message too long. Please keep it under 2000 characters."}), 400
+
+    # Get session and conversation history; a logged-in user's history follows their saved conversation
+    session_id = get_session_id()
+    check_rate_limit(request_identity())
+    conversation_id = open_conversation(request.json)
+    if conversation_id is not None:
+        session_id = f"conversation:{conversation_id}"
+    conversation_history = get_conversation_history(session_id)
+    if traffic_recorder is not None:
+        traffic_recorder.request(session_id, user_message, request.json.get('stream'))
+
+    logger.info(f"Session {session_id}: Processing message of {len(user_message)} characters")
+
+    # Normalized once; the router, the answer cache key and retrieval all match on it
+    with trace_stage('normalize'):
+        query = normalize(user_message)
+
+    # One of the follow-ups suggested with the previous reply? They name their own topic, so they
+    # share first-turn answers in the answer cache (including prefetched ones) whatever came before
+    suggested = user_message in session.get('suggestions', [])
+
+    # Greetings, feedback and out-of-scope questions have fixed replies
+    decision = route_intent(session_id, query, conversation_history)
+    if decision is not None:
+        append_exchange(session_id, user_message, decision.response)
+        logger.info(f"Session {session_id}: Answered locally as '{decision.intent}'")
+        return jsonify({
+            "response": decision.response,
+            "timestamp": datetime.now().strftime("%H:%M"),
+            "intent": decision.intent
         })
 
-        # Generate response from Gemini
-        model = genai.GenerativeModel('models/gemini-2.5-flash',
-                                      system_instruction=SYSTEM_INSTRUCTION)
+    # Likely next questions, offered with the reply and prefetched in the background
+    suggestions = offer_follow_ups(user_message, conversation_history)
+
+    # Exact facts (teachers, subjects, fees, office hours, rules) from the knowledge tables
+    lookup = lookup_knowledge(user_message, conversation_history)
+    if lookup is not None and lookup.answer:
+        append_exchange(session_id, user_message, lookup.answer)
+        logger.info(f"Session {session_id}: Answered from the '{lookup.table}' table")
+        if suggested:
+            SUGGESTION_CLICKS.inc(result='local')
+        return jsonify(with_suggestions({
+            "response": lookup.answer,
+            "timestamp": datetime.now().strftime("%H:%M"),
+            "knowledge": lookup.table
+        }, suggestions))
+
+    # Serve repeated first-turn questions and clicked suggestions from the answer cache
+    cache_key = get_answer_cache_key(query, [] if suggested else conversation_history)
+    if cache_key:
+        with trace_stage('cache_lookup'):
+            cached_response = answer_cache.get(cache_key)
+        ANSWER_CACHE_LOOKUPS.inc(result='miss' if cached_response is None else 'hit')
+        trace_field('cache', 'miss' if cached_response is None else 'hit')
+        if cached_response is not None:
+            append_exchange(session_id, user_message, cached_response)
+            logger.info(f"Session {session_id}: Response served from answer cache")
+            if suggested:
+                click = 'prefetched' if prefetcher is not None and prefetcher.claim(cache_key) else 'cached'
+                SUGGESTION_CLICKS.inc(result=click)
+                trace_field('suggestion', click)
+            return jsonify(with_suggestions({
+                "response": cached_response,
+                "timestamp": datetime.now().strftime("%H:%M"),
+                "cached": True
+            }, suggestions))
+    if suggested:
+        SUGGESTION_CLICKS.inc(result='model')
+        if conversation_history:
+            # Answered with the conversation as context, so not a first-turn answer to cache
+            cache_key = None
+
+    # Build conversation contents with PDF context and history
+    with trace_stage('prompt_build'):
+        contents = build_contents(user_message, conversation_history, session_id,
+                                  grounding=lookup.grounding() if lookup is not None else None, query=query)
+
+    # Don't queue for a model that is known to be down
+    model_backend.breaker.check()
+
+    # Identical requests in flight share one model call (see coalesced_reply)
+    streaming = bool(request.json.get('stream') and app.config['STREAMING_ENABLED'])
+    return PendingTurn(session_id, user_message, contents, cache_key, join_flight(contents), streaming, suggestions)
+
+
+def acquire_turn_slot(turn):
+    """Generation slot for a turn; a leader that can't get one fails its followers too"""
+    try:
+        return acquire_generation_slot()
+    except Overloaded as e:
+        if turn.flight is not None:
+            turn.flight.fail(e)
+        raise
+
+
+def coalesced_reply(turn, assistant_response):
+    """Reply with the answer of an identical request that was already in flight"""
+    append_exchange(turn.session_id, turn.user_message, assistant_response)
+    logger.info(f"Session {turn.session_id}: Response shared from an identical in-flight request")
+    return jsonify(with_suggestions({
+        "response": assistant_response,
+        "timestamp": datetime.now().strftime("%H:%M"),
+        "coalesced": True
+    }, turn.suggestions))
+
+
+def finish_turn(turn, response, assistant_response):
+    """Store the model's answer (history, answer cache, followers) and build the reply"""
+    if turn.flight is not None:
+        turn.flight.publish(assistant_response)
+    record_usage(response)
+
+    # Store in conversation history
+    append_exchange(turn.session_id, turn.user_message, assistant_response)
+    if turn.cache_key and assistant_response:
+        answer_cache.set(turn.cache_key, assistant_response)
+
+    logger.info(f"Session {turn.session_id}: Response generated successfully")
+
+    # Create response object
+    response_data = with_suggestions({
+        "response": assistant_response,
+        "timestamp": datetime.now().strftime("%H:%M")
+    }, turn.suggestions)
+
+    with trace_stage('serialize'):
+        return jsonify(response_data)
 
-        response = model.generate_content(contents)
 
-        # Get the response text
-        assistant_response = response.text
+def chat_error_response(error):
+    """Reply for a /send_message request that failed with error"""
+    if isinstance(error, RateLimited):
+        logger.warning(f"Rate limited {g.get('rate_identity')}: {str(error)}")
+        return rate_limited_response(error)
+
+    if isinstance(error, Overloaded):
+        logger.warning(f"Rejected message: {str(error)}, retry after {error.retry_after}s")
+        return overloaded_response(error.retry_after, error.status)
+
+    reason = degraded_reason(error)
+    if reason is not None:
+        # Outage, rate limit or timeout: answer locally rather than with an error
+        logger.warning(f"Model unavailable ({reason}: {str(error)})")
+        user_message = ((request.get_json(silent=True) or {}).get('message') or '').strip()
+        fallback = degraded_answer(user_message, reason)
+        if fallback is not None:
+            return jsonify({
+                "response": fallback,
+                "timestamp": datetime.now().strftime("%H:%M"),
+                "degraded": True
+            })
+        retry_after = error.retry_after if isinstance(error, CircuitOpen) else generation_scheduler.retry_after()
+        return overloaded_response(retry_after)
+    logger.error(f"Error processing message: {str(error)}", exc_info=error)
+    return jsonify({
+        "error": "Sorry, I encountered an error while processing your request.",
+        "timestamp": datetime.now().strftime("%H:%M")
+    }), 500
 
-        # Store in conversation history
-        conversation_history.append({
-            "role": "user",
-            "content": user_message,
-            "timestamp": datetime.now().strftime("%H:%M")
-        })
-        conversation_history.append({
-            "role": "model",
-            "content": assistant_response,
-            "timestamp": datetime.now().strftime("%H:%M")
-        })
 
-        # Keep only last 20 exchanges (40 messages) to prevent memory issues
-        if len(conversation_history) > 40:
-            conversation_history[:] = conversation_history[-40:]
+@app.route('/send_message', methods=['POST'])
+def send_message():
+    try:
+        turn = prepare_turn()
+        if not isinstance(turn, PendingTurn):
+            return turn
+
+        # Wait for an identical request already in flight instead of calling the model again
+        if turn.flight is not None and not turn.flight.leader:
+            if turn.streaming:
+                return stream_coalesced(turn)
+            with trace_stage('coalesce_wait'):
+                assistant_response = turn.flight.wait()
+            return coalesced_reply(turn, assistant_response)
+
+        # Generate response from Gemini once a slot is free
+        slot = acquire_turn_slot(turn)
+        if turn.streaming:
+            return stream_response(turn, slot)
+
+        try:
+            with trace_stage('generate'):
+                response = model_backend.generate_content(turn.contents, SYSTEM_INSTRUCTION)
+            # Get the response text
+            assistant_response = response.text
+        except Exception as e:
+            if turn.flight is not None:
+                turn.flight.fail(e)
+            raise
+        finally:
+            slot.release()
+        return finish_turn(turn, response, assistant_response)
 
-        logger.info(f"Session {session_id}: Response generated successfully")
+    except Exception as e:
+        return chat_error_response(e)
 
-        # Create response object
-        response_data = {
-            "response": assistant_response,
-            "timestamp": datetime.now().strftime("%H:%M")
-        }
 
-        return jsonify(response_data)
+@app.route('/send_messages', methods=['POST'])
+@admin_required
+def send_messages():
+    """Answer many questions at once, streaming NDJSON results as they complete"""
+    payload = request.get_json(silent=True) or {}
+    questions = payload.get('questions')
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) for q in questions):
+        return jsonify({"error": "Expected a non-empty list of questions"}), 400
+    if len(questions) > app.config['BATCH_MAX_QUESTIONS']:
+        return jsonify({"error": f"At most {app.config['BATCH_MAX_QUESTIONS']} questions per batch"}), 400
 
+    try:
+        concurrency = int(payload.get('concurrency', batch.DEFAULT_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid concurrency"}), 400
+    concurrency = max(1, min(concurrency, app.config['BATCH_MAX_CONCURRENCY']))
+    warm_cache = bool(payload.get('warm_cache'))
+    refresh = bool(payload.get('refresh'))
+    questions = [q.strip() for q in questions]
+    logger.info(f"Batch of {len(questions)} questions, concurrency {concurrency}, warm_cache={warm_cache}")
+
+    def answer(question):
+        return answer_batch_question(question, warm_cache=warm_cache, refresh=refresh)
+
+    def generate():
+        for result in batch.run_batch(questions, answer, concurrency):
+            if result["type"] == "summary":
+                logger.info(f"Batch finished: {result['ok']}/{result['total']} answered, {result['errors']} failed")
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers=STREAM_HEADERS)
+
+
+@app.route('/reload_knowledge', methods=['POST'])
+@admin_required
+def reload_knowledge():
+    """Reindex changed knowledge documents now and swap them in on this worker"""
+    try:
+        changes = knowledge_loader.reload()
     except Exception as e:
-        logger.error(f"Error processing message: {str(e)}", exc_info=True)
-        return jsonify({
-            "error": "Sorry, I encountered an error while processing your request.",
-            "timestamp": datetime.now().strftime("%H:%M")
-        }), 500
+        logger.error(f"Knowledge reload failed: {str(e)}")
+        KNOWLEDGE_RELOADS.inc(result='error')
+        return jsonify({"error": "Knowledge reload failed"}), 500
+    return jsonify(dict(changes, **knowledge_loader.current.stats()))
+
+
+@app.route('/top_consumers')
+@admin_required
+def top_consumers():
+    """Identities that used the most model tokens on a day (default today), with their remaining budgets"""
+    if rate_limiter is None:
+        return jsonify({"error": "Rate limiting is off"}), 404
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    day = request.args.get('day') or usage_day(time.time())
+    if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", day):
+        return jsonify({"error": "Expected day as YYYY-MM-DD"}), 400
+    consumers = rate_limiter.top_consumers(limit, day)
+    for consumer in consumers:
+        consumer["remaining"] = rate_limiter.remaining(consumer["identity"])
+    return jsonify({
+        "day": day,
+        "limits": rate_limiter.limits.to_dict(),
+        "consumers": consumers,
+        "scheduler": generation_scheduler.stats(),
+        "prefetch": prefetcher.stats() if prefetcher is not None else None
+    })
+
+
+def page_size_arg():
+    """?limit= for paginated routes, clamped; None if it isn't a number"""
+    try:
+        return max(1, min(int(request.args.get('limit', app.config['CONVERSATION_PAGE_SIZE'])), MAX_PAGE_SIZE))
+    except ValueError:
+        return None
+
+
+def conversations_unavailable():
+    """Error response when the conversation routes can't be used, else None"""
+    if conversation_store is None:
+        return jsonify({"error": "Saved conversations are off"}), 404
+    if current_user_email() is None:
+        return jsonify({"error": "Login required"}), 401
+    return None
+
+
+@app.route('/conversations')
+def list_conversations():
+    """One page of the user's conversations, most recent first; pass next_cursor back as ?cursor= for the next"""
+    error = conversations_unavailable()
+    if error:
+        return error
+    limit = page_size_arg()
+    if limit is None:
+        return jsonify({"error": "Invalid limit"}), 400
+    try:
+        conversations, next_cursor = conversation_store.list(current_user_email(), limit,
+                                                             request.args.get('cursor'))
+    except InvalidCursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify({
+        "conversations": conversations,
+        "next_cursor": next_cursor,
+        "current": session.get('conversation_id')
+    })
+
+
+@app.route('/conversations/<conversation_id>/messages')
+def conversation_messages(conversation_id):
+    """One page of a conversation's messages, newest page first; ?cursor= pages back to older ones"""
+    error = conversations_unavailable()
+    if error:
+        return error
+    limit = page_size_arg()
+    if limit is None:
+        return jsonify({"error": "Invalid limit"}), 400
+    email = current_user_email()
+    conversation = conversation_store.get(email, conversation_id)
+    if conversation is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    try:
+        messages, next_cursor = conversation_store.messages(email, conversation_id, limit,
+                                                            request.args.get('cursor'))
+    except InvalidCursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify({
+        "conversation": conversation,
+        "messages": [{"role": m.role, "content": m.content, "timestamp": m.timestamp} for m in messages],
+        "next_cursor": next_cursor
+    })
+
+
+@app.route('/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """Delete one of the user's conversations"""
+    error = conversations_unavailable()
+    if error:
+        return error
+    if not conversation_store.delete(current_user_email(), conversation_id):
+        return jsonify({"error": "Conversation not found"}), 404
+    history_store.clear(f"conversation:{conversation_id}")
+    if history_summarizer is not None:
+        history_summarizer.forget(f"conversation:{conversation_id}")
+    if session.get('conversation_id') == conversation_id:
+        session.pop('conversation_id')
+    return jsonify({"success": True})
 
 
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
-    """Clear conversation history for current session"""
+    """Clear conversation history for current session; a logged-in user's next message starts a new conversation"""
     try:
         session_id = get_session_id()
-        if session_id in conversation_histories:
-            conversation_histories[session_id] = []
-            logger.info(f"Session {session_id}: Conversation history cleared")
+        history_store.clear(session_id)
+        if history_summarizer is not None:
+            history_summarizer.forget(session_id)
+        session.pop('conversation_id', None)
+        logger.info(f"Session {session_id}: Conversation history cleared")
         return jsonify({"success": True, "message": "Conversation history cleared"})
     except Exception as e:
         logger.error(f"Error clearing history: {str(e)}")
         return jsonify({"error": "Failed to clear history"}), 500
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus-format metrics for this worker"""
+    token = app.config['METRICS_TOKEN']
+    if token and not has_bearer_token(token):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def begin_request_trace():
+    """Start timing chat requests"""
+    if request.endpoint in TRACED_ENDPOINTS:
+        g.trace = metrics.RequestTrace(request.endpoint)
+        IN_FLIGHT_REQUESTS.inc()
+
+
+@app.after_request
+def record_response_status(response):
+    trace = g.get('trace')
+    if trace is not None:
+        trace.status = response.status_code
+    # Tells the sidebar which saved conversation a message went to (set before a stream starts)
+    conversation_id = g.get('conversation_id')
+    if conversation_id is not None:
+        response.headers['X-Conversation-Id'] = conversation_id
+    return response
+
+
+@app.teardown_request
+def end_request_trace(exc):
+    """Record metrics and the structured log line once the response is fully sent"""
+    trace = g.pop('trace', None)
+    if trace is None:
+        return
+    IN_FLIGHT_REQUESTS.dec()
+    if trace.status is None:
+        trace.status = 500
+    REQUEST_LATENCY.observe(trace.elapsed_ms(), endpoint=trace.endpoint, status=trace.status)
+    for stage, elapsed in trace.stages.items():
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+    if 'prompt_tokens' in trace.fields:
+        PROMPT_TOKENS.observe(trace.fields['prompt_tokens'])
+    if 'response_tokens' in trace.fields:
+        RESPONSE_TOKENS.observe(trace.fields['response_tokens'])
+    request_logger.info(json.dumps(trace.record()))
+
+
 @app.errorhandler(404)
 def not_found(e):
     return jsonify({"error": "Resource not found"}), 404
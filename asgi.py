@@ -0,0 +1,308 @@
+"""
+ASGI entry point with an async chat endpoint.
+
+Under WSGI every /send_message holds a worker thread for the whole Gemini
+call, so serving a few hundred students at once takes hundreds of threads.
+Served through this module instead (`uvicorn asgi:app`), POST /send_message
+awaits the model on the event loop: a request waiting for Gemini costs a
+coroutine, not a thread.
+
+The endpoint runs the same steps as the threaded view in app.py. The parts
+that touch the history store, conversation store, answer cache, rate limiter
+and knowledge index are blocking SQLite and CPU work of a few milliseconds;
+they run on a small thread pool (ASYNC_BLOCKING_THREADS) inside the request's
+Flask context, so the event loop never waits on them. The model call itself
+(generate_content_async, streamed or not) and the retries around it run on
+the loop, and so do followers of a coalesced call. Requests queued for a
+generation slot wait on a separate pool, which the scheduler's bounded queue
+keeps small, so they can never starve the short blocking work.
+
+Every other route, and /send_message when ASYNC_CHAT=0, is served by the
+Flask app unchanged through a WSGI bridge on the same thread pool.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+import asyncio
+import contextvars
+import io
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+
+import app as chat
+
+logger = logging.getLogger(__name__)
+
+flask_app = chat.app
+blocking_pool = ThreadPoolExecutor(max_workers=flask_app.config['ASYNC_BLOCKING_THREADS'],
+                                   thread_name_prefix='asgi-blocking')
+# At most GENERATION_MAX_QUEUE threads wait here; the rest are admitted or turned away at once
+slot_pool = ThreadPoolExecutor(max_workers=flask_app.config['GENERATION_MAX_QUEUE']
+                               + flask_app.config['GENERATION_MAX_CONCURRENCY'],
+                               thread_name_prefix='asgi-slots')
+
+
+async def run_blocking(fn, *args, pool=blocking_pool):
+    """Run fn on a thread pool with the caller's context (and so its Flask request context)"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(pool, context.run, fn, *args)
+
+
+async def iterate_blocking(iterable):
+    """Iterate a blocking iterable (a streamed Flask body) on the blocking pool"""
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await run_blocking(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+def build_environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP request"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def send_start(send, status, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+
+
+async def send_flask_response(send, response):
+    """Send a finished Flask response, iterating streamed bodies on the blocking pool"""
+    await send_start(send, response.status_code, response.headers.to_wsgi_list())
+    try:
+        if response.is_sequence:
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+            return
+        async for chunk in iterate_blocking(response.iter_encoded()):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # Runs call_on_close callbacks (slot release, single-flight cleanup)
+        await run_blocking(response.close)
+
+
+async def serve_wsgi(scope, receive, send):
+    """Serve a request with the Flask app on the blocking pool"""
+    body = await read_body(receive)
+    if body is None:
+        return
+    environ = build_environ(scope, body)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    result = await run_blocking(flask_app, environ, start_response)
+    try:
+        chunks = iterate_blocking(result)
+        first = await anext(chunks, b'')
+        await send_start(send, started['status'], started['headers'])
+        await send({'type': 'http.response.body', 'body': first, 'more_body': True})
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await run_blocking(result.close)
+
+
+class ClientDisconnected(Exception):
+    """The browser went away while an answer was being streamed"""
+
+
+class AsyncStream:
+    """A streamed model answer, sent by the async endpoint as NDJSON"""
+
+    def __init__(self, turn, slot):
+        self.turn = turn
+        self.slot = slot
+
+
+async def generate_reply():
+    """The reply to the current /send_message request: a Flask response value or an AsyncStream"""
+    try:
+        turn = await run_blocking(chat.prepare_turn)
+        if not isinstance(turn, chat.PendingTurn):
+            return turn
+
+        # Wait for an identical request already in flight instead of calling the model again
+        if turn.flight is not None and not turn.flight.leader:
+            if turn.streaming:
+                try:
+                    with chat.trace_stage('coalesce_wait'):
+                        assistant_response = await turn.flight.wait_async()
+                except chat.FlightFailed as e:
+                    lines = await run_blocking(chat.coalesced_stream_lines, turn, None, e)
+                else:
+                    lines = await run_blocking(chat.coalesced_stream_lines, turn, assistant_response)
+                return flask_app.response_class(lines, mimetype='application/x-ndjson', headers=chat.STREAM_HEADERS)
+            with chat.trace_stage('coalesce_wait'):
+                assistant_response = await turn.flight.wait_async()
+            return await run_blocking(chat.coalesced_reply, turn, assistant_response)
+
+        slot = await run_blocking(chat.acquire_turn_slot, turn, pool=slot_pool)
+        if turn.streaming:
+            return AsyncStream(turn, slot)
+
+        try:
+            with chat.trace_stage('generate'):
+                response = await chat.model_backend.generate_content_async(turn.contents, chat.SYSTEM_INSTRUCTION)
+            assistant_response = response.text
+        except Exception as e:
+            if turn.flight is not None:
+                turn.flight.fail(e)
+            raise
+        finally:
+            slot.release()
+        return await run_blocking(chat.finish_turn, turn, response, assistant_response)
+
+    except Exception as e:
+        return await run_blocking(chat.chat_error_response, e)
+
+
+async def send_async_stream(send, stream, headers):
+    """Forward the model's chunks as NDJSON lines as they arrive on the event loop"""
+    turn = stream.turn
+    trace = g.get('trace')
+    started = trace.started if trace is not None else time.perf_counter()
+    await send_start(send, 200, headers)
+
+    async def emit(line):
+        try:
+            await send({'type': 'http.response.body', 'body': line.encode('utf-8'), 'more_body': True})
+        except OSError as e:
+            raise ClientDisconnected() from e
+
+    chunks = []
+    try:
+        try:
+            with chat.trace_stage('generate'):
+                response = await chat.model_backend.generate_content_async(turn.contents, chat.SYSTEM_INSTRUCTION,
+                                                                           stream=True)
+                async for chunk in response:
+                    text = chunk.text
+                    if not text:
+                        continue
+                    await emit(chat.stream_chunk_line(chunks, text, started, turn.session_id))
+            await run_blocking(chat.record_usage, response)
+        except (asyncio.CancelledError, ClientDisconnected):
+            # Followers get an error instead of waiting for an answer that won't come
+            if turn.flight is not None:
+                turn.flight.fail(chat.FlightFailed("The leading request ended early"))
+            raise
+        except Exception as e:
+            stream.slot.release()
+            for line in await run_blocking(chat.stream_error_lines, turn, e, chunks):
+                await emit(line)
+        else:
+            stream.slot.release()
+            await emit(await run_blocking(chat.stream_done_line, turn, chunks, started))
+        await send({'type': 'http.response.body', 'body': b''})
+    except ClientDisconnected:
+        logger.info(f"Session {turn.session_id}: Client disconnected mid-stream")
+    finally:
+        stream.slot.release()
+
+
+async def serve_send_message(scope, receive, send):
+    """POST /send_message with the model call awaited on the event loop"""
+    body = await read_body(receive)
+    if body is None:
+        return
+    ctx = flask_app.request_context(build_environ(scope, body))
+    # Pushed in this task's context; run_blocking copies it to the pool threads
+    ctx.push()
+    error = None
+    try:
+        reply = await run_blocking(flask_app.preprocess_request)
+        if reply is None:
+            reply = await generate_reply()
+        if isinstance(reply, AsyncStream):
+            # Headers (session cookie, conversation id) are final before the first chunk
+            shell = flask_app.response_class(mimetype='application/x-ndjson', headers=chat.STREAM_HEADERS)
+            shell = await run_blocking(flask_app.process_response, shell)
+            await send_async_stream(send, reply, shell.headers.to_wsgi_list())
+        else:
+            response = await run_blocking(lambda: flask_app.process_response(flask_app.make_response(reply)))
+            await send_flask_response(send, response)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        ctx.pop(error)
+
+
+class ChatASGI:
+    """ASGI app: async /send_message, everything else through the Flask app"""
+
+    def __init__(self, async_chat=True):
+        self.async_chat = async_chat
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    blocking_pool.shutdown(wait=False)
+                    slot_pool.shutdown(wait=False)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        if self.async_chat and scope['method'] == 'POST' and scope['path'] == '/send_message':
+            await serve_send_message(scope, receive, send)
+        else:
+            await serve_wsgi(scope, receive, send)
+
+
+app = ChatASGI(flask_app.config['ASYNC_CHAT'])
@@ -0,0 +1,156 @@
+"""
+Batch answering of many questions, for FAQ pre-generation and cache warming.
+
+Questions are answered concurrently without session history, through the
+same generation scheduler (and so the same rate limit) as chat traffic.
+Results come back as soon as each one completes, with a progress counter, and
+one failed question never loses the rest of the batch.
+
+The /send_messages endpoint streams these results as NDJSON. The CLI runs a
+batch either in-process against the local answer cache, or against a
+running server:
+
+    python batch.py questions.txt --out answers.ndjson --warm-cache
+    python batch.py questions.txt --url https://ask-lagronian.example --token "$BATCH_API_TOKEN"
+
+The questions file holds one question per line, or a JSON list.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_CONCURRENCY = 4
+MAX_QUESTION_CHARS = 2000
+
+
+def run_batch(questions, answer, concurrency=DEFAULT_CONCURRENCY):
+    """Answer questions concurrently, yielding one result dict per question as it completes
+
+    answer(question) returns (response, source). A final summary dict
+    (type "summary") lists the questions that failed.
+    """
+    total = len(questions)
+    started = time.perf_counter()
+    done = 0
+    failed = []
+
+    def run(index, question):
+        item_started = time.perf_counter()
+        result = {"type": "result", "index": index, "question": question}
+        try:
+            if not question or len(question) > MAX_QUESTION_CHARS:
+                raise ValueError(f"Question must be 1-{MAX_QUESTION_CHARS} characters")
+            response, source = answer(question)
+            result.update(status="ok", response=response, source=source)
+        except Exception as e:
+            result.update(status="error", error=f"{type(e).__name__}: {str(e)}")
+        result["elapsed_ms"] = round((time.perf_counter() - item_started) * 1000, 1)
+        return result
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch')
+    try:
+        futures = [pool.submit(run, index, question) for index, question in enumerate(questions)]
+        for future in as_completed(futures):
+            result = future.result()
+            done += 1
+            if result["status"] == "error":
+                failed.append({"index": result["index"], "question": result["question"], "error": result["error"]})
+            result["progress"] = {"done": done, "total": total}
+            yield result
+    finally:
+        # A closed stream (client gone) drops the questions not started yet
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    yield {
+        "type": "summary",
+        "total": total,
+        "ok": total - len(failed),
+        "errors": len(failed),
+        "failed": sorted(failed, key=lambda item: item["index"]),
+        "elapsed_s": round(time.perf_counter() - started, 2)
+    }
+
+
+def read_questions(path):
+    """Questions from a text file (one per line) or a JSON list"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return [str(q).strip() for q in json.loads(text)]
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+
+
+def local_results(questions, args):
+    """Run the batch in this process, sharing DATA_DIR (and the answer cache) with local workers"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault('WARM_UP_ON_STARTUP', '0')
+    import app as chat_app
+
+    def answer(question):
+        return chat_app.answer_batch_question(question, warm_cache=args.warm_cache, refresh=args.refresh)
+
+    return run_batch(questions, answer, args.concurrency)
+
+
+def remote_results(questions, args):
+    """Run the batch on a server through /send_messages"""
+    import requests
+
+    response = requests.post(
+        f"{args.url.rstrip('/')}/send_messages",
+        json={"questions": questions, "concurrency": args.concurrency,
+              "warm_cache": args.warm_cache, "refresh": args.refresh},
+        headers={"Authorization": f"Bearer {args.token}"} if args.token else {},
+        stream=True, timeout=(10, None)
+    )
+    if response.status_code != 200:
+        raise SystemExit(f"Server answered {response.status_code}: {response.text[:200]}")
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a list of questions in bulk")
+    parser.add_argument('questions', help="Text file with one question per line, or a JSON list")
+    parser.add_argument('--out', help="Write results as NDJSON to this path (default: stdout)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Questions answered at once")
+    parser.add_argument('--warm-cache', action='store_true', help="Store the answers in the answer cache")
+    parser.add_argument('--refresh', action='store_true', help="Regenerate answers that are already cached")
+    parser.add_argument('--url', help="Send the batch to a running server instead of answering locally")
+    parser.add_argument('--token', default=os.getenv('BATCH_API_TOKEN'), help="Bearer token for --url")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    results = remote_results(questions, args) if args.url else local_results(questions, args)
+
+    out = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+    summary = None
+    try:
+        for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if result["type"] == "summary":
+                summary = result
+                continue
+            progress = result["progress"]
+            status = result["status"] if result["status"] == "error" else result.get("source", "ok")
+            print(f"[{progress['done']}/{progress['total']}] {status:<9} {result['question'][:70]}", file=sys.stderr)
+    finally:
+        if args.out:
+            out.close()
+
+    if summary is None:
+        raise SystemExit("Batch ended without a summary")
+    print(f"{summary['ok']}/{summary['total']} answered in {summary['elapsed_s']}s, {summary['errors']} failed",
+          file=sys.stderr)
+    for item in summary["failed"]:
+        print(f"  #{item['index']}: {item['question'][:60]} -> {item['error']}", file=sys.stderr)
+    sys.exit(1 if summary["errors"] else 0)
+
+
+if __name__ == '__main__':
+    main()
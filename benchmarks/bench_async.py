@@ -0,0 +1,241 @@
+"""
+Concurrent-session capacity of one worker: threaded WSGI against the async endpoint.
+
+Both modes run in this process against the fake model backend, with the
+answer cache, intent router, knowledge tables and request coalescing off so
+every message reaches the model:
+
+- threaded: the Flask app on a pool of --threads threads, like a gthread
+  worker; each request holds its thread for the whole model call
+- async: asgi.app called directly on one event loop; requests waiting for
+  the model are coroutines
+
+For each number of concurrent students, each one sends --turns messages in a
+row (no think time). Reported per mode and concurrency: messages per second,
+p50/p95 latency, peak server threads and memory growth. Capacity is the largest
+concurrency whose p95 stays within --slo times the model latency.
+
+    python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --sessions 50 100 200 400 800 --threads 32 --stream --out async.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+QUESTIONS = [
+    "What are the enrollment requirements for transferees?",
+    "What subjects does STEM have in grade 11?",
+    "How is the grading system computed?",
+    "Who are the ICT teachers?",
+    "Tell me about the SHS voucher program",
+    "What are the school rules on uniforms?",
+]
+
+
+def configure(args):
+    os.environ.update({
+        "MODEL_BACKEND": "fake",
+        "FAKE_MODEL_LATENCY": f"fixed:{args.latency}",
+        "FAKE_MODEL_CHUNKS": "8",
+        "FAKE_MODEL_CHUNK_DELAY_MS": "0",
+        "SECRET_KEY": "bench-async",
+        "DATA_DIR": tempfile.mkdtemp(prefix='ask_lagronian_bench_async_'),
+        "WARM_UP_ON_STARTUP": "0",
+        "ANSWER_CACHE": "off",
+        "INTENT_ROUTER": "off",
+        "KNOWLEDGE_TABLES": "0",
+        "COALESCE_REQUESTS": "off",
+        "RATE_LIMITS": "off",
+        "HISTORY_SUMMARY_ENABLED": "0",
+        "GENERATION_MAX_CONCURRENCY": "100000",
+        "GENERATION_MAX_QUEUE": "0",
+        "UPSTREAM_TIMEOUT": "120",
+    })
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(1, math.ceil(pct / 100 * len(ordered))) - 1], 1)
+
+
+def server_threads(prefix):
+    return sum(1 for thread in threading.enumerate() if thread.name.startswith(prefix))
+
+
+def rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Client:
+    """One simulated student: a signed session cookie that follows Set-Cookie"""
+
+    def __init__(self, flask_app, n):
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self.cookie = serializer.dumps({"user": {"email": f"student{n}@example.com", "name": f"student{n}"},
+                                        "session_id": f"bench-{n}"})
+
+    def request(self, message, stream):
+        body = json.dumps({"message": message, "stream": stream}).encode('utf-8')
+        headers = [(b'content-type', b'application/json'), (b'cookie', f"session={self.cookie}".encode('latin-1'))]
+        return body, headers
+
+    def update(self, headers):
+        for name, value in headers:
+            if name.lower() == 'set-cookie' and value.startswith('session='):
+                self.cookie = value.split(';', 1)[0][len('session='):]
+
+
+def scope_for(headers):
+    return {'type': 'http', 'method': 'POST', 'path': '/send_message', 'query_string': b'', 'headers': headers,
+            'scheme': 'http', 'server': ('127.0.0.1', 8000), 'client': ('127.0.0.1', 50000), 'http_version': '1.1'}
+
+
+async def call_asgi(asgi_app, client, message, stream):
+    body, headers = client.request(message, stream)
+    received = {'status': None, 'headers': [], 'body': b''}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            received['status'] = message['status']
+            received['headers'] = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in message['headers']]
+        else:
+            received['body'] += message.get('body', b'')
+
+    await asgi_app(scope_for(headers), receive, send)
+    client.update(received['headers'])
+    return received['status'], received['body']
+
+
+def call_wsgi(flask_app, build_environ, client, message, stream):
+    body, headers = client.request(message, stream)
+    received = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        received['status'] = int(status.split(' ', 1)[0])
+        received['headers'] = response_headers
+
+    result = flask_app(build_environ(scope_for(headers), body), start_response)
+    try:
+        data = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    client.update(received['headers'])
+    return received['status'], data
+
+
+async def run_level(mode, sessions, args, flask_app, asgi_module, server_pool):
+    clients = [Client(flask_app, n) for n in range(sessions)]
+    latencies = []
+    errors = 0
+    prefix = 'asgi-' if mode == 'async' else 'wsgi-worker'
+    peak_threads = server_threads(prefix)
+    loop = asyncio.get_running_loop()
+
+    async def student(n):
+        nonlocal errors, peak_threads
+        for turn in range(args.turns):
+            message = f"{QUESTIONS[(n + turn) % len(QUESTIONS)]} ({n}-{turn})"
+            started = time.perf_counter()
+            if mode == 'async':
+                status, body = await call_asgi(asgi_module.app, clients[n], message, args.stream)
+            else:
+                status, body = await loop.run_in_executor(server_pool, call_wsgi, flask_app,
+                                                          asgi_module.build_environ, clients[n], message, args.stream)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200 or b'"error"' in body:
+                errors += 1
+            peak_threads = max(peak_threads, server_threads(prefix))
+
+    rss_before = rss_kb()
+    started = time.perf_counter()
+    await asyncio.gather(*(student(n) for n in range(sessions)))
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "messages": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 2),
+        "messages_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "peak_threads": peak_threads,
+        "max_rss_growth_kb": rss_kb() - rss_before
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-worker session capacity of threaded and async chat")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[25, 50, 100, 200, 400],
+                        help="Concurrent students to try")
+    parser.add_argument('--turns', type=int, default=3, help="Messages per student")
+    parser.add_argument('--threads', type=int, default=32, help="Threads of the threaded worker")
+    parser.add_argument('--latency', type=int, default=1000, help="Fake model latency (ms)")
+    parser.add_argument('--stream', action='store_true', help="Send messages with stream=true")
+    parser.add_argument('--slo', type=float, default=1.5, help="p95 budget as a multiple of the model latency")
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'async'], choices=['threaded', 'async'])
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    configure(args)
+    import logging
+    logging.disable(logging.WARNING)
+    import asgi as asgi_module
+
+    flask_app = asgi_module.flask_app
+    results = []
+    server_pool = ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix='wsgi-worker')
+    for mode in args.modes:
+        for sessions in args.sessions:
+            result = asyncio.run(run_level(mode, sessions, args, flask_app, asgi_module, server_pool))
+            results.append(result)
+            print(f"{mode:<9} sessions={sessions:<5} {result['messages_per_s']:>7} msg/s  "
+                  f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms errors={result['errors']} "
+                  f"threads={result['peak_threads']}")
+
+    budget = args.latency * args.slo
+    capacity = {}
+    for mode in args.modes:
+        within = [r["sessions"] for r in results if r["mode"] == mode and not r["errors"] and r["p95_ms"] <= budget]
+        capacity[mode] = max(within, default=0)
+    print(f"Capacity (p95 <= {budget:.0f} ms): " + ", ".join(f"{mode} {n} sessions" for mode, n in capacity.items()))
+
+    if args.out:
+        report = {"commit": git_commit(), "timestamp": int(time.time()), "args": vars(args),
+                  "results": results, "capacity": capacity}
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Conversation list benchmark: sidebar listing and resume latency for heavy users.
+
+Seeds a SQLite conversation store with many users, each with hundreds of
+conversations, then measures for one of them:
+
+- the first sidebar page, and every page while scrolling to the end of the list
+- the same deep pages fetched with OFFSET, for comparison with the keyset cursor
+- resuming a conversation: its newest page of messages, the context window the
+  model gets (HISTORY_MAX_MESSAGES), and paging back to its first message
+- GET /conversations and GET /conversations/<id>/messages through the app
+  (fake model backend), including routing and JSON serialization
+
+    python benchmarks/bench_conversations.py
+    python benchmarks/bench_conversations.py --conversations 1000 --messages 80 --out conversations.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from conversation_store import SQLiteConversationStore, make_title  # noqa: E402
+
+USER = 'bench@example.com'
+QUESTIONS = [
+    "What are the enrollment requirements for Grade 11?",
+    "Which strands does Lagro High School offer?",
+    "How much is the miscellaneous fee?",
+    "Who teaches General Mathematics?",
+    "What time does the registrar's office open?",
+]
+
+
+def seed(store, users, conversations, messages):
+    """Fill the store directly (bulk inserts), spreading activity over the last 90 days"""
+    rng = random.Random(7)
+    now = int(time.time() * 1000)
+    conn = store._connect()
+    ids = []
+    with conn:
+        for u in range(users):
+            user = USER if u == 0 else f"user{u}@example.com"
+            for c in range(conversations):
+                conversation_id = f"{u:04d}{c:06d}{rng.getrandbits(64):016x}"
+                updated = now - rng.randrange(90 * 24 * 3600 * 1000)
+                question = rng.choice(QUESTIONS)
+                conn.execute("INSERT INTO conversations VALUES (?, ?, ?, ?, ?, ?)",
+                             (conversation_id, user, make_title(question), updated, updated, messages))
+                conn.executemany(
+                    "INSERT INTO conversation_messages VALUES (?, ?, ?, ?, ?)",
+                    [(conversation_id, seq + 1, 'user' if seq % 2 == 0 else 'model',
+                      question if seq % 2 == 0 else "Here is what the school handbook says. " * 8,
+                      updated // 1000) for seq in range(messages)]
+                )
+                if u == 0:
+                    ids.append(conversation_id)
+    return ids
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "median": round(statistics.median(values), 3),
+        "p95": round(values[max(0, round(0.95 * len(values)) - 1)], 3),
+        "max": round(values[-1], 3)
+    }
+
+
+def bench_store(store, ids, page_size, history_messages, repeats):
+    results = {"first_page_ms": [], "page_ms": [], "offset_page_ms": [], "deepest_page_ms": [],
+               "deepest_offset_ms": [], "resume_page_ms": [], "resume_context_ms": [], "older_page_ms": []}
+    conn = store._connect()
+    for _ in range(repeats):
+        elapsed, (page, cursor) = timed(store.list, USER, page_size)
+        results["first_page_ms"].append(elapsed)
+        offset = page_size
+        while cursor:
+            elapsed, (page, next_cursor) = timed(store.list, USER, page_size, cursor)
+            results["page_ms"].append(elapsed)
+            offset_ms, _ = timed(lambda: conn.execute(
+                "SELECT id, title, created_at, updated_at, message_count FROM conversations WHERE user = ?"
+                " ORDER BY updated_at DESC, id DESC LIMIT ? OFFSET ?", (USER, page_size + 1, offset)).fetchall())
+            results["offset_page_ms"].append(offset_ms)
+            if not next_cursor:
+                results["deepest_page_ms"].append(elapsed)
+                results["deepest_offset_ms"].append(offset_ms)
+            offset += page_size
+            cursor = next_cursor
+
+        conversation_id = random.choice(ids)
+        elapsed, (messages, cursor) = timed(store.messages, USER, conversation_id, page_size)
+        results["resume_page_ms"].append(elapsed)
+        elapsed, _ = timed(store.messages, USER, conversation_id, history_messages)
+        results["resume_context_ms"].append(elapsed)
+        while cursor:
+            elapsed, (messages, cursor) = timed(store.messages, USER, conversation_id, page_size, cursor)
+            results["older_page_ms"].append(elapsed)
+    return {key: summarize(values) for key, values in results.items() if values}
+
+
+def bench_http(data_dir, ids, page_size, repeats):
+    os.environ.update(MODEL_BACKEND='fake', WARM_UP_ON_STARTUP='0', SECRET_KEY='bench-conversations',
+                      DATA_DIR=data_dir, CONVERSATION_STORE='sqlite', CONVERSATION_PAGE_SIZE=str(page_size))
+    import app as chat_app
+
+    client = chat_app.app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'email': USER, 'name': 'Bench', 'picture': ''}
+    results = {"http_first_page_ms": [], "http_page_ms": [], "http_resume_ms": []}
+    for _ in range(repeats):
+        elapsed, response = timed(client.get, '/conversations')
+        results["http_first_page_ms"].append(elapsed)
+        cursor = response.get_json()["next_cursor"]
+        while cursor:
+            elapsed, response = timed(client.get, f'/conversations?cursor={cursor}')
+            results["http_page_ms"].append(elapsed)
+            cursor = response.get_json()["next_cursor"]
+        elapsed, response = timed(client.get, f'/conversations/{random.choice(ids)}/messages')
+        assert response.status_code == 200
+        results["http_resume_ms"].append(elapsed)
+    return {key: summarize(values) for key, values in results.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure conversation listing and resume latency")
+    parser.add_argument('--users', type=int, default=50, help="Users in the store")
+    parser.add_argument('--conversations', type=int, default=500, help="Conversations per user")
+    parser.add_argument('--messages', type=int, default=40, help="Messages per conversation")
+    parser.add_argument('--page-size', type=int, default=20, help="Conversations or messages per page")
+    parser.add_argument('--history-messages', type=int, default=40, help="Messages loaded as model context on resume")
+    parser.add_argument('--repeats', type=int, default=5, help="Times the whole list is scrolled through")
+    parser.add_argument('--no-http', action='store_true', help="Skip the measurements through the app")
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='ask_lagronian_bench_conversations_')
+    try:
+        store = SQLiteConversationStore(os.path.join(data_dir, 'conversations.sqlite3'))
+        seed_ms, ids = timed(seed, store, args.users, args.conversations, args.messages)
+        print(f"Seeded {args.users} users x {args.conversations} conversations x {args.messages} messages "
+              f"in {seed_ms / 1000:.1f}s")
+
+        report = {"commit": git_commit(), "timestamp": int(time.time()), "args": vars(args),
+                  "results": bench_store(store, ids, args.page_size, args.history_messages, args.repeats)}
+        if not args.no_http:
+            report["results"].update(bench_http(data_dir, ids, args.page_size, args.repeats))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    for key, stats in report["results"].items():
+        print(f"{key:<22} median={stats['median']:<8} p95={stats['p95']:<8} max={stats['max']:<8} n={stats['count']}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
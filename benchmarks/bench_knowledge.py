@@ -0,0 +1,108 @@
+"""
+Microbenchmarks for the structured knowledge tables.
+
+Measures the cold open of the memory-mapped tables file, per-question lookup
+latency and throughput, and compares them with a BM25 search over the
+knowledge base passages (knowledge_base.py) for the same questions.
+
+    python benchmarks/bench_knowledge.py
+    python benchmarks/bench_knowledge.py --iterations 5000 --out bench_knowledge.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import knowledge_base  # noqa: E402
+import knowledge_tables  # noqa: E402
+
+QUESTIONS = [
+    "Who teaches ICT in grade 12?",
+    "How much is the tuition for TVL-HE?",
+    "What are the guidance office hours?",
+    "What subjects are in STEM for grade 11?",
+    "What are the ABM subjects for grade 12 second semester?",
+    "What strands are offered?",
+    "Where is the library?",
+    "Are cellphones allowed inside the campus?",
+    "Tell me about the SHS voucher program",
+    "Saan matatagpuan ang aklatan?",
+]
+
+
+def time_calls(fn, iterations):
+    """Per-call latencies in microseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def stats(samples):
+    ordered = sorted(samples)
+    return {
+        "mean_us": round(statistics.mean(ordered), 1),
+        "p50_us": round(ordered[len(ordered) // 2], 1),
+        "p95_us": round(ordered[int(len(ordered) * 0.95) - 1], 1),
+        "per_s": round(1e6 / statistics.mean(ordered)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default=knowledge_tables.DEFAULT_DB_PATH, help="Built knowledge tables")
+    parser.add_argument('--knowledge-dir', default=knowledge_base.DEFAULT_KNOWLEDGE_DIR,
+                        help="Knowledge documents whose passages BM25 searches")
+    parser.add_argument('--iterations', type=int, default=1000, help="Lookups per question")
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} not found, build it with: python knowledge_tables.py")
+
+    start = time.perf_counter()
+    tables = knowledge_tables.KnowledgeTables(args.db)
+    tables.meta()
+    cold_open_ms = (time.perf_counter() - start) * 1000
+    index = knowledge_base.KnowledgeBaseLoader(args.knowledge_dir).get().index
+
+    results = {"db_bytes": os.path.getsize(args.db), "cold_open_ms": round(cold_open_ms, 3), "questions": []}
+    all_lookups, all_searches = [], []
+    for question in QUESTIONS:
+        lookup = tables.lookup(question)
+        lookups = time_calls(lambda: tables.lookup(question), args.iterations)
+        searches = time_calls(lambda: index.search(question), args.iterations) if index else []
+        all_lookups.extend(lookups)
+        all_searches.extend(searches)
+        results["questions"].append({
+            "question": question,
+            "table": lookup.table if lookup else None,
+            "templated": bool(lookup and lookup.answer),
+            "lookup": stats(lookups),
+            "bm25": stats(searches) if searches else None,
+        })
+    results["lookup"] = stats(all_lookups)
+    results["bm25"] = stats(all_searches) if all_searches else None
+
+    print(f"tables: {results['db_bytes'] // 1024} kB, cold open {results['cold_open_ms']} ms")
+    for row in results["questions"]:
+        bm25 = f"  bm25 p50={row['bm25']['p50_us']}us" if row["bm25"] else ''
+        print(f"  {row['question'][:48]:<48} {str(row['table']):<9} {'template' if row['templated'] else '        '}"
+              f"  lookup p50={row['lookup']['p50_us']}us ({row['lookup']['per_s']}/s){bm25}")
+    print(f"overall lookup mean={results['lookup']['mean_us']}us ({results['lookup']['per_s']}/s)"
+          + (f", bm25 mean={results['bm25']['mean_us']}us" if results["bm25"] else ''))
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Query normalization benchmark: throughput and how well paraphrases converge.
+
+Groups of questions that mean the same thing (English, Filipino and Taglish
+phrasings) are run through the shared normalizer. For each paraphrase it
+reports whether it gets the same answer cache key as the first question of
+its group, the term overlap (Jaccard) of the two, and whether retrieval puts
+the same passage first. Pairs of questions that only differ in their question
+word or word order must get different cache keys; any that collide are
+reported and fail the run, as do suggested follow-ups (which are prefetched
+into the answer cache) that share a key with a different question, and so
+does paraphrase convergence below --min-same-key. It also measures normalization cost per message,
+uncached and through the memo.
+
+    python benchmarks/bench_normalization.py
+    python benchmarks/bench_normalization.py --repeats 2000 --out normalization.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+import answer_cache  # noqa: E402
+import follow_ups  # noqa: E402
+import knowledge_base  # noqa: E402
+import normalization  # noqa: E402
+
+GROUPS = [
+    ["Where is the library?", "saan ang library", "nasaan ang aklatan", "saan matatagpuan ang silid-aklatan"],
+    ["What are the enrollment requirements?", "ano requirements sa enrollment",
+     "ano ang mga kailangan sa pagpapatala", "enrollment reqs", "mga requirements para mag-enroll"],
+    ["What strands are offered in senior high?", "anong mga strand ang meron sa SHS", "what strands does shs offer"],
+    ["How much is the tuition fee?", "magkano ang bayad", "magkano matrikula", "tuition fees"],
+    ["Who are the ICT teachers?", "sino ang mga guro sa ict", "ict faculty", "sino teacher ng ICT"],
+    ["What is the grading system?", "paano ang grading", "ano ang sistema ng pagmamarka"],
+    ["What are the school rules?", "ano ang mga patakaran ng paaralan", "school regulations"],
+    ["When is enrollment?", "kailan ang enrollment", "kailan pwede mag-enroll", "kailan ang pagpapatala"],
+    ["What is HUMSS?", "ano ang humms", "ano po ang Humanities and Social Sciences strand"],
+    ["Are there scholarships?", "may scholarship ba", "meron bang iskolarship"],
+    ["What are the guidance office hours?", "anong oras bukas ang guidance office", "guidance office schedule"],
+    ["What subjects are in STEM?", "anong mga asignatura sa STEM", "stem subjects"],
+]
+
+# Different questions that share terms; each pair must get different answer cache keys
+DISTINCT = [
+    ("When is enrollment?", "Where is enrollment?"),
+    ("When is enrollment?", "How do I enroll?"),
+    ("Where is enrollment?", "How do I enroll?"),
+    ("Kailan ang enrollment?", "Saan ang enrollment?"),
+    ("Kailan ang enrollment?", "How do I enroll?"),
+    ("Where is the registrar?", "Who is the registrar?"),
+    ("STEM to ABM", "ABM to STEM"),
+    ("Can I shift from STEM to ABM?", "Can I shift from ABM to STEM?"),
+]
+
+# Questions students type that share terms with a suggested follow-up without asking it
+SUGGESTION_NEIGHBOURS = [
+    "How do I enroll?", "Where is enrollment?", "Saan ang enrollment?", "Who handles enrollment?",
+    "Who is the registrar?", "When is the registrar open?", "Is there tuition for STEM?",
+    "Who are the STEM students?", "Where are the STEM teachers?", "How many STEM subjects are there?",
+]
+
+
+def suggested_questions(language):
+    """Every follow-up question follow_ups.py can suggest in a language, with sample slots"""
+    questions = []
+    for with_slots, without in follow_ups.TEMPLATES.values():
+        for templates in (with_slots, without):
+            if templates is not None:
+                for grade in (11, 12):
+                    question = templates[language].format(strand="STEM", grade=grade, office="registrar")
+                    if question not in questions:
+                        questions.append(question)
+    return questions
+
+
+def top_passage(kb, question):
+    results = kb.retrieve(question, 1)[1]
+    if not results:
+        return None
+    passage = results[0][1]
+    return passage["doc"], passage["page"], passage["text"][:40]
+
+
+def bench_paraphrases(kb):
+    pairs = same_key = same_top = 0
+    overlap = 0.0
+    misses = []
+    for group in GROUPS:
+        reference = answer_cache.normalize_question(group[0])
+        reference_top = top_passage(kb, group[0]) if kb is not None else None
+        for question in group[1:]:
+            pairs += 1
+            key = answer_cache.normalize_question(question)
+            same_key += key == reference
+            a, b = set(reference.split()), set(key.split())
+            overlap += len(a & b) / max(1, len(a | b))
+            if kb is not None:
+                same_top += top_passage(kb, question) == reference_top
+            if key != reference:
+                misses.append({"question": question, "key": key, "reference": reference})
+    pairs_to_check = list(DISTINCT)
+    # A prefetched suggestion must only be served for its own question (or its translation)
+    for language in ("en", "fil"):
+        suggestions = suggested_questions(language)
+        for i, question in enumerate(suggestions):
+            pairs_to_check.extend((question, other) for other in suggestions[i + 1:] + SUGGESTION_NEIGHBOURS)
+    collisions = [{"questions": [a, b], "key": answer_cache.normalize_question(a)} for a, b in pairs_to_check
+                  if answer_cache.normalize_question(a) == answer_cache.normalize_question(b)]
+    results = {"pairs": pairs, "same_cache_key": same_key, "mean_jaccard": round(overlap / pairs, 3),
+               "cache_key_misses": misses, "distinct_pairs": len(pairs_to_check), "cache_key_collisions": collisions}
+    if kb is not None:
+        results["same_top_passage"] = same_top
+    return results
+
+
+def bench_throughput(repeats):
+    questions = [question for group in GROUPS for question in group]
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for question in questions:
+            normalization.normalize_uncached(question)
+    uncached = (time.perf_counter() - started) / (repeats * len(questions))
+
+    normalization._normalize_cached.cache_clear()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for question in questions:
+            normalization.normalize(question)
+    memoized = (time.perf_counter() - started) / (repeats * len(questions))
+    return {"uncached_us": round(uncached * 1e6, 2), "memoized_us": round(memoized * 1e6, 3),
+            "uncached_per_second": int(1 / uncached), "memoized_per_second": int(1 / memoized)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure query normalization cost and paraphrase agreement")
+    parser.add_argument('--repeats', type=int, default=500, help="Passes over the questions for throughput")
+    parser.add_argument('--no-retrieval', action='store_true', help="Skip the retrieval agreement check")
+    parser.add_argument('--min-same-key', type=float, default=0.75,
+                        help="Fail when fewer paraphrase pairs than this share their group's cache key")
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    kb = None if args.no_retrieval else knowledge_base.KnowledgeBaseLoader().get()
+    report = {"commit": git_commit(), "timestamp": int(time.time()), "args": vars(args),
+              "results": dict(bench_paraphrases(kb), **bench_throughput(args.repeats))}
+
+    results = report["results"]
+    print(f"Paraphrase pairs:        {results['pairs']}")
+    print(f"Same answer cache key:   {results['same_cache_key']}/{results['pairs']}")
+    print(f"Mean term overlap:       {results['mean_jaccard']}")
+    print(f"Distinct keys kept:      {results['distinct_pairs'] - len(results['cache_key_collisions'])}"
+          f"/{results['distinct_pairs']}")
+    if kb is not None:
+        print(f"Same top passage:        {results['same_top_passage']}/{results['pairs']}")
+    print(f"Normalize (uncached):    {results['uncached_us']} us/message ({results['uncached_per_second']}/s)")
+    print(f"Normalize (memoized):    {results['memoized_us']} us/message ({results['memoized_per_second']}/s)")
+    for miss in results["cache_key_misses"]:
+        print(f"  miss: {miss['question']!r} -> {miss['key']!r} (expected {miss['reference']!r})")
+    for collision in results["cache_key_collisions"]:
+        print(f"  COLLISION: {collision['questions'][0]!r} and {collision['questions'][1]!r} -> {collision['key']!r}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    converged = results["same_cache_key"] / results["pairs"]
+    if converged < args.min_same_key:
+        print(f"FAIL: {converged:.0%} of paraphrases share a cache key, below {args.min_same_key:.0%}")
+    if results["cache_key_collisions"] or converged < args.min_same_key:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
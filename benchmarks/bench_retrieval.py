@@ -0,0 +1,116 @@
+"""
+Compare prompt size and latency of whole-file mode against retrieval mode.
+
+Offline (default) it reports the locally measurable parts: the size of the
+grounding context sent per question and the time spent assembling the prompt.
+With --live and a real GEMINI_API_KEY it also asks Gemini for exact prompt
+token counts and measures end-to-end generate_content latency in both modes.
+
+    python benchmarks/bench_retrieval.py
+    python benchmarks/bench_retrieval.py --live --out bench_output.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('GEMINI_API_KEY', 'offline-benchmark')
+
+import app as chat_app  # noqa: E402
+import retrieval  # noqa: E402
+
+QUESTIONS = [
+    "What are the enrollment requirements for transferees?",
+    "What subjects does STEM have in grade 11?",
+    "How is the grading system computed?",
+    "Who are the ICT teachers?",
+    "What are the guidance office hours?",
+    "Saan matatagpuan ang library?",
+    "Tell me about the SHS voucher program",
+    "What are the school rules on uniforms?",
+]
+
+
+def estimate_tokens(chars):
+    """Rough token estimate (~4 characters per token) for offline runs"""
+    return chars // 4
+
+
+def contents_text(contents):
+    return ''.join(part.get("text", '') for msg in contents for part in msg["parts"])
+
+
+def count_tokens(contents):
+    genai = chat_app.model_backend.backend.genai()
+    model = genai.GenerativeModel(chat_app.GEMINI_MODEL_NAME, system_instruction=chat_app.SYSTEM_INSTRUCTION)
+    return model.count_tokens(contents).total_tokens
+
+
+def run_mode(mode, live, full_text):
+    chat_app.app.config['CONTEXT_MODE'] = mode
+    rows = []
+    for question in QUESTIONS:
+        row = {"question": question}
+        if mode == 'file' and not live:
+            # Whole-file mode needs an upload; offline, use the PDF's extracted text as a lower bound
+            row["context_chars"] = len(full_text)
+        else:
+            start = time.perf_counter()
+            contents = chat_app.build_contents(question, [])
+            row["build_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            row["context_chars"] = len(contents_text(contents))
+        row["est_prompt_tokens"] = estimate_tokens(row["context_chars"])
+
+        if live:
+            row["prompt_tokens"] = count_tokens(contents)
+            start = time.perf_counter()
+            chat_app.model_backend.generate_content(contents, chat_app.SYSTEM_INSTRUCTION)
+            row["generate_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        rows.append(row)
+    return rows
+
+
+def summarize(rows):
+    summary = {}
+    for key in ("build_ms", "context_chars", "est_prompt_tokens", "prompt_tokens", "generate_ms"):
+        values = [row[key] for row in rows if key in row]
+        if values:
+            summary[key] = {"mean": round(statistics.mean(values), 3), "max": max(values)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--live', action='store_true', help="Call Gemini for token counts and latency")
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.live and os.environ['GEMINI_API_KEY'] == 'offline-benchmark':
+        parser.error("--live needs a real GEMINI_API_KEY")
+
+    full_text = ' '.join(retrieval.extract_pdf_pages(chat_app.PDF_FILE_PATH))
+
+    results = {}
+    for mode in ('file', 'retrieval'):
+        rows = run_mode(mode, args.live, full_text)
+        results[mode] = {"summary": summarize(rows), "questions": rows}
+
+    for mode, result in results.items():
+        print(f"== {mode} mode")
+        for key, stats in result["summary"].items():
+            print(f"  {key:<18} mean={stats['mean']:<12} max={stats['max']}")
+
+    before = results['file']['summary']['context_chars']['mean']
+    after = results['retrieval']['summary']['context_chars']['mean']
+    print(f"Context size reduced {before / max(after, 1):.1f}x ({before:.0f} -> {after:.0f} chars per turn)")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
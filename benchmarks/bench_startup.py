@@ -0,0 +1,116 @@
+"""
+Cold-start benchmark: import time and time to first byte of the first requests.
+
+Every run starts a fresh Python process (like a new serverless instance),
+imports the app with the fake model backend and measures:
+
+- process start until `import app` returns, and the import alone
+- time to first byte of the first GET / and of the first GET /chatbot
+  (with a logged-in session)
+- whether the Gemini SDK or authlib were imported along the way
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 20 --out startup.json
+
+Results are printed and written as JSON with the current commit so cold-start
+regressions can be tracked.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Modules that should stay out of a cold start that only serves pages
+HEAVY_MODULES = ('google.generativeai', 'grpc', 'authlib', 'PyPDF2')
+
+
+def first_byte_ms(client, path):
+    """Milliseconds until the first chunk of the response body"""
+    started = time.perf_counter()
+    response = client.get(path, buffered=False)
+    next(iter(response.response), b'')
+    elapsed = (time.perf_counter() - started) * 1000
+    response.close()
+    return round(elapsed, 2), response.status_code
+
+
+def child():
+    """One cold start, run in a fresh process; prints its measurements as JSON"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import app as chat_app
+
+    result = {"import_ms": round((time.perf_counter() - started) * 1000, 2)}
+    client = chat_app.app.test_client()
+    result["home_ttfb_ms"], result["home_status"] = first_byte_ms(client, '/')
+    with client.session_transaction() as session:
+        session['user'] = {'email': 'bench@example.com', 'name': 'Bench', 'picture': ''}
+    result["chatbot_ttfb_ms"], result["chatbot_status"] = first_byte_ms(client, '/chatbot')
+    result["loaded"] = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(json.dumps(result))
+
+
+def run_once(env):
+    started = time.perf_counter()
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child'],
+                                     cwd=ROOT, env=env, text=True, stderr=subprocess.DEVNULL)
+    total_ms = (time.perf_counter() - started) * 1000
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = round(total_ms, 2)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(runs, key):
+    values = sorted(run[key] for run in runs)
+    return {
+        "median": round(statistics.median(values), 2),
+        "p95": values[max(0, round(0.95 * len(values)) - 1)],
+        "min": values[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import time and first-request latency")
+    parser.add_argument('--runs', type=int, default=10, help="Cold starts to measure")
+    parser.add_argument('--warm-up', action='store_true', help="Keep WARM_UP_ON_STARTUP background loading on")
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    env = dict(os.environ, MODEL_BACKEND='fake', SECRET_KEY='bench-startup',
+               WARM_UP_ON_STARTUP='1' if args.warm_up else '0',
+               DATA_DIR=os.path.join(tempfile.gettempdir(), 'ask_lagronian_bench_startup'))
+    runs = [run_once(env) for _ in range(args.runs)]
+
+    report = {"commit": git_commit(), "timestamp": int(time.time()), "args": vars(args), "summary": {}, "runs": runs}
+    for key in ("process_ms", "import_ms", "home_ttfb_ms", "chatbot_ttfb_ms"):
+        report["summary"][key] = summarize(runs, key)
+        stats = report["summary"][key]
+        print(f"{key:<16} median={stats['median']:<9} p95={stats['p95']:<9} min={stats['min']}")
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    print(f"Heavy modules loaded: {', '.join(loaded) or 'none'}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
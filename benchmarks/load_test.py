@@ -0,0 +1,286 @@
+"""
+Load generator for /send_message and /clear_history.
+
+By default it starts the app locally with the fake model backend
+(MODEL_BACKEND=fake) in 1, 2, ... worker processes and drives realistic
+multi-turn sessions against them, so throughput can be measured without
+spending Gemini quota. Each simulated student gets a signed Flask session
+cookie with a logged-in user, exactly what the OAuth callback would set.
+
+    python benchmarks/load_test.py --workers 1 2 4 --sessions 200 --concurrency 32
+    python benchmarks/load_test.py --latency uniform:200-1200 --error-rate 0.02 --stream-ratio 0.5
+    python benchmarks/load_test.py --url http://localhost:5000 --secret-key "$SECRET_KEY"
+
+Results (p50/p95/p99 latency, requests per second, worker memory growth) are
+printed and written as JSON so runs can be compared across commits.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CONVERSATIONS = [
+    ["Hi", "My name is Ana", "What strands are offered?", "What subjects are in STEM for grade 11?", "Yes"],
+    ["What are the enrollment requirements?", "How about for transferees?", "No"],
+    ["Ano ang requirements sa enrollment?", "Saan ang registrar?", "Salamat!"],
+    ["What is the grading system?", "How is the initial grade computed?", "Yes"],
+    ["Who are the ICT teachers?", "I'm grade 12 TVL-ICT", "What subjects will I have next semester?"],
+    ["Tell me about the SHS voucher program", "Who can apply?", "Yes"],
+    ["Saan matatagpuan ang aklatan?", "Ano ang library process?"],
+    ["What are the guidance office hours?", "Who is in charge?", "Yes"],
+    ["What is HUMSS?", "Compare HUMSS and ABM", "What careers fit ABM?", "No"],
+    ["What are the school rules on uniforms?", "What happens if I'm late?"],
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return round(ordered[rank - 1], 1)
+
+
+def mint_session_cookie(secret_key, email):
+    """Signed Flask session for a logged-in user, as set by /authorize"""
+    from flask import Flask
+
+    signer_app = Flask('load_test')
+    signer_app.secret_key = secret_key
+    serializer = signer_app.session_interface.get_signing_serializer(signer_app)
+    return serializer.dumps({
+        "user": {"email": email, "name": email.split('@')[0], "picture": None},
+        "session_id": str(uuid.uuid4())
+    })
+
+
+def rss_kb(pid):
+    """Resident set size of a process in kB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _serve(port, env):
+    os.environ.update(env)
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import logging
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # Failures are counted by the load generator; keep worker output quiet
+    logging.getLogger('app').setLevel(logging.CRITICAL)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def start_workers(count, base_port, env):
+    ctx = multiprocessing.get_context('spawn')
+    workers = []
+    for i in range(count):
+        process = ctx.Process(target=_serve, args=(base_port + i, env), daemon=True)
+        process.start()
+        workers.append((process, f"http://127.0.0.1:{base_port + i}"))
+
+    for _, url in workers:
+        deadline = time.time() + 60
+        while True:
+            try:
+                if requests.get(f"{url}/", timeout=2).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"Worker at {url} did not start")
+            time.sleep(0.2)
+    return workers
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, status, latency_ms, ttft_ms=None):
+        with self._lock:
+            self.samples.append((endpoint, status, latency_ms, ttft_ms))
+
+
+def send(http, url, endpoint, payload, recorder):
+    start = time.perf_counter()
+    ttft_ms = None
+    try:
+        if payload.get("stream"):
+            with http.post(f"{url}/{endpoint}", json=payload, stream=True, timeout=120) as response:
+                status = response.status_code
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - start) * 1000
+                    if b'"type": "error"' in line:
+                        # Streams report upstream failures in-band after a 200
+                        status = 502
+        else:
+            response = http.post(f"{url}/{endpoint}", json=payload, timeout=120)
+            status = response.status_code
+    except requests.RequestException:
+        status = 0
+    recorder.add(endpoint, status, (time.perf_counter() - start) * 1000, ttft_ms)
+
+
+def run_session(n, url, secret_key, args, recorder):
+    rng = random.Random(args.seed * 100003 + n)
+    http = requests.Session()
+    http.cookies.set('session', mint_session_cookie(secret_key, f"student{n}@example.com"))
+
+    start = time.perf_counter()
+    response = http.get(f"{url}/chatbot", timeout=30)
+    recorder.add('chatbot', response.status_code, (time.perf_counter() - start) * 1000)
+
+    for message in rng.choice(CONVERSATIONS):
+        payload = {"message": message, "stream": rng.random() < args.stream_ratio}
+        send(http, url, 'send_message', payload, recorder)
+        if args.think_time:
+            time.sleep(rng.uniform(0, args.think_time))
+    if rng.random() < args.clear_ratio:
+        send(http, url, 'clear_history', {}, recorder)
+
+
+def summarize(samples, elapsed):
+    summary = {"requests": len(samples), "duration_s": round(elapsed, 2),
+               "rps": round(len(samples) / elapsed, 2) if elapsed else None, "endpoints": {}}
+    for endpoint in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == endpoint]
+        latencies = [s[2] for s in rows]
+        ttfts = [s[3] for s in rows if s[3] is not None]
+        summary["endpoints"][endpoint] = {
+            "requests": len(rows),
+            "errors": sum(1 for s in rows if not 200 <= s[1] < 300),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "ttft_p50_ms": percentile(ttfts, 50),
+            "ttft_p95_ms": percentile(ttfts, 95)
+        }
+    return summary
+
+
+def run(worker_count, args):
+    secret_key = args.secret_key or uuid.uuid4().hex
+    workers = []
+    if args.url:
+        urls = [args.url]
+    else:
+        env = {
+            "MODEL_BACKEND": "fake",
+            "GEMINI_API_KEY": "",
+            "SECRET_KEY": secret_key,
+            "DATA_DIR": tempfile.mkdtemp(prefix='ask_lagronian_load_'),
+            "FAKE_MODEL_LATENCY": args.latency,
+            "FAKE_MODEL_ERROR_RATE": str(args.error_rate),
+            "FAKE_MODEL_CHUNKS": str(args.chunks),
+            "FAKE_MODEL_CHUNK_DELAY_MS": str(args.chunk_delay),
+            "FAKE_MODEL_SEED": str(args.seed),
+        }
+        env.update(dict(kv.split('=', 1) for kv in args.env))
+        workers = start_workers(worker_count, args.port, env)
+        urls = [url for _, url in workers]
+
+    rss_before = [rss_kb(process.pid) for process, _ in workers]
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        # Sessions stick to one worker, like a load balancer with session affinity
+        futures = [pool.submit(run_session, n, urls[n % len(urls)], secret_key, args, recorder)
+                   for n in range(args.sessions)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    rss_after = [rss_kb(process.pid) for process, _ in workers]
+
+    for process, _ in workers:
+        process.terminate()
+        process.join(5)
+
+    result = summarize(recorder.samples, elapsed)
+    result["workers"] = worker_count if workers else None
+    if workers and None not in rss_before + rss_after:
+        result["memory_kb"] = {
+            "rss_before": rss_before,
+            "rss_after": rss_after,
+            "growth_per_worker": [after - before for before, after in zip(rss_before, rss_after)]
+        }
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the chat endpoints")
+    parser.add_argument('--url', help="Target an already running server instead of starting local workers")
+    parser.add_argument('--secret-key', help="SECRET_KEY of the target server (required with --url)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help="Worker process counts to compare")
+    parser.add_argument('--port', type=int, default=5100, help="First port for local workers")
+    parser.add_argument('--sessions', type=int, default=100, help="Simulated student sessions per run")
+    parser.add_argument('--concurrency', type=int, default=16, help="Sessions running at the same time")
+    parser.add_argument('--stream-ratio', type=float, default=0.5, help="Fraction of messages sent with stream=true")
+    parser.add_argument('--clear-ratio', type=float, default=0.2, help="Fraction of sessions ending with /clear_history")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Max random pause between turns (s)")
+    parser.add_argument('--latency', default='lognormal:800,0.4', help="Fake model latency distribution")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fake model error rate")
+    parser.add_argument('--chunks', type=int, default=8, help="Fake model streamed chunks per answer")
+    parser.add_argument('--chunk-delay', type=float, default=40, help="Fake model delay between chunks (ms)")
+    parser.add_argument('--env', nargs='*', default=[], help="Extra KEY=VALUE settings for local workers")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.url and not args.secret_key:
+        parser.error("--url needs --secret-key to sign session cookies")
+
+    report = {"commit": git_commit(), "timestamp": int(time.time()), "args": vars(args), "runs": []}
+    for worker_count in ([None] if args.url else args.workers):
+        result = run(worker_count, args)
+        report["runs"].append(result)
+        print(f"== workers={result['workers'] or 'external'}  {result['requests']} requests "
+              f"in {result['duration_s']}s ({result['rps']} req/s)")
+        for endpoint, stats in result["endpoints"].items():
+            print(f"  {endpoint:<14} n={stats['requests']:<5} errors={stats['errors']:<4} "
+                  f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms"
+                  + (f" ttft_p50={stats['ttft_p50_ms']}ms" if stats['ttft_p50_ms'] is not None else ''))
+        if "memory_kb" in result:
+            print(f"  memory growth per worker (kB): {result['memory_kb']['growth_per_worker']}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
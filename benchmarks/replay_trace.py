@@ -0,0 +1,180 @@
+"""
+Replay a recorded day of chat traffic against the app, offline.
+
+Record real traffic by running the app with MODEL_RECORD=traffic.ndjson. The
+file holds every incoming message and every Gemini call (see model_backend.py).
+This script starts the current checkout with MODEL_BACKEND=replay on that
+file and sends the recorded messages again: each recorded session becomes a
+simulated logged-in student sending its messages in order, at their recorded
+offsets from the start of the trace. Model answers, token counts and latency
+come from the recording, so two commits can be compared on the same traffic.
+
+    python benchmarks/replay_trace.py traffic.ndjson --out replay.json
+    python benchmarks/replay_trace.py traffic.ndjson --speed 10 --model-time-scale 0.5
+    python benchmarks/replay_trace.py traffic.ndjson --speed 0 --workers 2
+
+--speed compresses the arrival schedule (0 sends every session as soon as
+there is room under --concurrency); --model-time-scale scales recorded model
+latency. Reported: latency per endpoint, throughput, model calls and tokens
+from each worker's /metrics, and how the replayed calls matched the recording
+(exact contents, same message with a changed prompt, or not recorded).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from load_test import Recorder, git_commit, mint_session_cookie, send, start_workers, summarize  # noqa: E402
+from model_backend import load_recording  # noqa: E402
+
+METRIC_LINE = re.compile(r'^(ask_lagronian_[a-z_]+)(\{[^}]*\})? (\S+)$')
+RESULT_LABEL = re.compile(r'result="([^"]+)"')
+
+
+def sessions_from(recorded_requests, limit=None):
+    """Recorded messages grouped by session, each with its offset from the first message (s)"""
+    if limit:
+        recorded_requests = recorded_requests[:limit]
+    start = min((r["t"] for r in recorded_requests), default=0)
+    sessions = OrderedDict()
+    for record in sorted(recorded_requests, key=lambda r: r["t"]):
+        sessions.setdefault(record["session"], []).append(
+            (record["t"] - start, record["message"], record.get("stream", False)))
+    return list(sessions.values())
+
+
+def run_session(n, messages, url, secret_key, speed, started, recorder):
+    http = requests.Session()
+    http.cookies.set('session', mint_session_cookie(secret_key, f"replay{n}@example.com"))
+    for offset, message, stream in messages:
+        if speed:
+            delay = offset / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        send(http, url, 'send_message', {"message": message, "stream": stream}, recorder)
+
+
+def scrape_metrics(url, token=None):
+    """Counters and histogram sums of one worker, summed over label sets"""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    totals = {}
+    try:
+        text = requests.get(f"{url}/metrics", headers=headers, timeout=10).text
+    except requests.RequestException:
+        return totals
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        if name == 'ask_lagronian_replay_lookups_total':
+            name = 'replay_' + RESULT_LABEL.search(labels).group(1)
+        try:
+            totals[name] = totals.get(name, 0) + float(value)
+        except ValueError:
+            continue
+    return totals
+
+
+def model_summary(per_worker):
+    total = {}
+    for metrics in per_worker:
+        for name, value in metrics.items():
+            total[name] = total.get(name, 0) + value
+    calls = total.get('ask_lagronian_prompt_tokens_count', 0)
+    summary = {
+        "model_calls": int(calls),
+        "prompt_tokens": int(total.get('ask_lagronian_prompt_tokens_sum', 0)),
+        "response_tokens": int(total.get('ask_lagronian_response_tokens_sum', 0)),
+        "replay": {result: int(total.get(f"replay_{result}", 0)) for result in ('exact', 'message', 'miss')}
+    }
+    summary["prompt_tokens_per_call"] = round(summary["prompt_tokens"] / calls, 1) if calls else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded chat traffic against the app")
+    parser.add_argument('trace', help="NDJSON file recorded with MODEL_RECORD")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Arrival schedule speed-up (1 = recorded pace, 0 = as fast as possible)")
+    parser.add_argument('--model-time-scale', type=float, default=1.0,
+                        help="Multiplier on recorded model latency (0 = instant answers)")
+    parser.add_argument('--workers', type=int, default=1, help="Local worker processes")
+    parser.add_argument('--port', type=int, default=5200, help="First port for local workers")
+    parser.add_argument('--concurrency', type=int, default=64, help="Sessions running at the same time")
+    parser.add_argument('--limit', type=int, help="Only replay the first N recorded messages")
+    parser.add_argument('--env', nargs='*', default=[], help="Extra KEY=VALUE settings for the workers")
+    parser.add_argument('--out', help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    recorded_requests, calls = load_recording(args.trace)
+    sessions = sessions_from(recorded_requests, args.limit)
+    if not sessions:
+        parser.error(f"{args.trace} has no recorded messages")
+    print(f"Replaying {sum(len(s) for s in sessions)} messages in {len(sessions)} sessions "
+          f"({len(calls)} recorded model calls)")
+
+    secret_key = uuid.uuid4().hex
+    env = {
+        "MODEL_BACKEND": "replay",
+        "MODEL_REPLAY_FILE": os.path.abspath(args.trace),
+        "MODEL_REPLAY_TIME_SCALE": str(args.model_time_scale),
+        "MODEL_RECORD": "",
+        "GEMINI_API_KEY": "",
+        "SECRET_KEY": secret_key,
+        "DATA_DIR": tempfile.mkdtemp(prefix='ask_lagronian_replay_'),
+        "WARM_UP_ON_STARTUP": "0",
+        "METRICS_TOKEN": "",
+    }
+    env.update(dict(kv.split('=', 1) for kv in args.env))
+    workers = start_workers(args.workers, args.port, env)
+    urls = [url for _, url in workers]
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(run_session, n, messages, urls[n % len(urls)], secret_key, args.speed,
+                                   started, recorder)
+                       for n, messages in enumerate(sessions)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+        model = model_summary([scrape_metrics(url, env["METRICS_TOKEN"]) for url in urls])
+    finally:
+        for process, _ in workers:
+            process.terminate()
+            process.join(5)
+
+    result = summarize(recorder.samples, elapsed)
+    result["model"] = model
+    report = {"commit": git_commit(), "timestamp": int(time.time()), "args": vars(args), "results": result}
+
+    print(f"{result['requests']} requests in {result['duration_s']}s ({result['rps']} req/s)")
+    for endpoint, stats in result["endpoints"].items():
+        print(f"  {endpoint:<14} n={stats['requests']:<5} errors={stats['errors']:<4} "
+              f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms"
+              + (f" ttft_p50={stats['ttft_p50_ms']}ms" if stats['ttft_p50_ms'] is not None else ''))
+    print(f"  model calls={model['model_calls']} prompt_tokens={model['prompt_tokens']} "
+          f"({model['prompt_tokens_per_call']}/call) response_tokens={model['response_tokens']}")
+    print(f"  replay matches: exact={model['replay']['exact']} message={model['replay']['message']} "
+          f"miss={model['replay']['miss']}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Token-budgeted conversation window.
+
+Recent messages are kept verbatim until HISTORY_TOKEN_BUDGET is spent; older
+turns are folded into a running summary that is regenerated in a background
+thread, never on the request path. User details that section 16 of the system
+instruction asks the bot to track (name, grade level, strand) are extracted
+from the whole history and always sent.
+"""
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Per-message framing overhead in tokens (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+MAX_SUMMARY_SESSIONS = 10000
+
+NAME_PATTERN = re.compile(
+    r"(?i:\b(?:my name is|my name's|call me|i am|i'm|im|ako si|ako po si|pangalan ko ay|pangalan ko ay si)\s+)"
+    r"([A-Za-zÀ-ÿñÑ][A-Za-zÀ-ÿñÑ'\-]+(?:\s+[A-Z][A-Za-zÀ-ÿñÑ'\-]+)?)"
+)
+NAME_STOPWORDS = frozenset("""
+a an the in from grade g11 g12 interested asking looking here new not just so also
+currently going planning transferee student parent guardian po na taking enrolled
+""".split())
+GRADE_PATTERN = re.compile(r"(?i)\b(?:grade|baitang|g)\s*-?\s*(11|12)\b|\b(11|12)(?:th)?\s+grade\b")
+STRAND_PATTERN = re.compile(
+    r"(?i)\b(stem|humss|humms|abm|gas|tvl[\s-]*(?:ict|he|ia)|tvl|ict|home economics|industrial arts)\b"
+)
+STRAND_NAMES = {
+    "humms": "HUMSS", "home economics": "TVL-HE", "industrial arts": "TVL-IA", "ict": "TVL-ICT"
+}
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def message_tokens(message):
+    return estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def canonical_strand(raw):
+    key = re.sub(r'[\s-]+', ' ', raw.lower()).strip()
+    if key.startswith('tvl '):
+        return 'TVL-' + key[4:].upper()
+    return STRAND_NAMES.get(key, key.upper())
+
+
+def extract_user_facts(messages):
+    """Name, grade level and strand mentioned by the user, latest mention wins"""
+    facts = {}
+    previous = None
+    for message in messages:
+        if message.role == "user":
+            text = message.content
+            match = NAME_PATTERN.search(text)
+            if match and match.group(1).split()[0].lower() not in NAME_STOPWORDS:
+                facts["name"] = match.group(1)
+            elif previous is not None and "your name" in previous.content.lower():
+                # A short reply to the intro question ("what's your name?") is the name itself
+                words = text.strip().rstrip('.!').split()
+                if 1 <= len(words) <= 3 and all(w.isalpha() for w in words):
+                    facts["name"] = ' '.join(w.capitalize() for w in words)
+
+            grade = GRADE_PATTERN.search(text)
+            if grade:
+                facts["grade_level"] = f"Grade {grade.group(1) or grade.group(2)}"
+
+            strands = STRAND_PATTERN.findall(text)
+            if strands:
+                facts["strand"] = canonical_strand(strands[-1])
+        previous = message
+    return facts
+
+
+def format_facts(facts):
+    labels = (("name", "Name"), ("grade_level", "Grade level"), ("strand", "Strand of interest"))
+    return '; '.join(f"{label}: {facts[key]}" for key, label in labels if key in facts)
+
+
+def fallback_summary(messages):
+    """Extractive summary used until the background summary is ready"""
+    topics = [m.content.strip().split('\n')[0][:120] for m in messages if m.role == "user"]
+    return "Earlier the student asked about: " + ' | '.join(topics[-8:]) if topics else ''
+
+
+def _message_id(message):
+    return hashlib.sha1(f"{message.role}\0{message.timestamp}\0{message.content}".encode('utf-8')).hexdigest()
+
+
+def _messages_after(messages, marker):
+    """Messages that come after the one identified by marker (all of them if it is gone)"""
+    for i in range(len(messages) - 1, -1, -1):
+        if _message_id(messages[i]) == marker:
+            return messages[i + 1:]
+    return messages
+
+
+class RollingSummarizer:
+    """Keeps one running summary per session and refreshes it in the background
+
+    When given, capture() runs on the caller's thread as a refresh is scheduled and its
+    result is passed on as summarize's third argument (e.g. who to charge for the call).
+    """
+
+    def __init__(self, summarize, min_new_messages=4, max_workers=2, max_sessions=MAX_SUMMARY_SESSIONS,
+                 capture=None):
+        self._summarize = summarize
+        self._capture = capture
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='summary')
+        # session_id -> (id of the last message folded into the summary, summary)
+        self._summaries = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.min_new_messages = min_new_messages
+        self.max_sessions = max_sessions
+
+    def get(self, session_id, folded_messages):
+        """Latest summary for the session; schedules a refresh once enough new turns are folded"""
+        with self._lock:
+            entry = self._summaries.get(session_id)
+            if entry is not None:
+                self._summaries.move_to_end(session_id)
+                new_messages = _messages_after(folded_messages, entry[0])
+            else:
+                new_messages = folded_messages
+            stale = entry is None or len(new_messages) >= self.min_new_messages
+            if stale and new_messages and session_id not in self._pending:
+                self._pending.add(session_id)
+                previous = entry[1] if entry else None
+                captured = (self._capture(),) if self._capture is not None else ()
+                self._executor.submit(self._refresh, session_id, list(new_messages), previous, captured)
+        if entry is None:
+            return fallback_summary(folded_messages)
+        if new_messages:
+            # Turns folded since the last refresh aren't in the summary yet
+            return f"{entry[1]} {fallback_summary(new_messages)}"
+        return entry[1]
+
+    def forget(self, session_id):
+        with self._lock:
+            self._summaries.pop(session_id, None)
+
+    def _refresh(self, session_id, new_messages, previous, captured=()):
+        try:
+            summary = self._summarize(previous, new_messages, *captured)
+            with self._lock:
+                self._summaries[session_id] = (_message_id(new_messages[-1]), summary)
+                self._summaries.move_to_end(session_id)
+                while len(self._summaries) > self.max_sessions:
+                    self._summaries.popitem(last=False)
+        except Exception as e:
+            logger.error(f"Session {session_id}: Summary refresh failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+
+
+def build_history_window(history, budget, summarizer=None, session_id=None):
+    """Split history into a verbatim window within the token budget and a summary of the rest
+
+    Returns (window, context_text, stats) where context_text holds the summary and
+    tracked user facts (or '' when there is nothing to add).
+    """
+    full_tokens = sum(message_tokens(m) for m in history)
+
+    kept = 0
+    used = 0
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if used + cost > budget:
+            break
+        used += cost
+        kept += 1
+
+    # The window has to start with a user turn to keep roles alternating
+    start = len(history) - kept
+    while start < len(history) and history[start].role != "user":
+        used -= message_tokens(history[start])
+        start += 1
+    window = history[start:]
+    folded = history[:start]
+
+    parts = []
+    if folded:
+        if summarizer is not None and session_id is not None:
+            summary = summarizer.get(session_id, folded)
+        else:
+            summary = fallback_summary(folded)
+        if summary:
+            parts.append(f"Summary of the earlier conversation: {summary}")
+    facts = format_facts(extract_user_facts(history))
+    if facts:
+        parts.append(f"Details the student shared: {facts}")
+    context_text = '\n'.join(parts)
+
+    sent_tokens = used + (estimate_tokens(context_text) + MESSAGE_OVERHEAD_TOKENS if context_text else 0)
+    stats = {
+        "history_tokens": full_tokens,
+        "sent_tokens": sent_tokens,
+        "saved_tokens": max(0, full_tokens - sent_tokens),
+        "window_messages": len(window),
+        "folded_messages": len(folded)
+    }
+    return window, context_text, stats
@@ -0,0 +1,329 @@
+"""
+Per-user conversation list for the chat sidebar.
+
+The conversation history in history_store.py is the model's context window:
+keyed by session, capped and expiring. This store keeps every conversation of
+a logged-in user, so they can be listed and resumed after logging out.
+
+Listing and reading are paginated by keyset cursors rather than OFFSET, so the
+cost of a page doesn't grow with how far the user has scrolled:
+
+- conversations are listed newest activity first; the cursor encodes the
+  (updated_at, id) of the last row shown, served by an index on
+  (user, updated_at, id)
+- messages are read newest page first, in order within the page; the cursor
+  is the sequence number of the oldest message shown
+
+Two backends share the interface: SQLite (in DATA_DIR, shared by workers) and
+an in-process one for development.
+"""
+import base64
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from history_store import Message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+TITLE_LENGTH = 60
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that this store didn't issue"""
+
+
+def encode_cursor(*parts):
+    return base64.urlsafe_b64encode(':'.join(str(part) for part in parts).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, count):
+    """The cursor's parts as strings; raises InvalidCursor"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    parts = text.split(':', count - 1)
+    if len(parts) != count:
+        raise InvalidCursor(cursor)
+    return parts
+
+
+def make_title(text):
+    """Sidebar title from a conversation's first question"""
+    title = ' '.join(text.split())
+    if len(title) > TITLE_LENGTH:
+        title = title[:TITLE_LENGTH - 1].rsplit(' ', 1)[0] + '…'
+    return title or 'New conversation'
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class ConversationStore:
+    """Interface for conversation backends
+
+    Conversations are dicts with id, title, created_at, updated_at (epoch
+    milliseconds) and message_count. Every read takes the user so one user
+    can never page through another's conversations.
+    """
+
+    def create(self, user, title=None):
+        """Start an empty conversation for user and return it"""
+        raise NotImplementedError
+
+    def get(self, user, conversation_id):
+        """The user's conversation, or None"""
+        raise NotImplementedError
+
+    def list(self, user, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """(conversations, next_cursor) by most recent activity; next_cursor is None on the last page"""
+        raise NotImplementedError
+
+    def messages(self, user, conversation_id, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """(messages, next_cursor): the newest messages before cursor, oldest first"""
+        raise NotImplementedError
+
+    def append(self, conversation_id, messages):
+        """Add messages to a conversation and mark it as the most recent"""
+        raise NotImplementedError
+
+    def delete(self, user, conversation_id):
+        """Remove a conversation and its messages; False if the user has no such conversation"""
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class MemoryConversationStore(ConversationStore):
+    """Conversations in this process only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # conversation_id -> [user, conversation dict, messages]
+        self._conversations = {}
+
+    def create(self, user, title=None):
+        created = now_ms()
+        conversation = {"id": uuid.uuid4().hex, "title": title or 'New conversation',
+                        "created_at": created, "updated_at": created, "message_count": 0}
+        with self._lock:
+            self._conversations[conversation["id"]] = [user, conversation, []]
+        return dict(conversation)
+
+    def get(self, user, conversation_id):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            return dict(entry[1]) if entry and entry[0] == user else None
+
+    def list(self, user, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        after = None
+        if cursor:
+            updated_at, conversation_id = decode_cursor(cursor, 2)
+            after = (_int(updated_at, cursor), conversation_id)
+        with self._lock:
+            rows = [dict(c) for u, c, _ in self._conversations.values() if u == user]
+        rows.sort(key=lambda c: (c["updated_at"], c["id"]), reverse=True)
+        if after is not None:
+            rows = [c for c in rows if (c["updated_at"], c["id"]) < after]
+        return _page(rows, limit, lambda c: encode_cursor(c["updated_at"], c["id"]))
+
+    def messages(self, user, conversation_id, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None or entry[0] != user:
+                return [], None
+            history = list(entry[2])
+        end = len(history)
+        if cursor:
+            end = min(end, _int_cursor(cursor) - 1)
+        start = max(0, end - limit)
+        page = history[start:end]
+        return page, encode_cursor(start + 1) if start > 0 else None
+
+    def append(self, conversation_id, messages):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                return
+            conversation = entry[1]
+            if conversation["message_count"] == 0 and messages:
+                conversation["title"] = make_title(messages[0].content)
+            entry[2].extend(messages)
+            conversation["message_count"] = len(entry[2])
+            conversation["updated_at"] = max(now_ms(), conversation["updated_at"] + 1)
+
+    def delete(self, user, conversation_id):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None or entry[0] != user:
+                return False
+            del self._conversations[conversation_id]
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "conversations": len(self._conversations)}
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversations shared by all workers through SQLite"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " id TEXT PRIMARY KEY, user TEXT NOT NULL, title TEXT NOT NULL,"
+                " created_at INTEGER NOT NULL, updated_at INTEGER NOT NULL, message_count INTEGER NOT NULL)"
+            )
+            # Serves both the sidebar listing and its cursor, newest first
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_user_updated ON conversations (user, updated_at, id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_messages ("
+                " conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL,"
+                " content TEXT NOT NULL, timestamp INTEGER NOT NULL, PRIMARY KEY (conversation_id, seq))"
+                " WITHOUT ROWID"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def create(self, user, title=None):
+        created = now_ms()
+        conversation = {"id": uuid.uuid4().hex, "title": title or 'New conversation',
+                        "created_at": created, "updated_at": created, "message_count": 0}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO conversations VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation["id"], user, conversation["title"], created, created, 0)
+            )
+        return conversation
+
+    def get(self, user, conversation_id):
+        row = self._connect().execute(
+            "SELECT id, title, created_at, updated_at, message_count FROM conversations"
+            " WHERE id = ? AND user = ?", (conversation_id, user)
+        ).fetchone()
+        return _conversation_row(row) if row else None
+
+    def list(self, user, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        query = ("SELECT id, title, created_at, updated_at, message_count FROM conversations"
+                 " WHERE user = ?")
+        params = [user]
+        if cursor:
+            updated_at, conversation_id = decode_cursor(cursor, 2)
+            query += " AND (updated_at, id) < (?, ?)"
+            params += [_int(updated_at, cursor), conversation_id]
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        rows = self._connect().execute(query, params + [limit + 1]).fetchall()
+        return _page([_conversation_row(row) for row in rows], limit,
+                     lambda c: encode_cursor(c["updated_at"], c["id"]))
+
+    def messages(self, user, conversation_id, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM conversations WHERE id = ? AND user = ?",
+                        (conversation_id, user)).fetchone() is None:
+            return [], None
+        before = _int_cursor(cursor) if cursor else None
+        rows = conn.execute(
+            "SELECT seq, role, content, timestamp FROM conversation_messages WHERE conversation_id = ?"
+            + (" AND seq < ?" if before is not None else "") + " ORDER BY seq DESC LIMIT ?",
+            [conversation_id] + ([before] if before is not None else []) + [limit + 1]
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        page = [Message(role, content, timestamp) for _, role, content, timestamp in rows]
+        return page, encode_cursor(rows[0][0]) if more else None
+
+    def append(self, conversation_id, messages):
+        if not messages:
+            return
+        with self._connect() as conn:
+            # Take the write lock before reading the count, so two workers appending to one
+            # conversation can't both number their messages from the same count
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT message_count, updated_at FROM conversations WHERE id = ?",
+                               (conversation_id,)).fetchone()
+            if row is None:
+                return
+            count, updated_at = row
+            conn.executemany(
+                "INSERT INTO conversation_messages VALUES (?, ?, ?, ?, ?)",
+                [(conversation_id, count + i + 1, m.role, m.content, m.timestamp) for i, m in enumerate(messages)]
+            )
+            # Strictly increasing, so the cursor order is stable even within one millisecond
+            updated = max(now_ms(), updated_at + 1)
+            if count == 0:
+                conn.execute("UPDATE conversations SET title = ?, updated_at = ?, message_count = ? WHERE id = ?",
+                             (make_title(messages[0].content), updated, len(messages), conversation_id))
+            else:
+                conn.execute("UPDATE conversations SET updated_at = ?, message_count = ? WHERE id = ?",
+                             (updated, count + len(messages), conversation_id))
+
+    def delete(self, user, conversation_id):
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM conversations WHERE id = ? AND user = ?",
+                                   (conversation_id, user)).rowcount
+            if deleted:
+                conn.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+        return bool(deleted)
+
+    def stats(self):
+        conversations = self._connect().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        return {"backend": "sqlite", "conversations": conversations}
+
+
+def _page(rows, limit, cursor_of):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, cursor_of(rows[-1])
+    return rows, None
+
+
+def _int(value, cursor):
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def _int_cursor(cursor):
+    return _int(decode_cursor(cursor, 1)[0], cursor)
+
+
+def _conversation_row(row):
+    conversation_id, title, created_at, updated_at, message_count = row
+    return {"id": conversation_id, "title": title, "created_at": created_at,
+            "updated_at": updated_at, "message_count": message_count}
+
+
+def create_conversation_store(backend, data_dir):
+    """Build the configured conversation backend ('sqlite', 'memory' or 'off'), or None when off"""
+    if backend in ('off', 'none', ''):
+        return None
+    if backend == 'sqlite':
+        try:
+            return SQLiteConversationStore(os.path.join(data_dir, 'conversations.sqlite3'))
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not open conversation store in {data_dir} ({str(e)}), keeping them in memory")
+            return MemoryConversationStore()
+    if backend != 'memory':
+        logger.warning(f"Unknown CONVERSATION_STORE backend '{backend}', using memory")
+    return MemoryConversationStore()
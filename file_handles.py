@@ -0,0 +1,173 @@
+"""
+Shared handles for files uploaded to the Gemini File API.
+
+Gemini keeps an uploaded file for 48 hours. Instead of re-uploading the school
+PDF in every worker and on every cold start, the handle (URI, mime type and
+expiry) is stored in a small SQLite database keyed by the file's content hash.
+Uploads are single-flight: one thread per process and one process per machine
+performs an upload while the others wait and then reuse its result. Handles are
+refreshed in the background shortly before they expire.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from retrieval import file_sha256
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Gemini deletes uploaded files after 48 hours
+DEFAULT_FILE_TTL = 48 * 3600
+# Start refreshing this many seconds before a handle expires
+DEFAULT_REFRESH_MARGIN = 3600
+
+
+class FileHandleStore:
+    """SQLite table of uploaded file handles keyed by content hash"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_handles ("
+                " content_hash TEXT PRIMARY KEY,"
+                " name TEXT, uri TEXT NOT NULL, mime_type TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, uploaded_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def get(self, content_hash):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT name, uri, mime_type, expires_at, uploaded_at FROM file_handles WHERE content_hash = ?",
+                (content_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("name", "uri", "mime_type", "expires_at", "uploaded_at"), row))
+
+    def put(self, content_hash, handle):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO file_handles VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, handle["name"], handle["uri"], handle["mime_type"],
+                 handle["expires_at"], handle["uploaded_at"])
+            )
+
+
+class FileHandleManager:
+    """Upload a local file once and hand out its Gemini file handle"""
+
+    def __init__(self, file_path, store, mime_type='application/pdf',
+                 refresh_margin=DEFAULT_REFRESH_MARGIN, upload=None):
+        self.file_path = file_path
+        self.store = store
+        self.mime_type = mime_type
+        self.refresh_margin = refresh_margin
+        self._upload = upload or gemini_upload
+        self._lock = threading.Lock()
+        self._lock_path = f"{store.db_path}.lock"
+        self._content_hash = None
+        self._handle = None
+        self._refreshing = False
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = file_sha256(self.file_path)
+        return self._content_hash
+
+    def get(self):
+        """Return a usable handle, uploading only if no fresh one exists"""
+        handle = self._handle
+        now = time.time()
+        if handle is None or handle["expires_at"] <= now:
+            return self._refresh(force=False)
+
+        if handle["expires_at"] - now <= self.refresh_margin:
+            # Still valid: serve it and refresh off the request path
+            self._refresh_in_background()
+        return handle
+
+    def warm_up(self):
+        """Load or upload the handle in a background thread"""
+        thread = threading.Thread(target=self._safe_refresh, name='file-handle-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._safe_refresh, kwargs={"force": True},
+                         name='file-handle-refresh', daemon=True).start()
+
+    def _safe_refresh(self, force=False):
+        try:
+            self._refresh(force=force)
+        except Exception as e:
+            logger.error(f"Background refresh of {self.file_path} failed: {str(e)}")
+        finally:
+            self._refreshing = False
+
+    def _is_fresh(self, handle, force):
+        if handle is None:
+            return False
+        remaining = handle["expires_at"] - time.time()
+        return remaining > (self.refresh_margin if force else 0)
+
+    def _refresh(self, force=False):
+        # Single flight within this process...
+        with self._lock:
+            if self._is_fresh(self._handle, force):
+                return self._handle
+            # ...and across worker processes sharing the store
+            with self._file_lock():
+                handle = self.store.get(self.content_hash)
+                if not self._is_fresh(handle, force):
+                    handle = self._upload(self.file_path, self.mime_type)
+                    self.store.put(self.content_hash, handle)
+                    logger.info(f"Uploaded {os.path.basename(self.file_path)}: {handle['uri']}")
+                self._handle = handle
+                return handle
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def gemini_upload(file_path, mime_type):
+    """Upload a file with the Gemini File API and return its handle"""
+    import google.generativeai as genai
+
+    uploaded_file = genai.upload_file(file_path, mime_type=mime_type)
+    now = time.time()
+    expiration = getattr(uploaded_file, 'expiration_time', None)
+    expires_at = expiration.timestamp() if expiration else now + DEFAULT_FILE_TTL
+    return {
+        "name": uploaded_file.name,
+        "uri": uploaded_file.uri,
+        "mime_type": uploaded_file.mime_type,
+        "expires_at": expires_at,
+        "uploaded_at": now
+    }
@@ -0,0 +1,143 @@
+"""
+Suggested follow-up questions.
+
+After an answer about a strand, students almost always ask the obvious next
+thing: its subjects, its teachers, what it takes to enroll. The conversation
+topics that section 16 of the system instruction asks the bot to track (the
+strand and grade level from extract_user_facts, and the topic of the latest
+question as the knowledge tables parse it) select the next questions from a
+small table of likely follow-ups, in the student's language.
+
+Every suggestion names its strand, grade or office, so it reads the same
+without the conversation before it: it can be answered as a first-turn
+question, which is what lets the app prefetch and cache it.
+
+    python follow_ups.py "What is STEM?"
+    python follow_ups.py "I'm in grade 11" "magkano ang tuition sa ABM?"
+"""
+import argparse
+import re
+
+from context_builder import extract_user_facts
+from history_store import Message
+from answer_cache import normalize_question
+from intent_router import detect_language
+from knowledge_tables import parse_question
+
+DEFAULT_LIMIT = 3
+
+ENROLLMENT_PATTERN = re.compile(r"(?i)\b(enroll\w*|enrol\w*|requirements?|reqs|pagpapatala|mag-enroll|transferees?)\b")
+
+# Question templates by kind: (with the slots filled, without them); None when the kind needs its slot
+TEMPLATES = {
+    "subjects": ({"en": "What subjects does {strand} have in Grade {grade}?",
+                  "fil": "Ano ang mga subject ng {strand} sa Grade {grade}?"}, None),
+    "faculty": ({"en": "Who are the {strand} teachers?",
+                 "fil": "Sino ang mga teacher ng {strand}?"}, None),
+    "requirements": ({"en": "What are the requirements to enroll in {strand}?",
+                      "fil": "Ano ang mga requirements para mag-enroll sa {strand}?"},
+                     {"en": "What are the enrollment requirements?",
+                      "fil": "Ano ang mga requirements sa enrollment?"}),
+    "tuition": ({"en": "How much is the tuition for {strand}?",
+                 "fil": "Magkano ang tuition sa {strand}?"},
+                {"en": "How much is the tuition fee?",
+                 "fil": "Magkano ang tuition fee?"}),
+    "vouchers": (None, {"en": "How does the SHS voucher work?",
+                        "fil": "Paano gumagana ang SHS voucher?"}),
+    "strands": (None, {"en": "What strands does Lagro High School offer?",
+                       "fil": "Ano ang mga strand sa Lagro High School?"}),
+    "enrollment_schedule": (None, {"en": "When is enrollment?",
+                                   "fil": "Kailan ang enrollment?"}),
+    "office_hours": ({"en": "What are the {office} hours?",
+                      "fil": "Ano ang oras ng {office}?"}, None),
+    "office_location": ({"en": "Where is the {office}?",
+                         "fil": "Saan ang {office}?"}, None),
+    "light_offenses": (None, {"en": "What are the light offenses?",
+                              "fil": "Ano ang mga light offenses?"}),
+    "major_offenses": (None, {"en": "What are the major offenses?",
+                              "fil": "Ano ang mga major offenses?"}),
+}
+
+# Topic of the latest question -> kinds of question students most often ask next, most likely first
+FOLLOW_UPS = {
+    "strands": ["subjects", "faculty", "requirements", "tuition"],
+    "subjects": ["other_grade_subjects", "faculty", "requirements"],
+    "faculty": ["subjects", "requirements", "tuition"],
+    "fees": ["vouchers", "requirements", "strands"],
+    "enrollment": ["requirements", "enrollment_schedule", "strands", "tuition"],
+    "offices": ["office_location", "office_hours"],
+    "locations": ["office_hours", "strands"],
+    "rules": ["light_offenses", "major_offenses"],
+}
+
+
+def conversation_topics(messages):
+    """Tracked topics of a conversation: the latest question's topic, strand, grade, office and language"""
+    facts = extract_user_facts(messages)
+    last = next((m.content for m in reversed(messages) if m.role == "user"), '')
+    parsed = parse_question(last)
+    topic = parsed["topic"]
+    if topic is None and ENROLLMENT_PATTERN.search(last):
+        topic = "enrollment"
+    elif topic is None and parsed["strand"] is not None:
+        # "What is STEM?"
+        topic = "strands"
+    grade = parsed["grade"]
+    if grade is None and facts.get("grade_level"):
+        grade = int(facts["grade_level"].split()[-1])
+    return {
+        "topic": topic,
+        "strand": parsed["strand"] or facts.get("strand"),
+        "grade": grade,
+        "office": parsed["office"],
+        "language": detect_language(last),
+    }
+
+
+def _question(kind, topics):
+    grade = topics["grade"] or 11
+    if kind == "other_grade_subjects":
+        kind, grade = "subjects", 12 if grade == 11 else 11
+    with_slots, without = TEMPLATES[kind]
+    slot = "office" if kind.startswith("office_") else "strand"
+    if topics[slot] is not None and with_slots is not None:
+        return with_slots[topics["language"]].format(strand=topics["strand"], grade=grade, office=topics["office"])
+    return without[topics["language"]] if without is not None else None
+
+
+def suggest_follow_ups(messages, limit=DEFAULT_LIMIT):
+    """Up to limit likely next questions for a conversation (its latest message is the student's)"""
+    topics = conversation_topics(messages)
+    if topics["topic"] is None or limit <= 0:
+        return []
+    # Compared by answer cache key: a suggestion is only skipped when it is the question already asked
+    asked = {normalize_question(m.content) for m in messages if m.role == "user"}
+    suggestions = []
+    for kind in FOLLOW_UPS[topics["topic"]]:
+        question = _question(kind, topics)
+        if question is None or question in suggestions:
+            continue
+        key = normalize_question(question)
+        if key in asked:
+            continue
+        asked.add(key)
+        suggestions.append(question)
+        if len(suggestions) == limit:
+            break
+    return suggestions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the follow-up questions suggested after a conversation")
+    parser.add_argument('messages', nargs='+', help="The student's messages, oldest first")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    args = parser.parse_args()
+
+    history = [Message("user", text) for text in args.messages]
+    print(conversation_topics(history))
+    for question in suggest_follow_ups(history, args.limit):
+        print(f"- {question}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Conversation history storage.
+
+`HistoryStore` is the interface send_message and clear_history talk to. Three
+backends implement it:
+
+- MemoryHistoryStore: per-process, LRU with idle-TTL eviction and a global
+  memory cap, exposes resident-size stats
+- SQLiteHistoryStore: shared by every worker on the machine
+- FileHistoryStore: one small JSON file per session
+
+Messages are compact `Message` records (`__slots__`, integer timestamps).
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MESSAGES = 40
+DEFAULT_IDLE_TTL = 3600
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# How often (seconds) persistent backends sweep out idle sessions
+SWEEP_INTERVAL = 300
+
+
+class Message:
+    """A single chat message"""
+    __slots__ = ('role', 'content', 'timestamp')
+
+    def __init__(self, role, content, timestamp=None):
+        self.role = role
+        self.content = content
+        self.timestamp = int(time.time()) if timestamp is None else int(timestamp)
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content[:30]!r}, {self.timestamp})"
+
+    def to_row(self):
+        return [self.role, self.content, self.timestamp]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def resident_size(self):
+        """Approximate bytes held by this message"""
+        return _MESSAGE_OVERHEAD + sys.getsizeof(self.content)
+
+
+_MESSAGE_OVERHEAD = sys.getsizeof(Message('user', '', 0)) + sys.getsizeof(0)
+
+
+class HistoryStore:
+    """Interface for conversation history backends"""
+
+    def get(self, session_id):
+        """Return the session's messages, oldest first"""
+        raise NotImplementedError
+
+    def append(self, session_id, messages, max_messages=DEFAULT_MAX_MESSAGES):
+        """Add messages to a session, keeping only the newest max_messages"""
+        raise NotImplementedError
+
+    def clear(self, session_id):
+        """Remove all messages of a session"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Backend size information"""
+        return {}
+
+
+class MemoryHistoryStore(HistoryStore):
+    """Per-process store with LRU, idle-TTL and total-size eviction"""
+
+    def __init__(self, idle_ttl=DEFAULT_IDLE_TTL, max_sessions=DEFAULT_MAX_SESSIONS, max_bytes=DEFAULT_MAX_BYTES):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        # session_id -> [last_access, messages, resident_bytes], least recently used first
+        self._sessions = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            if entry[0] + self.idle_ttl <= time.time():
+                self._drop(session_id)
+                return []
+            entry[0] = time.time()
+            self._sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def append(self, session_id, messages, max_messages=DEFAULT_MAX_MESSAGES):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry[0] + self.idle_ttl <= time.time():
+                # Expired but not evicted yet: start over, as get() would
+                self._drop(session_id)
+                entry = None
+            if entry is None:
+                entry = self._sessions[session_id] = [0, [], 0]
+            entry[0] = time.time()
+            self._sessions.move_to_end(session_id)
+
+            history = entry[1]
+            history.extend(messages)
+            if len(history) > max_messages:
+                del history[:-max_messages]
+
+            size = sum(message.resident_size() for message in history)
+            self._resident_bytes += size - entry[2]
+            entry[2] = size
+            self._evict()
+
+    def clear(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(entry[1]) for entry in self._sessions.values()),
+                "resident_bytes": self._resident_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions
+            }
+
+    def _drop(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._resident_bytes -= entry[2]
+
+    def _evict(self):
+        # Idle sessions sit at the front of the LRU order, so stop at the first active one
+        cutoff = time.time() - self.idle_ttl
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            over_limit = len(self._sessions) > self.max_sessions or self._resident_bytes > self.max_bytes
+            if entry[0] > cutoff and not over_limit:
+                break
+            self._drop(session_id)
+            self.evictions += 1
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """Store shared by all workers on the machine through SQLite"""
+
+    def __init__(self, db_path, idle_ttl=DEFAULT_IDLE_TTL):
+        self.db_path = db_path
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._last_sweep = 0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,"
+                " role TEXT NOT NULL, content TEXT NOT NULL, timestamp INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None or row[0] + self.idle_ttl <= time.time():
+                return []
+            rows = conn.execute(
+                "SELECT role, content, timestamp FROM messages WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+        return [Message.from_row(row) for row in rows]
+
+    def append(self, session_id, messages, max_messages=DEFAULT_MAX_MESSAGES):
+        now = time.time()
+        with self._connect() as conn:
+            # An expired session reads as empty, so its old messages must not come back as context
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND EXISTS"
+                " (SELECT 1 FROM sessions WHERE session_id = ? AND last_access + ? <= ?)",
+                (session_id, session_id, self.idle_ttl, now)
+            )
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(session_id, m.role, m.content, m.timestamp) for m in messages]
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN"
+                " (SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, max_messages)
+            )
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (session_id, now))
+        self._sweep(now)
+
+    def clear(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self):
+        with self._connect() as conn:
+            sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {"backend": "sqlite", "sessions": sessions, "messages": messages}
+
+    def _sweep(self, now):
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        cutoff = now - self.idle_ttl
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM messages WHERE session_id IN"
+                " (SELECT session_id FROM sessions WHERE last_access < ?)",
+                (cutoff,)
+            )
+            conn.execute("DELETE FROM sessions WHERE last_access < ?", (cutoff,))
+
+
+class FileHistoryStore(HistoryStore):
+    """One JSON file per session; the file's mtime is its last access"""
+
+    def __init__(self, directory, idle_ttl=DEFAULT_IDLE_TTL):
+        self.directory = directory
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        # Session ids come from cookies; never use them as file names directly
+        name = hashlib.sha256(session_id.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _read(self, path):
+        try:
+            if os.path.getmtime(path) + self.idle_ttl <= time.time():
+                return []
+            with open(path, encoding='utf-8') as f:
+                return [Message.from_row(row) for row in json.load(f)]
+        except (OSError, ValueError):
+            return []
+
+    def get(self, session_id):
+        path = self._path(session_id)
+        messages = self._read(path)
+        if messages:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return messages
+
+    def append(self, session_id, messages, max_messages=DEFAULT_MAX_MESSAGES):
+        path = self._path(session_id)
+        with self._lock:
+            history = self._read(path) + list(messages)
+            history = history[-max_messages:]
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([m.to_row() for m in history], f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        self._sweep()
+
+    def clear(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        files = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        return {"backend": "file", "sessions": len(files)}
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        cutoff = now - self.idle_ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def create_history_store(backend, data_dir, idle_ttl=DEFAULT_IDLE_TTL,
+                         max_sessions=DEFAULT_MAX_SESSIONS, max_bytes=DEFAULT_MAX_BYTES):
+    """Build the configured history backend"""
+    if backend == 'sqlite':
+        return SQLiteHistoryStore(os.path.join(data_dir, 'history.sqlite3'), idle_ttl)
+    if backend == 'file':
+        return FileHistoryStore(os.path.join(data_dir, 'history'), idle_ttl)
+    if backend != 'memory':
+        logger.warning(f"Unknown HISTORY_STORE backend '{backend}', using memory")
+    return MemoryHistoryStore(idle_ttl, max_sessions, max_bytes)
@@ -0,0 +1,437 @@
+"""
+Local intent router for messages that have a fixed reply.
+
+Sections 9, 11 and 13 of the system instruction define canned replies for
+feedback ("Yes"/"No"), greetings, name introductions and out-of-scope asks
+(Junior High, elementary, college, math problems, data deletion, non-school
+topics). Sending those to Gemini costs a full call with the PDF context, so they
+are recognised here first: keyword/pattern rules, then a small multinomial
+naive Bayes model trained at import time on the English and Filipino examples
+below. A decision is only taken when its confidence reaches the intent's
+threshold and the conversation state allows it (e.g. "Yes" only answers the
+"Did you find this helpful?" prompt).
+
+    python intent_router.py "Ano ang requirements sa grade 7?"
+    python intent_router.py --evaluate
+"""
+import argparse
+import math
+import re
+from collections import Counter, defaultdict
+
+from context_builder import NAME_PATTERN, NAME_STOPWORDS
+from normalization import NormalizedText, normalize
+
+DEFAULT_THRESHOLD = 0.9
+# Intents that are easy to confuse with real questions need more certainty
+DEFAULT_INTENT_THRESHOLDS = {"non_school": 0.97}
+RULE_CONFIDENCE = 1.0
+NO_INTENT = "none"
+
+REPLIES = {
+    "feedback_yes": {
+        "en": "Wow! I'm grateful to help you! If you have more questions, just let me know. 😊",
+        "fil": "Wow! Natutuwa akong nakatulong sa'yo! Kung may iba ka pang tanong, sabihan mo lang ako. 😊"
+    },
+    "feedback_no": {
+        "en": "Aw, sad to hear that. 😔 For detailed information, please visit our official website or "
+              "contact the school directly at hs.lagro@depedqc.ph or call 8939 1092.",
+        "fil": "Aw, nakakalungkot naman. 😔 Para sa mas detalyadong impormasyon, bisitahin ang aming official "
+               "website o makipag-ugnayan sa paaralan sa hs.lagro@depedqc.ph o tumawag sa 8939 1092."
+    },
+    "greeting": {
+        "en": "👋 Hey there, future Lagronian! Welcome to the Lagro High School chatbot—your go-to buddy for all "
+              "things Senior High! Whether you're curious about enrollment, academic tracks, or just need some "
+              "campus insights, I got you covered. But first, let's keep it chill—what's your name?",
+        "fil": "👋 Hello, future Lagronian! Welcome sa Lagro High School chatbot—ang iyong buddy para sa lahat ng "
+               "tungkol sa Senior High! Kung tungkol man ito sa enrollment, academic tracks, o gusto mo lang "
+               "malaman ang tungkol sa campus, sagot kita. Pero una, ano ang pangalan mo?"
+    },
+    "name_intro": {
+        "en": "🔥 Awesome, {name}! From now on, I'll call you that. So, what's on your mind? "
+              "Let's make your SHS journey at Lagro smooth and stress-free!",
+        "fil": "🔥 Astig, {name}! Simula ngayon, iyan na ang itatawag ko sa'yo. So, ano ang gusto mong malaman? "
+               "Gawin nating smooth at stress-free ang SHS journey mo sa Lagro!"
+    },
+    "junior_high": {
+        "en": "I'm designed to assist with Senior High School information only. For Junior High School inquiries, "
+              "please contact the school directly at hs.lagro@depedqc.ph or call 8939 1092.",
+        "fil": "Ako ay para lamang sa impormasyon tungkol sa Senior High School. Para sa mga tanong tungkol sa "
+               "Junior High School, makipag-ugnayan sa paaralan sa hs.lagro@depedqc.ph o tumawag sa 8939 1092."
+    },
+    "elementary": {
+        "en": "I'm designed to assist with Senior High School information only. For elementary school inquiries, "
+              "please contact Lagro Elementary School directly.",
+        "fil": "Ako ay para lamang sa impormasyon tungkol sa Senior High School. Para sa mga tanong tungkol sa "
+               "elementarya, makipag-ugnayan nang direkta sa Lagro Elementary School."
+    },
+    "college": {
+        "en": "I'm designed to assist with Senior High School information only. For college and university "
+              "inquiries, I recommend contacting your preferred institutions directly.",
+        "fil": "Ako ay para lamang sa impormasyon tungkol sa Senior High School. Para sa mga tanong tungkol sa "
+               "kolehiyo at unibersidad, makipag-ugnayan nang direkta sa paaralang gusto mo."
+    },
+    "math": {
+        "en": "I can't solve mathematical equations or perform problem-solving tasks. "
+              "I'm here to help with Senior High School information only.",
+        "fil": "Hindi ako makakalutas ng mga math equation o problem-solving tasks. "
+               "Narito ako para tumulong sa impormasyon tungkol sa Senior High School lamang."
+    },
+    "delete_data": {
+        "en": "I'm only designed to assist with Lagro High School-related concerns. I do not store or manage "
+              "personal data. If you have privacy concerns, please contact the school administration.",
+        "fil": "Ako ay para lamang sa mga concern tungkol sa Lagro High School. Hindi ako nag-iimbak o namamahala "
+               "ng personal data. Kung may privacy concerns ka, makipag-ugnayan sa school administration."
+    },
+    "non_school": {
+        "en": "I'm here to assist with Lagro High School matters only. "
+              "Let me know if you need help with anything related to the school!",
+        "fil": "Narito ako para tumulong sa mga bagay tungkol sa Lagro High School lamang. "
+               "Sabihan mo lang ako kung may kailangan ka tungkol sa paaralan!"
+    },
+}
+
+# Out-of-scope intents are never taken when the message also mentions SHS topics
+OUT_OF_SCOPE_INTENTS = frozenset({"junior_high", "elementary", "college", "math", "non_school"})
+SHS_PATTERN = re.compile(
+    r"(?i)\b(senior high|shs|grade\s*-?\s*1[12]|g1[12]|stem|humss|abm|gas|tvl|ict|strand|track|lagro)\b"
+)
+# Numbers next to these are grades, school years, rooms or times ("grade 11/12", "S.Y. 2024 - 2025", "8 - 5")
+SCHOOL_NUMBER_PATTERN = re.compile(
+    r"(?i)\b(grades?|g\d+|s\.?\s?y|school\s+year|year|sem(ester)?|quarter|section|room|office|hours?|oras|time|"
+    r"schedule|class(es)?|enroll\w*|page|week|day|date)\b|\d\s*([ap]\.?m)\b"
+)
+# An operand, an operator and another operand: "25 * 4", "2x + 3", "(3)^2"
+OPERATION_PATTERN = re.compile(r"(?i)(?:\d|(?<=\d)x|\bx\b|\))\s*([-+*/×÷^])\s*(?:\d|x\b|\()")
+# '-' and '/' also write ranges and fractions of the school year, so they need an equation or a request to solve
+EQUATION_PATTERN = re.compile(r"(?i)=|\b(solve|compute|calculate|evaluate|simplify|lutasin|sagutin)\b")
+QUESTION_PATTERN = re.compile(r"(?i)\?|\b(what is|what's|how much is|ano ang|ilan ang)\b")
+FEEDBACK_PROMPT_PATTERN = re.compile(r"(?i)\bhelpful\b|nakatulong")
+NAME_PROMPT_PATTERN = re.compile(r"(?i)your name|pangalan mo")
+GREETING_ONLY = re.compile(
+    r"(?i)^(hi|hello|hey|good (morning|afternoon|evening)|kumusta|kamusta|magandang (umaga|hapon|gabi))"
+    r"(\s*(po|there))?$"
+)
+
+RULES = [
+    ("feedback_yes", re.compile(
+        r"(?i)^\s*(yes|yep|yeah|yup|yes it was|it was|very helpful|helpful|oo|opo|oo naman|oo nga|sure|okay|ok)"
+        r"(\s*[,.!]*\s*(po|naman|it was|thanks|thank you|salamat|very much|so much))*[\s.!😊🙂👍]*$")),
+    ("feedback_no", re.compile(
+        r"(?i)^\s*(no|nope|nah|not really|not helpful|hindi|hindi po|hinde|di|hindi masyado|not at all)"
+        r"(\s*[,.!]*\s*(po|naman|it wasn't|it was not|sorry|eh))*[\s.!😔🙁👎]*$")),
+    ("greeting", re.compile(
+        r"(?i)^\s*(hi|hello|hey|helo|hellow|good (morning|afternoon|evening|day)|kumusta|kamusta|musta|"
+        r"magandang (umaga|hapon|gabi|araw))(\s*[,!.]*\s*(po|there|ask lagronian|lagronian|bot|chatbot))*[\s.!?👋😊]*$")),
+    ("math", re.compile(
+        r"(?i)(\bsolve\b.*\b(for|equation|x)\b|"
+        r"\b(derivative|integral|integrate|square root|factori[sz]e|simplify)\b|\blutasin\b)")),
+    ("junior_high", re.compile(r"(?i)\b(junior high|jhs|grades?\s*-?\s*(7|8|9|10)|g(7|8|9|10))\b")),
+    ("elementary", re.compile(r"(?i)\b(elementary|elementarya|kinder|kindergarten|grades?\s*-?\s*[1-6]|primary school)\b")),
+    ("college", re.compile(
+        r"(?i)\b(upcat|acet|dcat|ustet|college entrance|college admission|university admission|"
+        r"college application|mag-?kolehiyo|kolehiyo|unibersidad)\b")),
+    ("delete_data", re.compile(
+        r"(?i)\b(delete|erase|remove|burahin|burahin mo|i-?delete)\b.*\b(my|ko|aking)\b.*"
+        r"\b(data|information|info|impormasyon|personal)\b")),
+]
+
+# Training examples for the bag-of-words model; "none" are real SHS questions
+TRAINING_EXAMPLES = [
+    ("feedback_yes", t) for t in (
+        "yes", "yes it was", "yep", "yeah thanks", "yes thank you", "very helpful", "yes very helpful",
+        "it was helpful", "yes po", "oo", "opo", "oo naman", "oo salamat", "oo nakatulong", "opo salamat po",
+        "yes it helped a lot", "sobrang nakatulong", "oo ang laking tulong", "yes that helps", "helpful naman"
+    )
+] + [
+    ("feedback_no", t) for t in (
+        "no", "nope", "not really", "no it wasn't", "not helpful", "no not helpful", "it didn't help",
+        "hindi", "hindi po", "hindi nakatulong", "hindi masyado", "di nakatulong", "no not at all",
+        "hindi po eh", "not quite", "that did not help", "no sorry", "medyo hindi"
+    )
+] + [
+    ("greeting", t) for t in (
+        "hi", "hello", "hey", "hi there", "hello po", "good morning", "good afternoon", "good evening",
+        "kumusta", "kamusta po", "musta", "magandang umaga", "magandang hapon po", "magandang gabi",
+        "hey there", "hello ask lagronian", "hi po", "yo"
+    )
+] + [
+    ("junior_high", t) for t in (
+        "enrollment for grade 7", "junior high school requirements", "jhs enrollment", "grade 8 schedule",
+        "my brother is grade 9 what are his subjects", "paano mag enroll sa grade 7",
+        "requirements para sa junior high", "grade 10 sections", "who is the grade 9 adviser",
+        "junior high teachers", "kailan ang enrollment ng jhs", "grade 7 entrance exam",
+        "my sister will be incoming grade 7", "jhs class schedule"
+    )
+] + [
+    ("elementary", t) for t in (
+        "elementary enrollment", "grade 3 requirements", "kinder enrollment", "enrollment sa elementarya",
+        "my child is in grade 5", "elementary school near lagro", "grade 1 enrollment requirements",
+        "paano mag enroll ng kinder", "primary school teachers", "elementary schedule"
+    )
+] + [
+    ("college", t) for t in (
+        "requirements for up college admission", "best university for engineering",
+        "college entrance exam schedule", "when is the upcat", "saan magandang mag kolehiyo",
+        "tuition fee in universities", "how do i apply to ust", "college application deadlines",
+        "which university has the best nursing program", "magkano ang tuition sa kolehiyo",
+        "dlsu admission requirements", "acet registration", "universities in quezon city"
+    )
+] + [
+    ("math", t) for t in (
+        "solve 2x + 3 = 7", "what is 25 * 4", "integrate x squared", "derivative of sin x",
+        "lutasin ang 5 + 3", "find the value of x", "square root of 144", "can you solve this equation",
+        "help me with my algebra homework", "what is 15 percent of 200", "simplify the expression",
+        "compute the area of a circle with radius 5", "sagutin mo itong math problem"
+    )
+] + [
+    ("delete_data", t) for t in (
+        "delete my data", "remove my personal information", "burahin ang data ko",
+        "please erase my information from your servers", "i want my data deleted",
+        "how do i delete my account data", "pakibura ang impormasyon ko", "delete everything you know about me"
+    )
+] + [
+    ("non_school", t) for t in (
+        "what's the weather today", "tell me a joke", "who won the nba finals", "recommend a movie",
+        "write me a poem", "sino ang presidente ng pilipinas", "what is the price of bitcoin",
+        "what is the best phone to buy", "how do i cook adobo", "who is taylor swift",
+        "anong magandang kanta", "play a game with me", "what is the meaning of life", "how to lose weight"
+    )
+] + [
+    (NO_INTENT, t) for t in (
+        "what strands are offered", "what are the enrollment requirements", "how about for transferees",
+        "ano ang requirements sa enrollment", "saan ang registrar", "what is the grading system",
+        "how is the initial grade computed", "who are the ict teachers", "i'm grade 12 tvl-ict",
+        "what subjects will i have next semester", "tell me about the shs voucher program", "who can apply",
+        "saan matatagpuan ang aklatan", "ano ang library process", "what are the guidance office hours",
+        "who is in charge", "what is humss", "compare humss and abm", "what careers fit abm",
+        "what are the school rules on uniforms", "what happens if i'm late", "who is the principal",
+        "what time does school start", "magkano ang tuition fee", "are there scholarships",
+        "what college courses fit stem", "which strand is best for nursing in college",
+        "is there a math club", "what are the math subjects in stem", "ano ang mga strand",
+        "paano mag enroll sa grade 11", "what about grade 12", "idk just tell me", "what are the school events",
+        "latest school news", "where is the school located", "how do i get to lagro high school",
+        "what is the contact number of the school", "what are the extracurricular activities",
+        "requirements for grade 11 transferees", "may dress code ba", "what are the stem teachers",
+        "is there a computer lab", "how many absences are allowed", "i'm failing general mathematics",
+        "what is tvl he", "what are the core subjects", "when is the enrollment", "sino ang adviser ng stem",
+        "how do i contact the guidance office", "what documents do i need", "thank you for the info"
+    )
+]
+
+
+def arithmetic_expression(text):
+    """Whether text asks to work out an expression like "what is 25 * 4?" or "2x + 3 = 7", not a grade or time range"""
+    operators = {match.group(1) for match in OPERATION_PATTERN.finditer(text)}
+    if not operators or SCHOOL_NUMBER_PATTERN.search(text) or SHS_PATTERN.search(text):
+        return False
+    if operators <= {'-', '/'}:
+        return bool(EQUATION_PATTERN.search(text))
+    return bool(EQUATION_PATTERN.search(text) or QUESTION_PATTERN.search(text))
+
+
+def tokenize(text):
+    """Normalized words (stopwords kept, they carry intent here) and their bigrams"""
+    words = normalize(text).words
+    return list(words) + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+class BagOfWordsModel:
+    """Multinomial naive Bayes over unigrams and bigrams"""
+
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha
+        self.labels = []
+        self.log_prior = {}
+        self.log_likelihood = {}
+        self.log_unseen = {}
+        self.vocabulary = set()
+
+    def train(self, examples):
+        counts = defaultdict(Counter)
+        label_counts = Counter()
+        for label, text in examples:
+            tokens = tokenize(text)
+            counts[label].update(tokens)
+            label_counts[label] += 1
+            self.vocabulary.update(tokens)
+
+        total = sum(label_counts.values())
+        size = len(self.vocabulary)
+        self.labels = sorted(label_counts)
+        for label in self.labels:
+            denominator = sum(counts[label].values()) + self.alpha * size
+            self.log_prior[label] = math.log(label_counts[label] / total)
+            self.log_likelihood[label] = {
+                token: math.log((count + self.alpha) / denominator) for token, count in counts[label].items()
+            }
+            self.log_unseen[label] = math.log(self.alpha / denominator)
+        return self
+
+    def predict(self, text):
+        """(label, probability) of the most likely label; ('none', 0.0) without known words"""
+        tokens = [t for t in tokenize(text) if t in self.vocabulary]
+        if not tokens:
+            return NO_INTENT, 0.0
+        scores = {}
+        for label in self.labels:
+            likelihood = self.log_likelihood[label]
+            unseen = self.log_unseen[label]
+            scores[label] = self.log_prior[label] + sum(likelihood.get(t, unseen) for t in tokens)
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+
+FILIPINO_MARKERS = frozenset("""
+ang ng mga sa po ako ko mo ba ano saan paano sino kailan magkano bakit oo opo hindi di salamat
+kumusta kamusta musta magandang umaga hapon gabi pangalan ikaw siya naman lang nga rin din
+""".split())
+
+
+def detect_language(text):
+    """'fil' when the message reads as Filipino or Taglish, otherwise 'en'"""
+    words = re.findall(r"[a-zñ]+", text.lower())
+    return 'fil' if any(w in FILIPINO_MARKERS for w in words) else 'en'
+
+
+def parse_thresholds(spec):
+    """Parse per-intent thresholds like 'college:0.95,non_school:0.99'"""
+    thresholds = {}
+    for item in (spec or '').split(','):
+        if item.strip():
+            intent, _, value = item.partition(':')
+            thresholds[intent.strip()] = float(value)
+    return thresholds
+
+
+class RouteDecision:
+    __slots__ = ('intent', 'confidence', 'source', 'response')
+
+    def __init__(self, intent, confidence, source, response):
+        self.intent = intent
+        self.confidence = confidence
+        self.source = source
+        self.response = response
+
+    def to_dict(self):
+        return {"intent": self.intent, "confidence": round(self.confidence, 3), "source": self.source}
+
+
+class IntentRouter:
+    """Answers messages with a canned reply when rules or the model are confident enough"""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, thresholds=None, examples=TRAINING_EXAMPLES):
+        self.threshold = threshold
+        self.thresholds = dict(DEFAULT_INTENT_THRESHOLDS)
+        self.thresholds.update(thresholds or {})
+        self.model = BagOfWordsModel().train(examples)
+
+    def threshold_for(self, intent):
+        """Confidence needed for an intent; a value above 1 disables it"""
+        return self.thresholds.get(intent, self.threshold)
+
+    def classify(self, message):
+        """Best (intent, confidence, source) for a message (text or NormalizedText), ignoring conversation state"""
+        text = message.text if isinstance(message, NormalizedText) else message
+        for intent, pattern in RULES:
+            if pattern.search(text) or (intent == 'math' and arithmetic_expression(text)):
+                return intent, RULE_CONFIDENCE, 'rule'
+        intent, confidence = self.model.predict(message)
+        return intent, confidence, 'model'
+
+    def route(self, message, history=()):
+        """RouteDecision with the canned reply, or None to send the message to the model"""
+        normalized = normalize(message)
+        message = normalized.text
+        previous = history[-1] if history else None
+        name = self._introduced_name(message, previous, history)
+        if name:
+            return self._decision('name_intro', RULE_CONFIDENCE, 'rule', message, name=name)
+
+        intent, confidence, source = self.classify(normalized)
+        if intent == NO_INTENT or confidence < self.threshold_for(intent):
+            return None
+        if not self._allowed(intent, message, previous, history):
+            return None
+        return self._decision(intent, confidence, source, message)
+
+    def _allowed(self, intent, message, previous, history):
+        if intent in ('feedback_yes', 'feedback_no'):
+            # Only an answer to "Did you find this information helpful? (Yes/No)"
+            return (previous is not None and previous.role == "model"
+                    and bool(FEEDBACK_PROMPT_PATTERN.search(previous.content)))
+        if intent == 'greeting':
+            # The introduction is only for the start of a conversation
+            return not history
+        if intent in OUT_OF_SCOPE_INTENTS:
+            return not SHS_PATTERN.search(message)
+        return True
+
+    def _introduced_name(self, message, previous, history):
+        text = message.strip()
+        words = text.rstrip('.!').split()
+        if '?' in text or not 1 <= len(words) <= 6:
+            return None
+        asked = (previous is not None and previous.role == "model"
+                 and bool(NAME_PROMPT_PATTERN.search(previous.content)))
+        if history and not asked:
+            return None
+
+        match = NAME_PATTERN.search(text)
+        if match and match.group(1).split()[0].lower() not in NAME_STOPWORDS:
+            # Unprompted, only a capitalised name counts ("I'm Ana", not "I'm confused")
+            if not asked and not match.group(1)[0].isupper():
+                return None
+            # Nothing but the introduction ("Hi, I'm Ana")
+            rest = (text[:match.start()] + text[match.end():]).strip(" ,.!")
+            if not rest or GREETING_ONLY.match(rest):
+                return match.group(1)
+            return None
+        if asked and len(words) <= 3 and all(w.isalpha() for w in words):
+            # A bare reply to "what's your name?"
+            if words[0].lower() not in NAME_STOPWORDS and self.classify(text)[0] == NO_INTENT:
+                return ' '.join(w.capitalize() for w in words)
+        return None
+
+    def _decision(self, intent, confidence, source, message, **values):
+        template = REPLIES[intent][detect_language(message)]
+        return RouteDecision(intent, confidence, source, template.format(**values) if values else template)
+
+
+def evaluate(examples=TRAINING_EXAMPLES):
+    """Leave-one-out accuracy of the bag-of-words model on the training examples"""
+    correct = 0
+    errors = []
+    for i, (label, text) in enumerate(examples):
+        model = BagOfWordsModel().train(examples[:i] + examples[i + 1:])
+        predicted, confidence = model.predict(text)
+        if predicted == label:
+            correct += 1
+        else:
+            errors.append((text, label, predicted, confidence))
+    return correct / len(examples), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify messages with the local intent router")
+    parser.add_argument('messages', nargs='*', help="Messages to classify")
+    parser.add_argument('--evaluate', action='store_true', help="Leave-one-out accuracy of the model")
+    args = parser.parse_args()
+
+    if args.evaluate:
+        accuracy, errors = evaluate()
+        print(f"Leave-one-out accuracy: {accuracy:.1%} on {len(TRAINING_EXAMPLES)} examples")
+        for text, label, predicted, confidence in errors:
+            print(f"  {text!r}: expected {label}, got {predicted} ({confidence:.2f})")
+
+    router = IntentRouter()
+    for message in args.messages:
+        intent, confidence, source = router.classify(message)
+        decision = router.route(message)
+        print(f"{message!r}: {intent} ({confidence:.2f}, {source}) -> "
+              f"{decision.response if decision else 'send to model'}")
+
+
+if __name__ == '__main__':
+    main()
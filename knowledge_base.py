@@ -0,0 +1,409 @@
+"""
+Multi-document knowledge base with incremental, hash-based reindexing.
+
+School information lives in a directory of documents (KNOWLEDGE_DIR), for
+example one PDF per topic: news.pdf, rules.pdf, faculty.pdf, fees.pdf. Plain
+.txt and .md files work too. If the directory holds no documents, the single
+school PDF is used instead. Index it with:
+
+    python knowledge_base.py            # re-extract changed documents only
+    python knowledge_base.py --upload   # also upload documents Gemini doesn't have yet
+
+- `index/knowledge/manifest.json` records each document's content hash
+- only documents whose hash changed are re-extracted and re-chunked; their
+  passages are stored per document under `passages/<hash>.json`
+- the BM25 index itself is not stored: it is rebuilt in memory from the
+  stored passages, which takes milliseconds
+- uploaded file handles are keyed by content hash (see file_handles.py), so
+  unchanged documents are never uploaded again
+
+At query time the passages of all documents are searched with BM25 and the
+documents whose passages (or names) match the question best are selected:
+retrieval mode sends passages from those documents only, and whole-file mode
+attaches only their uploaded files instead of every document.
+
+A loaded `KnowledgeBase` is never modified. `KnowledgeBaseLoader` notices when
+a document is added, removed or changed, builds a new knowledge base in the
+background and swaps it in with one reference assignment, so requests never
+see a half-built index and workers don't need a restart. The committed index
+is a read-only seed for the loader; what it reindexes at runtime is written to
+its own directory (under DATA_DIR in the app), never into the source tree.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from normalization import normalize, terms as index_terms
+from retrieval import BM25Index, CHUNK_OVERLAP, CHUNK_WORDS, chunk_pages, extract_pdf_pages, file_sha256
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KNOWLEDGE_DIR = os.path.join(ROOT, 'knowledge')
+DEFAULT_INDEX_DIR = os.path.join(ROOT, 'index', 'knowledge')
+DEFAULT_FALLBACK_PATH = os.path.join(ROOT, 'Lagro High School - Data .pdf')
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+MIME_TYPES = {'.pdf': 'application/pdf', '.txt': 'text/plain', '.md': 'text/markdown'}
+
+# Passages considered when choosing documents for a question
+SELECT_CANDIDATES = 20
+# Documents scoring below this share of the best document are left out
+SELECT_RATIO = 0.5
+DEFAULT_MAX_DOCUMENTS = 2
+
+
+def list_documents(knowledge_dir, fallback_path=None):
+    """(name, path) of every supported document, or of the fallback file if there are none"""
+    documents = []
+    if os.path.isdir(knowledge_dir):
+        for folder, dirs, files in os.walk(knowledge_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for file_name in sorted(files):
+                if os.path.splitext(file_name)[1].lower() in MIME_TYPES and not file_name.startswith('.'):
+                    path = os.path.join(folder, file_name)
+                    documents.append((os.path.relpath(path, knowledge_dir).replace(os.sep, '/'), path))
+    if not documents and fallback_path and os.path.exists(fallback_path):
+        documents.append((os.path.basename(fallback_path), fallback_path))
+    return documents
+
+
+def extract_pages(path):
+    """Text of each page of a document (text files are a single page)"""
+    if os.path.splitext(path)[1].lower() == '.pdf':
+        return extract_pdf_pages(path)
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return [re.sub(r'\s+', ' ', f.read()).strip()]
+
+
+def read_manifest(index_dir):
+    try:
+        with open(os.path.join(index_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def _passages_path(index_dir, content_hash):
+    return os.path.join(index_dir, 'passages', f"{content_hash}.json")
+
+
+def _read_passages(index_dir, content_hash):
+    try:
+        with open(_passages_path(index_dir, content_hash), encoding='utf-8') as f:
+            return json.load(f)["passages"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def reindex(documents, index_dir=DEFAULT_INDEX_DIR, persist=True, previous=None,
+            chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP, seed_dir=None):
+    """Build a KnowledgeBase, extracting only documents whose content hash changed
+
+    documents is a list of (name, path). Passages of unchanged documents come
+    from `previous` (a loaded KnowledgeBase) or the passage files in
+    index_dir, then seed_dir (read only). Returns (knowledge_base, changes)
+    where changes lists the added, changed, removed and unchanged document
+    names, compared with `previous` if given, else with the manifest.
+    """
+    manifest = read_manifest(index_dir) if index_dir else None
+    if manifest is None and seed_dir:
+        manifest = read_manifest(seed_dir)
+    manifest = manifest or {}
+    same_chunking = manifest.get("chunk_words") == chunk_words and manifest.get("overlap") == overlap
+    indexed = manifest.get("documents", {}) if same_chunking else {}
+    stored_dirs = [d for d in (index_dir, seed_dir) if d] if same_chunking else []
+    in_memory = previous.passages_by_hash if previous is not None else {}
+    baseline = previous.documents if previous is not None else indexed
+    known = dict(indexed, **baseline)
+
+    entries, passages_by_hash = {}, {}
+    changes = {"added": [], "changed": [], "removed": [], "unchanged": []}
+    for name, path in documents:
+        stat = os.stat(path)
+        old = known.get(name)
+        if old and old["bytes"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+            # Same size and modification time: trust the recorded hash instead of reading the file
+            content_hash = old["sha256"]
+        else:
+            content_hash = file_sha256(path)
+
+        passages = in_memory.get(content_hash)
+        for stored_dir in stored_dirs:
+            if passages is not None:
+                break
+            passages = _read_passages(stored_dir, content_hash)
+        if passages is None:
+            pages = extract_pages(path)
+            passages = chunk_pages(pages, chunk_words, overlap)
+            if persist:
+                _write_json(_passages_path(index_dir, content_hash),
+                            {"sha256": content_hash, "pages": len(pages), "passages": passages})
+            logger.info(f"Indexed {name}: {len(passages)} passages")
+
+        before = baseline.get(name)
+        if before is None:
+            changes["added"].append(name)
+        elif before["sha256"] != content_hash:
+            changes["changed"].append(name)
+        else:
+            changes["unchanged"].append(name)
+        passages_by_hash[content_hash] = passages
+        entries[name] = {
+            "path": path,
+            "sha256": content_hash,
+            "bytes": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "mime_type": MIME_TYPES[os.path.splitext(name)[1].lower()],
+            "passages": len(passages)
+        }
+    changes["removed"] = sorted(set(baseline) - set(entries))
+
+    if persist:
+        _write_json(os.path.join(index_dir, MANIFEST_NAME), {
+            "version": MANIFEST_VERSION,
+            "chunk_words": chunk_words,
+            "overlap": overlap,
+            # Paths are machine-specific; the loader passes them in again
+            "documents": {name: {k: v for k, v in entry.items() if k != "path"} for name, entry in entries.items()}
+        })
+        _prune_passages(index_dir, set(passages_by_hash))
+    return KnowledgeBase(entries, passages_by_hash), changes
+
+
+def _prune_passages(index_dir, keep):
+    folder = os.path.join(index_dir, 'passages')
+    for file_name in os.listdir(folder) if os.path.isdir(folder) else []:
+        if file_name.endswith('.json') and file_name[:-5] not in keep:
+            try:
+                os.remove(os.path.join(folder, file_name))
+            except OSError:
+                pass
+
+
+def _name_terms(name):
+    return set(index_terms(re.sub(r'[_\-./]+', ' ', os.path.splitext(name)[0])))
+
+
+class KnowledgeBase:
+    """Passages of every document in one BM25 index, with per-question document selection"""
+
+    def __init__(self, documents, passages_by_hash):
+        self.documents = documents
+        self.passages_by_hash = passages_by_hash
+        passages = [
+            dict(passage, doc=name)
+            for name, entry in documents.items()
+            for passage in passages_by_hash[entry["sha256"]]
+        ]
+        self.index = BM25Index.build(passages)
+        self.version = hashlib.sha256(json.dumps(
+            sorted((name, entry["sha256"]) for name, entry in documents.items())).encode('utf-8')).hexdigest()
+        self._name_terms = {name: _name_terms(name) for name in documents}
+
+    def select(self, query, max_documents=DEFAULT_MAX_DOCUMENTS):
+        """Names of the documents most relevant to query, best first (empty if nothing matches)"""
+        return self.retrieve(query, 0, max_documents)[0]
+
+    def retrieve(self, query, k, max_documents=DEFAULT_MAX_DOCUMENTS):
+        """(selected document names, top-k (score, passage) pairs from those documents)"""
+        query = normalize(query)
+        candidates = self.index.search(query, k=max(k, SELECT_CANDIDATES))
+        scores = {}
+        for score, passage in candidates:
+            scores[passage["doc"]] = max(scores.get(passage["doc"], 0.0), score)
+
+        # A document named after the topic ("fees.pdf" for "how much are the fees?") goes first
+        terms = query.vector.keys()
+        bonus = max(scores.values(), default=1.0)
+        for name, name_terms in self._name_terms.items():
+            if terms & name_terms and len(self.documents) > 1:
+                scores[name] = scores.get(name, 0.0) + bonus
+
+        if not scores:
+            return [], []
+        best = max(scores.values())
+        ranked = sorted((name for name, score in scores.items() if score >= best * SELECT_RATIO),
+                        key=lambda name: -scores[name])
+        selected = ranked[:max(1, max_documents)]
+        results = [(score, passage) for score, passage in candidates if passage["doc"] in selected][:k]
+        return selected, results
+
+    def stats(self):
+        return {"documents": len(self.documents), "passages": len(self.index.passages), "version": self.version[:12]}
+
+
+class KnowledgeBaseLoader:
+    """Holds the current KnowledgeBase and swaps in a rebuilt one when the documents change
+
+    get() checks the document directory at most every `check_interval`
+    seconds (a directory listing and a stat per file) and, if anything
+    changed, reindexes in a background thread while requests keep using the
+    current knowledge base.
+    """
+
+    def __init__(self, knowledge_dir=DEFAULT_KNOWLEDGE_DIR, index_dir=None,
+                 fallback_path=DEFAULT_FALLBACK_PATH, check_interval=30.0, listener=None, seed_dir=DEFAULT_INDEX_DIR):
+        self.knowledge_dir = knowledge_dir
+        # Where reindexed passages are written (None: memory only); seed_dir is only read
+        self.index_dir = index_dir
+        self.seed_dir = seed_dir
+        self.fallback_path = fallback_path
+        self.check_interval = check_interval
+        self._listener = listener
+        self._current = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._reloading = False
+        self._persist = index_dir is not None
+
+    @property
+    def current(self):
+        """The loaded knowledge base, or None before the first load"""
+        return self._current
+
+    def get(self):
+        """Current knowledge base, loading it on first use"""
+        if self._signature is None:
+            with self._load_lock:
+                if self._signature is None:
+                    self.reload()
+        elif self.check_interval and time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            if self._read_signature() != self._signature:
+                self._reload_in_background()
+        return self._current
+
+    def reload(self):
+        """Reindex changed documents and swap in the result; returns the changes"""
+        with self._lock:
+            documents = list_documents(self.knowledge_dir, self.fallback_path)
+            signature = self._read_signature(documents)
+            try:
+                knowledge_base, changes = reindex(documents, self.index_dir, persist=self._persist,
+                                                  previous=self._current, seed_dir=self.seed_dir)
+            except OSError as e:
+                if not self._persist:
+                    raise
+                logger.warning(f"Could not persist knowledge index in {self.index_dir}: {str(e)}")
+                self._persist = False
+                knowledge_base, changes = reindex(documents, self.index_dir, persist=False, previous=self._current,
+                                                  seed_dir=self.seed_dir)
+
+            previous, self._current = self._current, knowledge_base
+            self._signature = signature
+            self._checked_at = time.monotonic()
+        if previous is not None and (changes["added"] or changes["changed"] or changes["removed"]):
+            logger.info(f"Reloaded knowledge base {knowledge_base.version[:12]}: "
+                        f"added {changes['added']}, changed {changes['changed']}, removed {changes['removed']}")
+        self._emit('reload', knowledge_base)
+        return changes
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._safe_reload, name='knowledge-reload', daemon=True).start()
+
+    def _safe_reload(self):
+        try:
+            self.reload()
+        except Exception as e:
+            # Keep serving the previous knowledge base
+            logger.error(f"Knowledge base reload failed: {str(e)}")
+            self._emit('reload_failed', e)
+        finally:
+            self._reloading = False
+
+    def _read_signature(self, documents=None):
+        if documents is None:
+            documents = list_documents(self.knowledge_dir, self.fallback_path)
+        signature = []
+        for name, path in documents:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _emit(self, kind, value):
+        if self._listener is not None:
+            self._listener(kind, value)
+
+
+def upload_documents(knowledge_base, data_dir, backend_name='gemini'):
+    """Make sure every document has a fresh handle in the app's shared file handle store
+
+    Handles are keyed by content hash, so only added and changed documents
+    (or ones whose upload expired) are actually uploaded.
+    """
+    from file_handles import FileHandleManager, FileHandleStore
+    from model_backend import create_model_backend
+
+    backend = create_model_backend(backend_name, None, os.getenv('GEMINI_API_KEY'))
+    store = FileHandleStore(os.path.join(
+        data_dir, 'file_handles.sqlite3' if backend.name == 'gemini' else f'file_handles_{backend.name}.sqlite3'))
+    for name, entry in knowledge_base.documents.items():
+        handle = FileHandleManager(entry["path"], store, mime_type=entry["mime_type"],
+                                   upload=backend.upload_file).get()
+        print(f"{name}: {handle['uri']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally index the knowledge documents")
+    parser.add_argument('--dir', default=os.getenv('KNOWLEDGE_DIR', DEFAULT_KNOWLEDGE_DIR),
+                        help="Directory of knowledge documents (.pdf, .txt, .md)")
+    parser.add_argument('--index', default=DEFAULT_INDEX_DIR, help="Where to write the manifest and passages")
+    parser.add_argument('--fallback', default=DEFAULT_FALLBACK_PATH, help="Document used when the directory is empty")
+    parser.add_argument('--upload', action='store_true', help="Upload added and changed documents to Gemini")
+    parser.add_argument('--data-dir', default=os.getenv('DATA_DIR'), help="Shared DATA_DIR of the app (for --upload)")
+    parser.add_argument('--query', help="Show the documents and passages selected for a test question")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    documents = list_documents(args.dir, args.fallback)
+    if not documents:
+        raise SystemExit(f"No documents in {args.dir}")
+    knowledge_base, changes = reindex(documents, args.index)
+    for kind in ("added", "changed", "removed", "unchanged"):
+        if changes[kind]:
+            print(f"{kind:<10} {', '.join(changes[kind])}")
+    print(f"{len(knowledge_base.documents)} documents, {len(knowledge_base.index.passages)} passages "
+          f"(version {knowledge_base.version[:12]}) -> {args.index}")
+
+    if args.upload:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        upload_documents(knowledge_base, args.data_dir or os.path.join(tempfile.gettempdir(), 'ask_lagronian'),
+                         os.getenv('MODEL_BACKEND', 'gemini'))
+
+    if args.query:
+        selected, results = knowledge_base.retrieve(args.query, 4)
+        print(f"Selected: {', '.join(selected) or '(none)'}")
+        for score, passage in results:
+            print(f"  {score:6.2f} {passage['doc']} p{passage['page']}: {passage['text'][:100]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,905 @@
+"""
+Structured knowledge tables extracted from the school PDF.
+
+Exact-fact questions ("who teaches ICT?", "tuition for TVL-HE", "guidance office
+hours") have their answer in one row of the PDF. At build time the PDF text is
+parsed into small tables (strands, subjects per strand/grade/semester, faculty,
+fees, offices, building locations and school rules) stored in an indexed,
+read-only SQLite file. At request time the file is opened lazily and
+memory-mapped; a question is matched to a table and its filters, and either the
+matching rows are sent as grounding or, for confident lookups, the answer is
+rendered from a template without calling the model.
+
+Rebuild the tables with:
+
+    python knowledge_tables.py
+    python knowledge_tables.py --query "who teaches ICT in grade 12?"
+"""
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from context_builder import GRADE_PATTERN, STRAND_PATTERN, canonical_strand
+from intent_router import detect_language
+from retrieval import extract_pdf_pages, file_sha256, tokenize
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+DEFAULT_PDF_PATH = os.path.join(os.path.dirname(__file__), 'Lagro High School - Data .pdf')
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), 'index', 'knowledge.sqlite3')
+# The whole file fits in the mapping, so lookups never copy pages into the heap
+MMAP_SIZE = 8 * 1024 * 1024
+DEFAULT_ANSWER_THRESHOLD = 0.9
+
+HELPFUL_PROMPT = "Did you find this information helpful? 😊 (Yes/No)"
+
+BULLETS = '●■○❖•'
+
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+
+def repair_split_words(text):
+    """Join words the PDF extraction broke in two ("Gener al" -> "General")
+
+    Two neighbouring tokens are joined when the joined word occurs unbroken
+    elsewhere in the text and one of the halves never stands on its own.
+    """
+    tokens = text.split(' ')
+    cores = [re.sub(r"[^a-zà-ÿñ]", '', t.lower()) for t in tokens]
+    vocabulary = Counter(cores)
+
+    def joinable(i):
+        a, b = tokens[i], tokens[i + 1]
+        if not (a[-1:].isalpha() and b[:1].isalpha()):
+            return False
+        head = re.search(r"[A-Za-zÀ-ÿñÑ]+$", a).group(0).lower()
+        tail = re.match(r"[A-Za-zÀ-ÿñÑ]+", b).group(0).lower()
+        return vocabulary.get(head + tail, 0) > 0 and head + tail not in (head, tail)
+
+    pairs = [bool(tokens[i]) and bool(tokens[i + 1]) and joinable(i) for i in range(len(tokens) - 1)]
+    standalone = Counter()
+    for i, core in enumerate(cores):
+        if not (i > 0 and pairs[i - 1]) and not (i < len(pairs) and pairs[i]):
+            standalone[core] += 1
+
+    out = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        while i < len(pairs) and pairs[i] and (standalone[cores[i]] == 0 or standalone[cores[i + 1]] == 0):
+            i += 1
+            token += tokens[i]
+        out.append(token)
+        i += 1
+    return ' '.join(out)
+
+
+def _section(text, start, end=None):
+    """Text between two headings ('' when the start heading is missing)"""
+    match = re.search(start, text)
+    if match is None:
+        return ''
+    rest = text[match.end():]
+    if end:
+        stop = re.search(end, rest)
+        if stop is not None:
+            rest = rest[:stop.start()]
+    return rest
+
+
+def _clean(item):
+    return re.sub(r"\s+", ' ', item).strip(" -:;,.–")
+
+
+STRAND_LIST_PATTERN = re.compile(r"❖\s*([^❖(]+?)\s*\((STEM|HUMM?SS?|ABM|TVL-[A-Z]+)\)")
+STRAND_ENROLLMENT_PATTERN = re.compile(r"📌\s*(STEM|ABM|HUMM?SS|TVL)\s*[–-]\s*([\d,]+\+?)\s*mag-aaral")
+
+
+def extract_strands(text):
+    """(code, name, enrolled) for each SHS strand"""
+    enrolled = {canonical_strand(code): count for code, count in STRAND_ENROLLMENT_PATTERN.findall(text)}
+    rows = []
+    for name, code in STRAND_LIST_PATTERN.findall(text):
+        code = canonical_strand(code)
+        if code in {r[0] for r in rows}:
+            continue
+        students = enrolled.get(code)
+        if students is None and code.startswith('TVL-') and 'TVL' in enrolled:
+            # The school reports one figure for all TVL strands
+            students = f"{enrolled['TVL']} (all TVL strands)"
+        rows.append((code, _clean(name), students))
+    return rows
+
+
+STRAND_HEADER_PATTERN = re.compile(
+    r"(?:\b(STEM|HUMMS|HUMSS|ABM)\b|TVL\s*-\s*(Information and Communication Technology|Home Economics|Industrial Arts))"
+    r"\s*(\([^)]*\))?\s*:?\s*(?=(?:For\s+)?grade\s*11)", re.IGNORECASE
+)
+TVL_CODES = {
+    "information and communication technology": "TVL-ICT", "home economics": "TVL-HE", "industrial arts": "TVL-IA"
+}
+CURRICULUM_MARKER_PATTERN = re.compile(
+    r"(?P<grade>\bgrade\s*(?P<grade_level>11|12)\b)"
+    r"|(?P<first>\b(?:1st and 2nd Quarters?|First Semester|1st Semester)\b)"
+    r"|(?P<second>\b(?:3rd and 4th Quarters?|Second Semester|2nd Semester)\b)"
+    r"|(?P<category>\b(?P<category_name>Core|Applied|Specialized)(?:\s+Subjects?)?\s*:)"
+    r"|(?P<bullet>[" + BULLETS + r"])",
+    re.IGNORECASE
+)
+
+
+def extract_subjects(text):
+    """(strand, specialization, grade, semester, category, subject) rows of the curriculum"""
+    curriculum = _section(text, r"SHS Curriculum and subjects per track/strand", r"SHS Enrollment requirements")
+    headers = list(STRAND_HEADER_PATTERN.finditer(curriculum))
+    rows = []
+    for n, header in enumerate(headers):
+        block = curriculum[header.end():headers[n + 1].start() if n + 1 < len(headers) else len(curriculum)]
+        if header.group(1):
+            strand = canonical_strand(header.group(1))
+        else:
+            strand = TVL_CODES[header.group(2).lower()]
+        specialization = header.group(3).strip('() ') if header.group(3) else ''
+        specialization = re.sub(r"\s*;\s*", '; ', specialization)
+
+        grade = 11
+        semester = 1
+        category = 'core'
+        position = 0
+        pending = []
+
+        def flush():
+            for item in pending:
+                # Rejoin single letters split off a word ("Tech-V oc", "P ambungad")
+                subject = re.sub(r"\b([A-Z]) ([a-z]{2,})", r"\1\2", _clean(item))
+                subject = re.sub(r"\s+For$", '', subject)
+                subject = _clean(re.sub(r"(?i)^.*?\bQuarter\s*&\s*\w+ Quarter\b", '', subject))
+                if len(subject) > 3 and not re.fullmatch(r"(?i)(core|applied|specialized)( subjects?)?", subject):
+                    rows.append((strand, specialization, grade, semester, category, subject))
+            pending.clear()
+
+        for marker in CURRICULUM_MARKER_PATTERN.finditer(block):
+            pending.append(block[position:marker.start()])
+            position = marker.end()
+            if marker.group('bullet'):
+                continue
+            flush()
+            if marker.group('grade'):
+                grade = int(marker.group('grade_level'))
+                semester, category = 1, 'core'
+            elif marker.group('first'):
+                semester, category = 1, 'core'
+            elif marker.group('second'):
+                semester, category = 2, 'core'
+            else:
+                category = marker.group('category_name').lower()
+        pending.append(block[position:])
+        flush()
+    return rows
+
+
+EMAIL_DOMAIN_PATTERN = re.compile(r"@\s*deped\s*qc\.ph")
+AREA_KEYS = [
+    ("ICT", r"\bICT\b|information and communication"),
+    ("STEM", r"\bSTEM\b"),
+    ("ABM", r"\bABM\b|accountancy"),
+    ("HUMSS", r"\bHUMM?SS?\b|humanities"),
+    ("ENGLISH", r"\benglish\b"),
+    ("SCIENCE", r"\bscience\b(?! and)|\bphysics\b"),
+    ("MATH", r"\bmath(ematics)?\b"),
+    ("TVL", r"\bTVL\b|technical-?\s*vocational"),
+    ("HE", r"\bhome economics\b|\bcookery\b"),
+    ("IA", r"\bindustrial arts\b|\(IA\)"),
+    ("RESEARCH", r"\bresearch\b"),
+    ("EMPOWERMENT TECHNOLOGIES", r"\bempowerment technolog"),
+    ("MIL", r"\bmedia and information literacy\b"),
+]
+
+
+def area_keys(text):
+    """Normalised subject-area keys mentioned in a text"""
+    return [key for key, pattern in AREA_KEYS if re.search(pattern, text, re.IGNORECASE)]
+
+
+def _repair_name(tokens):
+    # Lowercase fragments belong to the previous word ("Andr ea" -> "Andrea")
+    words = []
+    for token in tokens:
+        if words and re.fullmatch(r"[a-zñ]{1,4}", token):
+            words[-1] += token
+        else:
+            words.append(token)
+    return ' '.join(words)
+
+
+def _letters(text):
+    return re.sub(r"[^a-zñ]", '', text.lower())
+
+
+def _split_name_and_email(tokens):
+    """Split '<area> <Name> <email local part>' tokens into (prefix, name tokens, email local)"""
+    # The email local part is the trailing run of lowercase tokens
+    start = len(tokens)
+    while start > 0 and re.fullmatch(r"[a-z0-9.ñ]+", tokens[start - 1]):
+        start -= 1
+
+    for k in range(start, len(tokens)):
+        local = ''.join(tokens[k:])
+        before = tokens[:k]
+        first = local.partition('.')[0]
+        # The name starts where its letters spell the start of the address
+        for j in range(max(0, k - 8), k):
+            name = _repair_name(before[j:])
+            if not name or not name[0].isupper():
+                continue
+            surname = _letters(name.split()[-1])
+            if '.' in local and len(_letters(first)) > 1 and _letters(name).startswith(_letters(first)):
+                return before[:j], before[j:], local
+            if '.' not in local and surname == _letters(local):
+                # Address without a first name: take the capitalised words before it
+                j = k - 1
+                while j > 0 and k - j < 3 and re.fullmatch(r"[A-Z][a-zñ]+", before[j - 1]):
+                    j -= 1
+                return before[:j], before[j:], local
+    return None
+
+
+def extract_faculty(text):
+    """(name, email, subject_area) rows of the SHS faculty directory"""
+    directory = _section(text, r"SHS Faculty information.*?Subject Area Name Email", r"Person in Charge")
+    # The services table interrupts the faculty table on the same page
+    directory = re.sub(r"SHS Services\s*-\s*Guidance Service.*?Career Guidance", ' ', directory)
+    segments = EMAIL_DOMAIN_PATTERN.split(directory)
+    rows = []
+    area = ''
+    for segment in segments[:-1]:
+        tokens = segment.split()
+        split = _split_name_and_email(tokens)
+        if split is None:
+            logger.warning(f"Could not parse faculty entry: {segment.strip()[:80]}")
+            continue
+        prefix, name_tokens, local = split
+        prefix_text = _clean(re.sub(r"\s*([;,])\s*", r"\1 ", ' '.join(prefix)))
+        if prefix_text:
+            # Drop expansions like "(Information and Communication Technology)"
+            area = re.sub(r"\s*\([^)]*\)", '', re.sub(r"\s+([;,)])", r"\1", prefix_text))
+        rows.append((_repair_name(name_tokens), f"{local}@depedqc.ph", area))
+    return rows
+
+
+def extract_offices(text):
+    """(office, hours, services, people, location) rows for school services"""
+    rows = []
+    guidance = re.search(r"Guidance Service\s*:\s*(.+?)\s*-\s*Service offered\s*:\s*(.+?Career Guidance)", text)
+    guidance_person = re.search(r"Person in Charge\s*:\s*(.+?)\s*-\s*Library Service", text)
+    if guidance:
+        rows.append(("Guidance Office", _clean(guidance.group(1)), _clean(guidance.group(2)),
+                     _clean(guidance_person.group(1)) if guidance_person else ''))
+
+    library = re.search(r"Library Service\s*:\s*(.+?)\s*-\s*Registrar", text)
+    librarians = re.search(r"Librarian\s*:\s*(.+?)\s*📖", text)
+    if library:
+        people = _clean(librarians.group(1)) if librarians else ''
+        people = re.sub(r"\s+(?=Mrs?\.|Ms\.)", ', ', people)
+        rows.append(("Library", '', _clean(library.group(1)), people))
+
+    registrar = re.search(r"Registrar Service\s*:\s*(.+?)\s*-\s*Person in Charge\s*:\s*(.+?)\s*SHS School Building", text)
+    if registrar:
+        rows.append(("Registrar", '', _clean(registrar.group(1)), _clean(registrar.group(2))))
+    return rows
+
+
+def extract_locations(text):
+    """(building, occupant) rows of the campus map"""
+    mapping = _section(text, r"SHS School Building and Mapping\s*:", r"Lagro High School Library Process")
+    rows = []
+    for chunk in mapping.split('📍')[1:]:
+        parts = chunk.split('●')
+        building = _clean(re.sub(r"[^\w\s&().-]", '', parts[0]))
+        if not building:
+            # Unlabelled entries on the map; don't guess their building
+            continue
+        for occupant in parts[1:]:
+            occupant = _clean(re.sub(r"[^\w\s&(),.'-]", '', occupant))
+            if occupant and not occupant.startswith('Lagro High School'):
+                rows.append((building, occupant))
+    return rows
+
+
+VOUCHER_TIER_PATTERN = re.compile(
+    r"located\s*in\s*(?:the\s+)?(.+?)\s+will receive a full voucher amount of PhP\s*([\d,]+)(.*?)(?=located\s*in|$)",
+    re.DOTALL
+)
+
+
+def extract_fees(text):
+    """(fee, applies_to, amount, note) rows"""
+    rows = []
+    tuition = _section(text, r"Lagro High School - Tuition Fee", r"For Official Reference")
+    if re.search(r"Tuition is 100% FREE", tuition, re.IGNORECASE):
+        rows.append(("Tuition", "All SHS strands", "Free",
+                     "Public DepEd schools don't collect tuition (Republic Act No. 10931 and DepEd policy)"))
+    if re.search(r"Miscellaneous fees are not charged", tuition, re.IGNORECASE):
+        rows.append(("Miscellaneous fees", "All SHS strands", "Not charged", ''))
+
+    voucher = _section(text, r"How much is the value of the voucher\?", r"How did the government")
+    for region, full, rest in VOUCHER_TIER_PATTERN.findall(voucher):
+        region = _clean(re.sub(r"\s+", ' ', region))
+        rows.append(("SHS Voucher", f"Public JHS completers at a non-DepEd SHS in {region}", f"PhP {full}", ''))
+        private = re.search(r"80% or PhP\s*([\d,]+)", rest)
+        if private:
+            rows.append(("SHS Voucher", f"Private JHS completers at a non-DepEd SHS in {region}",
+                         f"PhP {private.group(1)}", ''))
+        state = re.search(r"50% or PhP\s*([\d,]+)", rest)
+        if state:
+            rows.append(("SHS Voucher", f"SUC/LUC enrollees in {region}", f"PhP {state.group(1)}", ''))
+    return rows
+
+
+RULE_HEADING_PATTERN = re.compile(r"^(.*?)\s*(?:\((Punishable by [^)]*)\))?$")
+
+
+def extract_rules(text):
+    """(category, rule, penalty) rows of the rules and regulations"""
+    rules = _section(text, r"Lagro High School - Rules and Regulations", r"Lagro High School - Scholarship")
+    pieces = rules.split('●')
+    rows = []
+    heading = RULE_HEADING_PATTERN.match(_clean(pieces[0]))
+    category, penalty = heading.group(1), heading.group(2) or ''
+    for piece in pieces[1:]:
+        # A new heading follows the last sentence of a rule
+        match = re.match(r"(.*[.!?\"”])\s*(.*)$", piece.strip(), re.DOTALL)
+        rule, following = (match.group(1), match.group(2)) if match else (piece, '')
+        rule = _clean(rule)
+        if rule:
+            rows.append((category, rule if rule[-1] in '.!?"”' else rule + '.', penalty))
+        following = _clean(following)
+        if following:
+            heading = RULE_HEADING_PATTERN.match(following)
+            category, penalty = heading.group(1), heading.group(2) or ''
+    return rows
+
+
+def extract_tables(pages):
+    """All knowledge tables from the PDF page texts"""
+    text = repair_split_words(' '.join(pages))
+    return {
+        "strands": extract_strands(text),
+        "subjects": extract_subjects(text),
+        "faculty": extract_faculty(text),
+        "offices": extract_offices(text),
+        "locations": extract_locations(text),
+        "fees": extract_fees(text),
+        "rules": extract_rules(text),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE strands (code TEXT PRIMARY KEY, name TEXT NOT NULL, enrolled TEXT) WITHOUT ROWID;
+CREATE TABLE subjects (
+    id INTEGER PRIMARY KEY, strand TEXT NOT NULL, specialization TEXT NOT NULL, grade INTEGER NOT NULL,
+    semester INTEGER NOT NULL, category TEXT NOT NULL, subject TEXT NOT NULL);
+CREATE INDEX subjects_by_strand ON subjects (strand, grade, semester);
+CREATE TABLE faculty (id INTEGER PRIMARY KEY, name TEXT NOT NULL, email TEXT NOT NULL, subject_area TEXT NOT NULL);
+CREATE TABLE faculty_areas (area TEXT NOT NULL, faculty_id INTEGER NOT NULL, PRIMARY KEY (area, faculty_id)) WITHOUT ROWID;
+CREATE TABLE offices (office TEXT PRIMARY KEY, hours TEXT, services TEXT, people TEXT) WITHOUT ROWID;
+CREATE TABLE locations (id INTEGER PRIMARY KEY, building TEXT NOT NULL, occupant TEXT NOT NULL);
+CREATE TABLE fees (id INTEGER PRIMARY KEY, fee TEXT NOT NULL, applies_to TEXT NOT NULL, amount TEXT NOT NULL, note TEXT);
+CREATE TABLE rules (id INTEGER PRIMARY KEY, category TEXT NOT NULL, rule TEXT NOT NULL, penalty TEXT);
+-- Inverted index over the free-text tables (rules, locations)
+CREATE TABLE terms (term TEXT NOT NULL, tbl TEXT NOT NULL, row_id INTEGER NOT NULL, PRIMARY KEY (term, tbl, row_id)) WITHOUT ROWID;
+"""
+
+
+def _terms(text):
+    return set(tokenize(text))
+
+
+def build_tables(pdf_path=DEFAULT_PDF_PATH, db_path=DEFAULT_DB_PATH):
+    """Extract the tables from the PDF and write them to db_path atomically"""
+    started = time.perf_counter()
+    tables = extract_tables(extract_pdf_pages(pdf_path))
+
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO strands VALUES (?, ?, ?)", tables["strands"])
+        conn.executemany("INSERT INTO subjects (strand, specialization, grade, semester, category, subject)"
+                         " VALUES (?, ?, ?, ?, ?, ?)", tables["subjects"])
+        for faculty_id, (name, email, area) in enumerate(tables["faculty"], start=1):
+            conn.execute("INSERT INTO faculty VALUES (?, ?, ?, ?)", (faculty_id, name, email, area))
+            conn.executemany("INSERT OR IGNORE INTO faculty_areas VALUES (?, ?)",
+                             [(key, faculty_id) for key in area_keys(area)])
+        conn.executemany("INSERT INTO offices VALUES (?, ?, ?, ?)", tables["offices"])
+        conn.executemany("INSERT INTO fees (fee, applies_to, amount, note) VALUES (?, ?, ?, ?)", tables["fees"])
+        for row_id, (building, occupant) in enumerate(tables["locations"], start=1):
+            conn.execute("INSERT INTO locations VALUES (?, ?, ?)", (row_id, building, occupant))
+            conn.executemany("INSERT OR IGNORE INTO terms VALUES (?, 'locations', ?)",
+                             [(term, row_id) for term in _terms(occupant)])
+        for row_id, (category, rule, penalty) in enumerate(tables["rules"], start=1):
+            conn.execute("INSERT INTO rules VALUES (?, ?, ?, ?)", (row_id, category, rule, penalty))
+            conn.executemany("INSERT OR IGNORE INTO terms VALUES (?, 'rules', ?)",
+                             [(term, row_id) for term in _terms(f"{category} {rule}")])
+
+        meta = {"schema_version": SCHEMA_VERSION, "sha256": file_sha256(pdf_path),
+                "pdf": os.path.basename(pdf_path), "built_at": int(time.time())}
+        meta.update({f"rows_{name}": len(rows) for name, rows in tables.items()})
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in meta.items()])
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    logger.info(f"Built knowledge tables in {(time.perf_counter() - started) * 1000:.0f} ms: "
+                + ', '.join(f"{name} {len(rows)}" for name, rows in tables.items()))
+    return tables
+
+
+def read_meta(db_path):
+    """Metadata of a built tables file, or None if it can't be read"""
+    try:
+        conn = sqlite3.connect(f"{Path(os.path.abspath(db_path)).as_uri()}?mode=ro", uri=True)
+        try:
+            return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def load_tables(db_path=DEFAULT_DB_PATH, pdf_path=DEFAULT_PDF_PATH, fallback_path=None):
+    """KnowledgeTables for db_path, rebuilding it if missing or stale
+
+    Read-only deployments (e.g. Vercel) rebuild into fallback_path instead.
+    """
+    meta = read_meta(db_path) if os.path.exists(db_path) else None
+    if not os.path.exists(pdf_path):
+        return KnowledgeTables(db_path) if meta else None
+
+    pdf_hash = file_sha256(pdf_path)
+    fresh = meta is not None and meta.get("sha256") == pdf_hash and meta.get("schema_version") == str(SCHEMA_VERSION)
+    if fresh:
+        return KnowledgeTables(db_path)
+
+    logger.info("Knowledge tables missing or stale, rebuilding from PDF")
+    try:
+        build_tables(pdf_path, db_path)
+        return KnowledgeTables(db_path)
+    except OSError as e:
+        if not fallback_path:
+            raise
+        logger.warning(f"Could not write knowledge tables to {db_path} ({str(e)}), using {fallback_path}")
+        fallback_meta = read_meta(fallback_path) if os.path.exists(fallback_path) else None
+        if not (fallback_meta and fallback_meta.get("sha256") == pdf_hash
+                and fallback_meta.get("schema_version") == str(SCHEMA_VERSION)):
+            build_tables(pdf_path, fallback_path)
+        return KnowledgeTables(fallback_path)
+
+
+# ---------------------------------------------------------------------------
+# Lookup
+# ---------------------------------------------------------------------------
+
+# Question topic -> table, checked in order
+TOPIC_PATTERNS = [
+    ("faculty", re.compile(r"(?i)\b(teach\w*|teachers?|faculty|instructors?|guro|nagtuturo|email of)\b")),
+    ("fees", re.compile(r"(?i)\b(tuition|fees?|bayad|babayaran|magkano|how much|cost|vouchers?|libre)\b")),
+    ("locations", re.compile(r"(?i)\b(where|saan|nasaan|located|location|building|find the)\b")),
+    ("offices", re.compile(r"(?i)\b(office hours|hours|open|opens|close|closes|bukas|oras|in charge|services?|librarians?)\b")),
+    ("subjects", re.compile(r"(?i)\b(subjects?|curriculum|asignatura|courses?|classes|pag-aaralan)\b")),
+    ("rules", re.compile(
+        r"(?i)\b(rules?|regulations?|bawal|prohibited|allowed|offen[cs]es?|haircut|hair|phones?|cellphones?|"
+        r"gadgets?|late|tardy|tardiness|absent|absences|suspension|suspended|punish\w*|penalt\w*|dyeing|"
+        r"school id|flag ceremony|textbooks?|cheating|smoking|vandalism)\b")),
+    ("strands", re.compile(r"(?i)\b(strands?|tracks?)\b")),
+]
+OFFICE_PATTERNS = [
+    ("Guidance Office", re.compile(r"(?i)\bguidance\b")),
+    ("Library", re.compile(r"(?i)\b(library|aklatan|silid-aklatan|librarians?)\b")),
+    ("Registrar", re.compile(r"(?i)\bregistrar\b")),
+]
+SEMESTER_PATTERN = re.compile(
+    r"(?i)\b(?:(first|1st|una|unang)|(second|2nd|ikalawa|ikalawang))\s*(?:sem|semester)\b")
+CATEGORY_PATTERN = re.compile(r"(?i)\b(core|applied|speciali[sz]ed)\b")
+# Every grade a question names, including lists like "grade 11 and 12" or "grades 11/12"
+GRADE_LIST_PATTERN = re.compile(
+    r"(?i)\b(?:grades?|baitang|g)\s*-?\s*(?:11|12)(?:\s*(?:,|/|&|-|and|or|at)\s*(?:grade\s*)?(?:11|12)\b)*"
+    r"|\b(?:11|12)(?:th)?\s+grade\b")
+# Yes/no and counting questions; a table listing doesn't answer them, the model does with the rows
+CLOSED_QUESTION_PATTERN = re.compile(
+    r"(?i)^\s*(is|are|am|does|do|did|can|could|may|will|would|was|were|has|have|should)\b|"
+    r"\bhow many\b|\bnumber of\b|\bilan\b|\bmeron bang\b|\bmay\b.*\bba\b")
+# Confidence of a lookup spanning several strands or grades: grounding for the model, never a template answer
+MULTIPLE_CONFIDENCE = 0.6
+STRAND_AREAS = {"TVL-ICT": "ICT", "TVL-HE": "HE", "TVL-IA": "IA", "STEM": "STEM", "ABM": "ABM", "HUMSS": "HUMSS"}
+# Everyday words for the vocabulary of the rules
+TERM_SYNONYMS = {
+    "phone": "cellular", "phones": "cellular", "cellphone": "cellular", "cellphones": "cellular",
+    "cp": "cellular", "gadget": "gadgets", "late": "tardiness", "tardy": "tardiness",
+    "absent": "absences", "hair": "haircut", "id": "id", "library": "library", "smoking": "smoking",
+    "textbook": "textbooks", "cheat": "cheating", "flag": "flag", "dye": "dyeing",
+}
+TOPIC_WORDS = frozenset("""
+rules rule regulations regulation allowed prohibited bawal school lagro high students student
+where located location building find saan nasaan office
+""".split())
+# Only short questions naming a strand, grade or office ("how about grade 12?") are follow-ups
+FOLLOW_UP_MAX_WORDS = 6
+CATEGORY_ORDER = {"core": 0, "applied": 1, "specialized": 2}
+SEMESTER_NAMES = {1: "First Semester", 2: "Second Semester"}
+
+
+class Lookup:
+    """Rows matching a question, with a template answer when one can be given"""
+    __slots__ = ('table', 'rows', 'confidence', 'answer')
+
+    def __init__(self, table, rows, confidence, answer=None):
+        self.table = table
+        self.rows = rows
+        self.confidence = confidence
+        self.answer = answer
+
+    def grounding(self):
+        """The matching rows as a prompt block"""
+        lines = [f"Exact facts from the Lagro High School data tables ({self.table}):"]
+        for row in self.rows:
+            lines.append('- ' + '; '.join(f"{key}: {row[key]}" for key in row.keys()
+                                          if key != 'id' and row[key] not in (None, '')))
+        return '\n'.join(lines)
+
+
+def parse_question(question):
+    """Topic and filters of a question"""
+    topic = next((name for name, pattern in TOPIC_PATTERNS if pattern.search(question)), None)
+    strands = STRAND_PATTERN.findall(question)
+    grade = GRADE_PATTERN.search(question)
+    grades = {int(n) for match in GRADE_LIST_PATTERN.finditer(question) for n in re.findall(r"1[12]", match.group(0))}
+    semester = SEMESTER_PATTERN.search(question)
+    category = CATEGORY_PATTERN.search(question)
+    office = next((name for name, pattern in OFFICE_PATTERNS if pattern.search(question)), None)
+    return {
+        "topic": topic,
+        "strand": canonical_strand(strands[-1]) if strands else None,
+        "strands": list(dict.fromkeys(canonical_strand(strand) for strand in strands)),
+        "grade": int(grade.group(1) or grade.group(2)) if grade else None,
+        "grades": sorted(grades),
+        "semester": (1 if semester.group(1) else 2) if semester else None,
+        "category": category.group(1).lower().replace('specialised', 'specialized') if category else None,
+        "office": office,
+        "areas": area_keys(question),
+    }
+
+
+class KnowledgeTables:
+    """Read-only, memory-mapped access to the built tables, opened on first use"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._uri = f"{Path(os.path.abspath(db_path)).as_uri()}?mode=ro"
+        self._local = threading.local()
+
+    def _connect(self):
+        # One connection per thread; pages are served from the shared mapping
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._uri, uri=True)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql, params=()):
+        return self._connect().execute(sql, params).fetchall()
+
+    def meta(self):
+        return {row["key"]: row["value"] for row in self.query("SELECT key, value FROM meta")}
+
+    def lookup(self, question, previous_question=None):
+        """Lookup for a question, or None when no table answers it
+
+        Filters missing from a follow-up ("how about grade 12?") are taken from
+        the previous question, which lowers the confidence.
+        """
+        filters = parse_question(question)
+        inherited = False
+        has_filter = any(filters[key] is not None for key in ("strand", "grade", "semester", "office")) or filters["areas"]
+        if previous_question and len(question.split()) <= FOLLOW_UP_MAX_WORDS:
+            previous = parse_question(previous_question)
+            if filters["topic"] is None and previous["topic"] is not None and has_filter:
+                filters["topic"] = previous["topic"]
+                inherited = True
+            for key in ("strand", "grade", "office"):
+                if filters[key] is None and previous[key] is not None and filters["topic"] == previous["topic"]:
+                    filters[key] = previous[key]
+                    inherited = True
+            if not filters["areas"] and filters["topic"] == previous["topic"]:
+                filters["areas"] = previous["areas"]
+        if filters["topic"] is None:
+            return None
+
+        if len(filters["strands"]) > 1 or len(filters["grades"]) > 1:
+            result = self._lookup_each(question, filters)
+        else:
+            result = getattr(self, f"_lookup_{filters['topic']}")(question, filters)
+        if result is None or not result.rows:
+            return None
+        if inherited:
+            result.confidence -= 0.2
+        if detect_language(question) != 'en' or CLOSED_QUESTION_PATTERN.search(question):
+            # Templates are English listings; Filipino, yes/no and counting questions get the rows as grounding
+            result.answer = None
+        return result
+
+    def _lookup_each(self, question, filters):
+        """Rows for every strand and grade a question names ("STEM and ABM", "grade 11 and 12"), as grounding"""
+        lookup = getattr(self, f"_lookup_{filters['topic']}")
+        table, rows, seen = None, [], set()
+        for strand in filters["strands"] or [filters["strand"]]:
+            for grade in filters["grades"] or [filters["grade"]]:
+                part_filters = dict(filters, strand=strand, grade=grade)
+                if len(filters["strands"]) > 1:
+                    # Subject areas would name every strand at once; each strand brings its own
+                    part_filters["areas"] = []
+                part = lookup(question, part_filters)
+                if part is None:
+                    continue
+                table = part.table
+                for row in part.rows:
+                    key = tuple(row)
+                    if key not in seen:
+                        seen.add(key)
+                        rows.append(row)
+        return Lookup(table, rows, MULTIPLE_CONFIDENCE) if rows else None
+
+    def _lookup_subjects(self, question, filters):
+        strand = filters["strand"]
+        if strand is None:
+            return None
+        sql = "SELECT * FROM subjects WHERE strand = ?"
+        params = [strand]
+        for key in ("grade", "semester", "category"):
+            if filters[key] is not None:
+                sql += f" AND {key} = ?"
+                params.append(filters[key])
+        rows = sorted(self.query(sql, params),
+                      key=lambda r: (r["specialization"], r["grade"], r["semester"], CATEGORY_ORDER[r["category"]], r["id"]))
+        if filters["grade"] is None:
+            # The whole two-year curriculum is too long for a template answer
+            return Lookup("subjects", rows, 0.7)
+        return Lookup("subjects", rows, 1.0, _render_subjects(strand, rows))
+
+    def _lookup_faculty(self, question, filters):
+        areas = filters["areas"] or ([STRAND_AREAS[filters["strand"]]] if filters["strand"] in STRAND_AREAS else [])
+        if not areas:
+            return None
+        # The most specific area wins ("TVL-ICT" -> ICT teachers, not all TVL teachers)
+        area = areas[0]
+        if len([key for key in areas if key != "TVL"]) > 1:
+            # "English and Math teachers": every named area, as grounding
+            rows = self.query(
+                "SELECT DISTINCT f.* FROM faculty_areas a JOIN faculty f ON f.id = a.faculty_id"
+                f" WHERE a.area IN ({', '.join('?' * len(areas))}) ORDER BY f.id", areas
+            )
+            return Lookup("faculty", rows, MULTIPLE_CONFIDENCE)
+        rows = self.query(
+            "SELECT f.* FROM faculty_areas a JOIN faculty f ON f.id = a.faculty_id WHERE a.area = ? ORDER BY f.id",
+            (area,)
+        )
+        return Lookup("faculty", rows, 1.0, _render_faculty(area, rows, filters["grade"]))
+
+    def _lookup_fees(self, question, filters):
+        if re.search(r"(?i)voucher", question):
+            rows = self.query("SELECT * FROM fees WHERE fee = 'SHS Voucher' ORDER BY id")
+            return Lookup("fees", rows, 0.95, _render_vouchers(rows))
+        rows = self.query("SELECT * FROM fees WHERE fee != 'SHS Voucher' ORDER BY id")
+        return Lookup("fees", rows, 1.0, _render_tuition(rows, filters["strand"]))
+
+    def _lookup_offices(self, question, filters):
+        if filters["office"] is None:
+            return None
+        rows = self.query("SELECT * FROM offices WHERE office = ?", (filters["office"],))
+        if not rows:
+            return None
+        asks_hours = re.search(r"(?i)\b(hours|open|opens|close|closes|bukas|oras|time)\b", question)
+        if asks_hours and not rows[0]["hours"]:
+            # The PDF has no hours for this office; let the model say so with the row as context
+            return Lookup("offices", rows, 0.6)
+        location = self._building_of(filters["office"])
+        return Lookup("offices", rows, 1.0, _render_office(rows[0], location))
+
+    def _lookup_locations(self, question, filters):
+        terms = [TERM_SYNONYMS.get(t, t) for t in tokenize(question) if t not in TOPIC_WORDS]
+        if filters["strand"]:
+            terms.append(filters["strand"].split('-')[-1].lower())
+        if filters["office"]:
+            terms.extend(tokenize(filters["office"].replace("Office", '')))
+        rows = self._search_terms('locations', terms)
+        if not rows:
+            return None
+        buildings = {row["building"] for row in rows}
+        return Lookup("locations", rows, 1.0 if len(buildings) == 1 else 0.8, _render_locations(rows))
+
+    def _lookup_rules(self, question, filters):
+        if re.search(r"(?i)\blight offen[cs]es?\b", question):
+            rows = self.query("SELECT * FROM rules WHERE category LIKE 'Light%' ORDER BY id")
+        elif re.search(r"(?i)\b(major|grave) offen[cs]es?\b", question):
+            rows = self.query("SELECT * FROM rules WHERE category LIKE 'Major%' ORDER BY id")
+        else:
+            terms = [TERM_SYNONYMS.get(t, t) for t in tokenize(question) if t not in TOPIC_WORDS]
+            rows = self._search_terms('rules', terms)
+        if not rows:
+            return None
+        if len(rows) > 15:
+            return Lookup("rules", rows, 0.6)
+        return Lookup("rules", rows, 0.95, _render_rules(rows))
+
+    def _lookup_strands(self, question, filters):
+        if filters["strand"] is not None:
+            # "What is STEM?" needs a description, not a table row
+            return Lookup("strands", self.query("SELECT * FROM strands WHERE code = ?", (filters["strand"],)), 0.5)
+        rows = self.query("SELECT * FROM strands")
+        order = {code: n for n, code in enumerate(("STEM", "HUMSS", "ABM", "TVL-ICT", "TVL-HE", "TVL-IA"))}
+        rows = sorted(rows, key=lambda r: order.get(r["code"], len(order)))
+        return Lookup("strands", rows, 1.0, _render_strands(rows))
+
+    def _search_terms(self, table, terms):
+        """Rows of a free-text table ranked by how many query terms they contain"""
+        terms = sorted(set(terms))
+        if not terms:
+            return []
+        placeholders = ','.join('?' * len(terms))
+        hits = self.query(
+            f"SELECT row_id, COUNT(*) AS matched FROM terms WHERE tbl = ? AND term IN ({placeholders})"
+            f" GROUP BY row_id ORDER BY matched DESC, row_id",
+            [table] + terms
+        )
+        if not hits:
+            return []
+        best = hits[0]["matched"]
+        ids = [hit["row_id"] for hit in hits if hit["matched"] == best]
+        return self.query(f"SELECT * FROM {table} WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids)
+
+    def _building_of(self, office):
+        rows = self._search_terms('locations', tokenize(office.replace("Office", '')))
+        return rows[0]["building"] if rows else None
+
+
+def _render_subjects(strand, rows):
+    grade = rows[0]["grade"]
+    lines = [f"📚 {strand} subjects for Grade {grade}:"]
+    heading = None
+    for row in rows:
+        section = (row["specialization"], row["semester"])
+        if section != heading:
+            heading = section
+            title = SEMESTER_NAMES[row["semester"]]
+            if row["specialization"]:
+                title = f"{row['specialization']} – {title}"
+            lines.append(f"\n📝 {title}")
+            category = None
+        if row["category"] != category:
+            category = row["category"]
+            lines.append(f"{category.capitalize()} subjects:")
+        lines.append(f"• {row['subject']}")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+AREA_TITLES = {"HE": "Home Economics", "IA": "Industrial Arts", "MIL": "Media and Information Literacy"}
+
+
+def _render_faculty(area, rows, grade):
+    title = AREA_TITLES.get(area, area if area.isupper() and len(area) <= 5 else area.title())
+    lines = [f"👩‍🏫 {title} teachers in Lagro High School's Senior High School:", '']
+    lines.extend(f"• {row['name']} – {row['email']}" for row in rows)
+    if grade is not None:
+        lines.append(f"\nKey point: the faculty list doesn't say which grade level each teacher handles, "
+                     f"so please confirm with the school for Grade {grade} classes.")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+def _render_tuition(rows, strand):
+    by_fee = {row["fee"]: row for row in rows}
+    tuition = by_fee.get("Tuition")
+    if tuition is None:
+        return None
+    scope = f"all SHS strands, including {strand}" if strand else "all SHS strands"
+    lines = [f"💸 Good news! Tuition at Lagro High School is FREE for {scope}."]
+    if "Miscellaneous fees" in by_fee:
+        lines.append("Miscellaneous fees are not charged either.")
+    if tuition["note"]:
+        lines.append(f"\n📌 {tuition['note']}.")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+def _render_vouchers(rows):
+    lines = ["🎓 SHS Voucher amounts (for Grade 10 completers enrolling in a non-DepEd Senior High School):", '']
+    lines.extend(f"• {row['applies_to']}: {row['amount']}" for row in rows)
+    lines.append("\nPlease verify the latest details on the official school website or by contacting "
+                 "the school directly.")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+def _render_office(row, building):
+    lines = [f"🏫 {row['office']}:"]
+    if row["hours"]:
+        lines.append(f"• Hours: {row['hours']}")
+    if row["services"]:
+        lines.append(f"• Services: {row['services']}")
+    if row["people"]:
+        lines.append(f"• Person in charge: {row['people']}")
+    if building:
+        lines.append(f"• Location: {building}")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+def _render_locations(rows):
+    lines = [f"📍 {row['occupant']}: {row['building']}" for row in rows]
+    lines.append("\nHope that helps you find your way! 🗺️")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+def _render_rules(rows):
+    lines = ["📋 From the Lagro High School rules and regulations:", '']
+    for row in rows:
+        penalty = f" ({row['penalty']})" if row["penalty"] else ''
+        lines.append(f"• {row['category']}: {row['rule']}{penalty}")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+def _render_strands(rows):
+    lines = ["🎓 Lagro High School offers these Senior High School strands:", '']
+    for row in rows:
+        lines.append(f"• {row['code']} – {row['name']}")
+    lines.append("\n🤔 Which strand are you interested in? I can share its subjects per grade and semester.")
+    lines.append(f"\n{HELPFUL_PROMPT}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the structured knowledge tables from the school PDF")
+    parser.add_argument('--pdf', default=DEFAULT_PDF_PATH, help="Path to the source PDF")
+    parser.add_argument('--out', default=DEFAULT_DB_PATH, help="Where to write the tables")
+    parser.add_argument('--query', help="Look up a question in the built tables")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    tables = build_tables(args.pdf, args.out)
+    print(f"Built {sum(len(rows) for rows in tables.values())} rows -> {args.out} "
+          f"({os.path.getsize(args.out) // 1024} kB)")
+    if args.query:
+        result = KnowledgeTables(args.out).lookup(args.query)
+        if result is None:
+            print("No table answers this question")
+        else:
+            print(f"{result.table} (confidence {result.confidence:.2f})")
+            print(result.answer or result.grounding())
+
+
+if __name__ == '__main__':
+    main()
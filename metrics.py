@@ -0,0 +1,201 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock, so
+recording a value costs a dict lookup and an addition. Values are per process;
+scrape each worker (or sum them) when running several.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in milliseconds and size buckets in tokens
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [(name, value) for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def _samples(self):
+        if self._function is not None:
+            # Collected at scrape time, e.g. the size of a store
+            try:
+                return [f"{self.name} {self._function()}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS_MS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {round(series[-1], 3)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS_MS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class RequestTrace:
+    """Per-request stage timings and fields for the structured request log"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.fields = {}
+        self.status = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def record(self):
+        record = {
+            "event": "request",
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "latency_ms": round(self.elapsed_ms(), 1),
+            "stages_ms": {name: round(ms, 1) for name, ms in self.stages.items()}
+        }
+        record.update(self.fields)
+        return record
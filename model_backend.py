@@ -0,0 +1,652 @@
+"""
+Model backends behind send_message.
+
+`GeminiBackend` talks to the Gemini API. `FakeBackend` is a local stand-in with
+configurable latency, streaming and error behaviour so the app can be
+benchmarked and load-tested without spending API quota. Both expose the same
+calls the app uses: `generate_content(contents, system_instruction, stream, timeout)`
+returning objects shaped like Gemini responses, its coroutine twin
+`generate_content_async` (streams are then iterated with `async for`), and
+`upload_file`.
+
+Select the backend with MODEL_BACKEND=gemini|fake|replay. The fake backend reads:
+
+- FAKE_MODEL_LATENCY: latency distribution before the first token, e.g.
+  "fixed:800", "uniform:300-1500", "normal:800,200" or "lognormal:800,0.5" (ms)
+- FAKE_MODEL_CHUNKS / FAKE_MODEL_CHUNK_DELAY_MS: streamed chunk count and gap
+- FAKE_MODEL_ERROR_RATE: fraction of calls that fail with a 429/503 error
+- FAKE_MODEL_RESPONSE_CHARS: length of generated answers
+- FAKE_MODEL_SEED: seed for reproducible runs
+
+Model traffic can be recorded and replayed, so changes to prompt assembly,
+history handling or caching can be compared between commits on the same
+traffic. `RecordingBackend` wraps the real backend (MODEL_RECORD=<file>) and
+appends one NDJSON line per model call: a hash of the request contents, the
+response text, its chunk timing, token counts and any error. The app adds a
+line per incoming message to the same file, so it is also the traffic trace
+that benchmarks/replay_trace.py sends again. `ReplayBackend` (MODEL_BACKEND=replay)
+answers from such a file offline:
+
+- MODEL_REPLAY_FILE: the recording to serve
+- MODEL_REPLAY_TIME_SCALE: multiplier on recorded latency (1 = original
+  timing, 0.5 = twice as fast, 0 = no delay)
+- MODEL_REPLAY_MISS: 'fake' (default) answers unrecorded requests with the
+  fake backend, 'error' fails them
+
+Requests are matched on the hash of their contents first. When prompt
+assembly changed, the contents differ, so they fall back to the recordings of
+the same user message, with prompt tokens scaled by how much the prompt grew
+or shrank.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiBackend:
+    """Google Gemini via the google-generativeai SDK
+
+    Model clients are created once per process and system instruction and
+    shared by all requests, instead of re-serializing the system prompt on
+    every call. They are built lazily so forked workers never inherit one.
+    The SDK itself (and its gRPC/protobuf stack, most of the app's import
+    time) is only imported and configured by the first call that needs it.
+    """
+    name = 'gemini'
+
+    def __init__(self, model_name, api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._models = {}
+        self._lock = threading.Lock()
+        self._configured = False
+
+    def genai(self):
+        """The google.generativeai module, configured with the API key"""
+        import google.generativeai as genai
+
+        if not self._configured:
+            with self._lock:
+                if not self._configured:
+                    genai.configure(api_key=self.api_key)
+                    self._configured = True
+        return genai
+
+    def _model(self, system_instruction):
+        model = self._models.get(system_instruction)
+        if model is None:
+            genai = self.genai()
+            with self._lock:
+                model = self._models.get(system_instruction)
+                if model is None:
+                    model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+                    self._models[system_instruction] = model
+        return model
+
+    def generate_content(self, contents, system_instruction=None, stream=False, timeout=None):
+        request_options = {"timeout": timeout} if timeout else None
+        return self._model(system_instruction).generate_content(contents, stream=stream,
+                                                                request_options=request_options)
+
+    async def generate_content_async(self, contents, system_instruction=None, stream=False, timeout=None):
+        request_options = {"timeout": timeout} if timeout else None
+        return await self._model(system_instruction).generate_content_async(contents, stream=stream,
+                                                                            request_options=request_options)
+
+    def upload_file(self, file_path, mime_type):
+        from file_handles import gemini_upload
+
+        self.genai()
+        return gemini_upload(file_path, mime_type)
+
+
+def parse_latency(spec):
+    """Turn a latency spec like 'lognormal:800,0.5' into a sampler returning milliseconds"""
+    kind, _, args = (spec or 'fixed:0').partition(':')
+    if kind == 'fixed':
+        value = float(args or 0)
+        return lambda rng: value
+    if kind == 'uniform':
+        low, _, high = args.partition('-')
+        return lambda rng: rng.uniform(float(low), float(high))
+    if kind == 'normal':
+        mean, _, stdev = args.partition(',')
+        return lambda rng: max(0.0, rng.gauss(float(mean), float(stdev or 0)))
+    if kind == 'lognormal':
+        # Parameterised by the median in ms and the sigma of the underlying normal
+        median, _, sigma = args.partition(',')
+        mu = math.log(float(median))
+        return lambda rng: rng.lognormvariate(mu, float(sigma or 0.5))
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class _Usage:
+    __slots__ = ('prompt_token_count', 'candidates_token_count', 'total_token_count')
+
+    def __init__(self, prompt_tokens, response_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.total_token_count = prompt_tokens + response_tokens
+
+
+class FakeResponse:
+    """Mimics the parts of a Gemini response the app reads"""
+
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeStream:
+    """Iterable of FakeResponse chunks, like a streamed Gemini response"""
+
+    def __init__(self, chunks, first_delay, chunk_delay, usage):
+        self._chunks = chunks
+        self._first_delay = first_delay
+        self._chunk_delay = chunk_delay
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        time.sleep(self._first_delay)
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                time.sleep(self._chunk_delay)
+            yield FakeResponse(chunk, None)
+
+    async def __aiter__(self):
+        await asyncio.sleep(self._first_delay)
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                await asyncio.sleep(self._chunk_delay)
+            yield FakeResponse(chunk, None)
+
+
+def _fake_timeout(timeout):
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return TimeoutError(f"Fake model: no answer within {timeout}s")
+    return exceptions.DeadlineExceeded(f"Fake model: no answer within {timeout}s")
+
+
+def _fake_error(rng):
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return RuntimeError("Fake model error")
+    if rng.random() < 0.5:
+        return exceptions.ResourceExhausted("Fake model: quota exceeded")
+    return exceptions.ServiceUnavailable("Fake model: service unavailable")
+
+
+def _fake_file_handle(file_path, mime_type):
+    """A file handle shaped like the Gemini File API's, without uploading anything"""
+    now = time.time()
+    return {
+        "name": f"files/fake-{uuid.uuid4().hex[:12]}",
+        "uri": f"https://generativelanguage.googleapis.com/v1beta/files/fake-{os.path.basename(file_path)}",
+        "mime_type": mime_type,
+        "expires_at": now + 48 * 3600,
+        "uploaded_at": now
+    }
+
+
+FILLER_ANSWER = (
+    "📚 Here's what I found about that at Lagro High School. Senior High students can choose from "
+    "STEM, HUMSS, ABM and the TVL strands, each with core, applied and specialized subjects. "
+    "For the most accurate details, you can also contact the school at hs.lagro@depedqc.ph. "
+)
+
+
+class FakeBackend:
+    """Local Gemini stand-in for benchmarks and load tests"""
+    name = 'fake'
+
+    def __init__(self, latency='lognormal:800,0.4', chunks=8, chunk_delay_ms=40,
+                 error_rate=0.0, response_chars=600, seed=None):
+        self._sample_latency = parse_latency(latency)
+        self.chunks = max(1, chunks)
+        self.chunk_delay = chunk_delay_ms / 1000
+        self.error_rate = error_rate
+        self.response_chars = response_chars
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls):
+        seed = os.getenv('FAKE_MODEL_SEED')
+        return cls(
+            latency=os.getenv('FAKE_MODEL_LATENCY', 'lognormal:800,0.4'),
+            chunks=int(os.getenv('FAKE_MODEL_CHUNKS', '8')),
+            chunk_delay_ms=float(os.getenv('FAKE_MODEL_CHUNK_DELAY_MS', '40')),
+            error_rate=float(os.getenv('FAKE_MODEL_ERROR_RATE', '0')),
+            response_chars=int(os.getenv('FAKE_MODEL_RESPONSE_CHARS', '600')),
+            seed=int(seed) if seed else None
+        )
+
+    def _plan(self, contents):
+        with self._lock:
+            self.calls += 1
+            latency = self._sample_latency(self._rng) / 1000
+            error = _fake_error(self._rng) if self._rng.random() < self.error_rate else None
+        text = (FILLER_ANSWER * (self.response_chars // len(FILLER_ANSWER) + 1))[:self.response_chars]
+        usage = _Usage(_estimate_prompt_tokens(contents), len(text) // 4)
+        return latency, error, text, usage
+
+    def _respond(self, contents, system_instruction, stream, timeout):
+        """(seconds to wait, error to raise after waiting or None, response)"""
+        latency, error, text, usage = self._plan(contents)
+        if system_instruction:
+            usage.prompt_token_count += len(system_instruction) // 4
+        if timeout and latency > timeout:
+            return timeout, _fake_timeout(timeout), None
+        if not stream:
+            return latency + self.chunk_delay * (self.chunks - 1), error, FakeResponse(text, usage)
+        if error is not None:
+            return latency, error, None
+        size = math.ceil(len(text) / self.chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        # The stream sleeps on its own schedule while it is iterated
+        return 0, None, FakeStream(pieces, latency, self.chunk_delay, usage)
+
+    def generate_content(self, contents, system_instruction=None, stream=False, timeout=None):
+        delay, error, response = self._respond(contents, system_instruction, stream, timeout)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    async def generate_content_async(self, contents, system_instruction=None, stream=False, timeout=None):
+        delay, error, response = self._respond(contents, system_instruction, stream, timeout)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    def upload_file(self, file_path, mime_type):
+        return _fake_file_handle(file_path, mime_type)
+
+
+def _estimate_prompt_tokens(contents):
+    if isinstance(contents, str):
+        return len(contents) // 4
+    chars = 0
+    for message in contents:
+        for part in message.get("parts", []):
+            # An attached file costs roughly the whole PDF
+            chars += len(part.get("text", '')) if "text" in part else 48000
+    return chars // 4
+
+
+def _prompt_text(contents):
+    """The last user message of a request (the whole prompt for plain-text calls)"""
+    if isinstance(contents, str):
+        return contents
+    for message in reversed(contents):
+        if message.get("role") == "user":
+            return ''.join(part.get("text", '') for part in message.get("parts", []))
+    return ''
+
+
+def request_key(contents, system_instruction=None):
+    """Stable hash of everything sent to the model for one call"""
+    payload = json.dumps([contents, system_instruction], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def message_key(contents):
+    """Hash of the user message alone, used when the rest of the prompt changed"""
+    return hashlib.sha256(_prompt_text(contents).encode('utf-8')).hexdigest()
+
+
+def _usage_counts(response):
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None, None
+    return usage.prompt_token_count, usage.candidates_token_count
+
+
+class TrafficRecorder:
+    """Appends recorded requests and model calls to an NDJSON file
+
+    Every record is written with a single O_APPEND write, so several workers
+    can record into the same file without interleaving lines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        try:
+            os.write(self._fd, line.encode('utf-8'))
+        except OSError as e:
+            logger.warning(f"Could not record model traffic to {self.path}: {str(e)}")
+
+    def request(self, session_id, message, stream=False):
+        """Record an incoming chat message; sessions are stored as hashes"""
+        self.write({
+            "type": "request",
+            "t": round(time.time(), 3),
+            "session": hashlib.sha256(str(session_id).encode('utf-8')).hexdigest()[:16],
+            "message": message,
+            "stream": bool(stream)
+        })
+
+
+class _RecordedStream:
+    """Passes a streamed response through, recording chunk timing once it ends"""
+
+    def __init__(self, response, finish):
+        self._response = response
+        self._finish = finish
+
+    def __iter__(self):
+        chunks = []
+        error = None
+        try:
+            for chunk in self._response:
+                chunks.append((time.perf_counter(), chunk.text or ''))
+                yield chunk
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(chunks, error, self._response)
+
+    async def __aiter__(self):
+        chunks = []
+        error = None
+        try:
+            async for chunk in self._response:
+                chunks.append((time.perf_counter(), chunk.text or ''))
+                yield chunk
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(chunks, error, self._response)
+
+    @property
+    def usage_metadata(self):
+        return getattr(self._response, 'usage_metadata', None)
+
+
+class RecordingBackend:
+    """Wraps a backend and records every generate_content call to a TrafficRecorder"""
+
+    def __init__(self, backend, recorder):
+        self.backend = backend
+        self.recorder = recorder
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def upload_file(self, file_path, mime_type):
+        return self.backend.upload_file(file_path, mime_type)
+
+    def generate_content(self, contents, system_instruction=None, stream=False, timeout=None):
+        started, record = time.perf_counter(), self._record(contents, system_instruction, stream)
+        try:
+            response = self.backend.generate_content(contents, system_instruction, stream=stream, timeout=timeout)
+        except Exception as e:
+            self._write(record, started, error=e)
+            raise
+        return self._recorded(record, started, response, stream)
+
+    async def generate_content_async(self, contents, system_instruction=None, stream=False, timeout=None):
+        started, record = time.perf_counter(), self._record(contents, system_instruction, stream)
+        try:
+            response = await self.backend.generate_content_async(contents, system_instruction, stream=stream,
+                                                                 timeout=timeout)
+        except Exception as e:
+            self._write(record, started, error=e)
+            raise
+        return self._recorded(record, started, response, stream)
+
+    def _record(self, contents, system_instruction, stream):
+        return {
+            "type": "model",
+            "t": round(time.time(), 3),
+            "key": request_key(contents, system_instruction),
+            "message_key": message_key(contents),
+            "prompt_estimate": _estimate_prompt_tokens(contents) + len(system_instruction or '') // 4,
+            "stream": stream
+        }
+
+    def _recorded(self, record, started, response, stream):
+        if not stream:
+            self._write(record, started, text=response.text, response=response)
+            return response
+
+        def finish(chunks, error, response):
+            if isinstance(error, GeneratorExit):
+                # The client went away; keep what was streamed as the answer
+                record["cancelled"] = True
+                error = None
+            offsets = [[round((at - started) * 1000, 1), len(piece)] for at, piece in chunks]
+            self._write(record, started, text=''.join(piece for _, piece in chunks), response=response,
+                        error=error, chunks=offsets, ended=chunks[-1][0] if chunks else None)
+
+        return _RecordedStream(response, finish)
+
+    def _write(self, record, started, text='', response=None, error=None, chunks=None, ended=None):
+        prompt_tokens, response_tokens = _usage_counts(response)
+        record.update({
+            "duration_ms": round(((ended or time.perf_counter()) - started) * 1000, 1),
+            "text": text,
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "error": f"{type(error).__name__}: {str(error)}" if error is not None else None
+        })
+        if chunks is not None:
+            record["chunks"] = chunks
+        self.recorder.write(record)
+
+
+def load_recording(path):
+    """(requests, model calls) from a recorded traffic file, in recorded order"""
+    requests, calls = [], []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A worker killed mid-write leaves a truncated last line
+                logger.warning(f"Skipping unreadable line {number} of {path}")
+                continue
+            if record.get("type") == "request":
+                requests.append(record)
+            elif record.get("type") == "model":
+                calls.append(record)
+    return requests, calls
+
+
+def _replayed_error(description):
+    """Recreate a recorded failure, keeping the exception type so retries behave the same"""
+    name, _, message = description.partition(': ')
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        exceptions = None
+    error_type = getattr(exceptions, name, None) if exceptions is not None else None
+    if isinstance(error_type, type) and issubclass(error_type, Exception):
+        # API errors put their status code in front of the message; don't repeat it
+        code = getattr(error_type, 'code', None)
+        if code is not None and message.startswith(f"{int(code)} "):
+            message = message[len(f"{int(code)} "):]
+        return error_type(message)
+    if name in ('TimeoutError', 'UpstreamTimeout'):
+        return TimeoutError(message)
+    if name == 'ConnectionError':
+        return ConnectionError(message)
+    return RuntimeError(description)
+
+
+class ReplayStream:
+    """Recorded chunks, yielded on their recorded (scaled) schedule"""
+
+    def __init__(self, pieces, usage):
+        self._pieces = pieces
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        started = time.perf_counter()
+        for at, text in self._pieces:
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            yield FakeResponse(text, None)
+
+    async def __aiter__(self):
+        started = time.perf_counter()
+        for at, text in self._pieces:
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield FakeResponse(text, None)
+
+
+class ReplayBackend:
+    """Serves recorded model responses offline, with their original or scaled timing
+
+    Each request key (or user message, on fallback) replays its recordings in
+    the order they were made, so retried failures fail again and then succeed
+    like they did. Lookups are reported to the listener as ('replay', result)
+    with result 'exact', 'message' or 'miss'.
+    """
+    name = 'replay'
+
+    def __init__(self, path, time_scale=1.0, miss='fake', listener=None):
+        self.path = path
+        self.time_scale = max(0.0, time_scale)
+        self.miss = miss
+        self._listener = listener
+        self._lock = threading.Lock()
+        self._by_key = defaultdict(list)
+        self._by_message = defaultdict(list)
+        self._served = defaultdict(int)
+        _, calls = load_recording(path)
+        for call in calls:
+            self._by_key[call["key"]].append(call)
+            self._by_message[call["message_key"]].append(call)
+        self._fallback = FakeBackend.from_env() if miss == 'fake' else None
+        logger.info(f"Replaying {len(calls)} recorded model calls from {path}")
+
+    @classmethod
+    def from_env(cls, listener=None):
+        return cls(
+            os.getenv('MODEL_REPLAY_FILE', 'model_traffic.ndjson'),
+            time_scale=float(os.getenv('MODEL_REPLAY_TIME_SCALE', '1')),
+            miss=os.getenv('MODEL_REPLAY_MISS', 'fake'),
+            listener=listener
+        )
+
+    def _next(self, table, key):
+        recordings = table.get(key)
+        if not recordings:
+            return None
+        with self._lock:
+            served = self._served[key]
+            self._served[key] = served + 1
+        # Past the end, keep serving the last recording (usually the successful one)
+        return recordings[min(served, len(recordings) - 1)]
+
+    def _lookup(self, contents, system_instruction):
+        call = self._next(self._by_key, request_key(contents, system_instruction))
+        if call is not None:
+            return call, 'exact'
+        call = self._next(self._by_message, message_key(contents))
+        if call is not None:
+            return call, 'message'
+        return None, 'miss'
+
+    def generate_content(self, contents, system_instruction=None, stream=False, timeout=None):
+        call, result = self._lookup(contents, system_instruction)
+        if self._listener is not None:
+            self._listener('replay', result)
+        if call is None:
+            if self._fallback is None:
+                raise RuntimeError("No recorded model response for this request")
+            return self._fallback.generate_content(contents, system_instruction, stream=stream, timeout=timeout)
+        delay, error, response = self._respond(call, result, contents, system_instruction, stream, timeout)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    async def generate_content_async(self, contents, system_instruction=None, stream=False, timeout=None):
+        call, result = self._lookup(contents, system_instruction)
+        if self._listener is not None:
+            self._listener('replay', result)
+        if call is None:
+            if self._fallback is None:
+                raise RuntimeError("No recorded model response for this request")
+            return await self._fallback.generate_content_async(contents, system_instruction, stream=stream,
+                                                               timeout=timeout)
+        delay, error, response = self._respond(call, result, contents, system_instruction, stream, timeout)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    def _respond(self, call, result, contents, system_instruction, stream, timeout):
+        """(seconds to wait, error to raise after waiting or None, response) for a recorded call"""
+        prompt_tokens = call.get("prompt_tokens") or 0
+        if result == 'message' and call.get("prompt_estimate"):
+            # Same question, different prompt: scale the recorded count by the change in prompt size
+            estimate = _estimate_prompt_tokens(contents) + len(system_instruction or '') // 4
+            prompt_tokens = round(prompt_tokens * estimate / call["prompt_estimate"])
+        usage = _Usage(prompt_tokens, call.get("response_tokens") or 0)
+
+        duration = call.get("duration_ms", 0) / 1000 * self.time_scale
+        if call.get("chunks"):
+            first = call["chunks"][0][0] / 1000 * self.time_scale
+        else:
+            first = duration
+        if timeout and first > timeout:
+            return timeout, _fake_timeout(timeout), None
+        if call.get("error"):
+            return duration, _replayed_error(call["error"]), None
+
+        text = call.get("text", '')
+        if not stream:
+            return duration, None, FakeResponse(text, usage)
+        pieces, position = [], 0
+        for at, length in call.get("chunks") or [[call.get("duration_ms", 0), len(text)]]:
+            pieces.append((at / 1000 * self.time_scale, text[position:position + length]))
+            position += length
+        return 0, None, ReplayStream(pieces, usage)
+
+    def upload_file(self, file_path, mime_type):
+        # Whole-file mode only needs a handle; the recorded answers don't depend on it
+        return _fake_file_handle(file_path, mime_type)
+
+
+def create_model_backend(backend, model_name, api_key=None, listener=None):
+    """Build the configured model backend"""
+    if backend == 'fake':
+        logger.warning("Using the fake model backend; answers are placeholders")
+        return FakeBackend.from_env()
+    if backend == 'replay':
+        logger.warning("Using the replay model backend; answers come from recorded traffic")
+        return ReplayBackend.from_env(listener)
+    if backend != 'gemini':
+        logger.warning(f"Unknown MODEL_BACKEND '{backend}', using gemini")
+    return GeminiBackend(model_name, api_key)
@@ -0,0 +1,287 @@
+"""
+Bilingual (English/Filipino/Taglish) query normalization.
+
+Students ask the same thing in many ways: "Where is the library?", "saan ang
+library", "nasaan ang aklatan". Everything that matches messages locally (the
+answer cache key, the intent router and BM25 retrieval) goes through
+`normalize()` so those paraphrases meet on the same terms:
+
+- lowercase, fold accents, split into words (hyphenated words are kept whole
+  when the table knows them, like "tvl-ict", else split)
+- multi-word phrases ("senior high school", "report card") become one term
+- a synonym and abbreviation table folds Filipino words, spelling variants and
+  shorthand onto one English term ("aklatan" -> library, "reqs" ->
+  requirement, "humms" -> humss)
+- light stemming: Filipino prefixes with reduplication ("pagpapatala" ->
+  patala) and a few English suffixes ("teachers" -> teacher)
+- stopwords of both languages are dropped from the content terms
+
+A `NormalizedText` carries the words (stopwords kept, for the intent router),
+the content terms (for retrieval), their counts (the term vector) and a
+canonical form (sorted distinct terms: what a message is about, ignoring
+how it is asked; the answer cache builds its own ordered key from `words`). `normalize()` is
+memoized per message and per word, so send_message computes it once and the
+consumers share it.
+
+    python normalization.py "Ano ang mga requirements sa pag-enroll?"
+"""
+import argparse
+import re
+import unicodedata
+from functools import lru_cache
+
+TOKEN_PATTERN = re.compile(r"[0-9a-zñ]+(?:['\-][0-9a-zñ]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be been by can could do does did for from how i in is it its me my of on or our the this
+that these those to was we were what whats when where which who why will with would you your about there their
+please pls tell know want like just any some also then than so if into us them they he she his her
+ang ng sa mga na ay si ni ano anong saan nasaan sino paano bakit kailan ba po ko ako mo ka kayo natin namin
+ito iyan iyon yan yun yung un o para may mayroon meron din rin lang naman sana nga pa kasi ni nina kina
+kami tayo sila niya nila akin amin atin iyo inyo dito diyan doon ay pala daw raw ha eh oh
+paki pakisabi pwede puwede gusto ganito ganun bang nang kung ung
+""".split())
+
+# Filipino words, spelling variants and shorthand mapped to one term (keys are lowercase words)
+SYNONYMS = {
+    # enrollment
+    "enrolment": "enrollment", "enroll": "enrollment", "enrol": "enrollment", "enrolling": "enrollment",
+    "enrolled": "enrollment", "enrollee": "enrollment", "enrollees": "enrollment",
+    "mag-enroll": "enrollment", "magenroll": "enrollment", "pag-enroll": "enrollment", "nag-enroll": "enrollment",
+    "magpapa-enroll": "enrollment", "pagpapatala": "enrollment", "patala": "enrollment",
+    "pagpaparehistro": "enrollment", "rehistro": "enrollment", "registration": "enrollment",
+    "admission": "enrollment", "admissions": "enrollment",
+    # requirements
+    "reqs": "requirement", "req": "requirement", "requirements": "requirement", "requisites": "requirement",
+    "kailangan": "requirement", "kinakailangan": "requirement", "kailangang": "requirement",
+    "dokumento": "document", "documents": "document", "papeles": "document",
+    # places
+    "aklatan": "library", "silid-aklatan": "library", "librarian": "library", "librarians": "library",
+    "paaralan": "school", "eskwelahan": "school", "eskuwelahan": "school", "iskul": "school",
+    "opisina": "office", "tanggapan": "office", "matatagpuan": "where", "makikita": "where",
+    "lokasyon": "location", "located": "location",
+    # people
+    "guro": "teacher", "mga-guro": "teacher", "teachers": "teacher", "faculty": "teacher", "titser": "teacher",
+    "tagapayo": "adviser",
+    "punong-guro": "principal", "prinsipal": "principal",
+    "estudyante": "student", "mag-aaral": "student", "students": "student",
+    # money
+    "bayad": "tuition", "bayarin": "tuition", "matrikula": "tuition", "fees": "tuition", "fee": "tuition",
+    "magkano": "cost", "presyo": "cost", "halaga": "cost", "price": "cost", "much": "cost",
+    "iskolarship": "scholarship", "scholarships": "scholarship", "iskolar": "scholarship",
+    # rules
+    "patakaran": "rule", "tuntunin": "rule", "regulations": "rule", "regulation": "rule", "rules": "rule",
+    "alituntunin": "rule", "bawal": "prohibited", "ipinagbabawal": "prohibited", "pinapayagan": "allow",
+    "uniporme": "uniform", "uniforms": "uniform",
+    # academics
+    "asignatura": "subject", "subjects": "subject", "aralin": "subject", "subjek": "subject",
+    "grading": "grade", "grades": "grade", "marka": "grade", "pagmamarka": "grade", "grado": "grade",
+    "baitang": "grade", "strands": "strand", "tracks": "track", "kurso": "course", "courses": "course",
+    "semestre": "semester", "sem": "semester", "iskedyul": "schedule", "schedules": "schedule",
+    "oras": "hour", "bukas": "open", "sarado": "closed", "sistema": "system",
+    # strands and programs
+    "humms": "humss", "humanities": "humss",
+    "tvl-ict": "tvl ict", "tvl-he": "tvl home-economics", "tvl-ia": "tvl industrial-arts",
+    "senior": "shs", "sh": "shs", "shs": "shs", "jhs": "jhs", "kolehiyo": "college", "unibersidad": "university",
+    # question words, folded onto their English stopwords
+    "saan": "where", "nasaan": "where", "kailan": "when", "sino": "who", "paano": "how",
+}
+
+# Multi-word phrases folded into one term before the words are looked up
+PHRASES = {
+    ("senior", "high", "school"): "shs", ("senior", "high"): "shs", ("junior", "high", "school"): "jhs",
+    ("junior", "high"): "jhs", ("silid", "aklatan"): "library", ("punong", "guro"): "principal",
+    ("tuition", "fee"): "tuition", ("tuition", "fees"): "tuition", ("report", "card"): "report-card",
+    ("home", "economics"): "home-economics", ("industrial", "arts"): "industrial-arts",
+    ("information", "and", "communications", "technology"): "ict",
+    ("humanities", "and", "social", "sciences"): "humss", ("social", "sciences"): "humss",
+    ("accountancy", "business", "and", "management"): "abm",
+    ("science", "technology", "engineering", "and", "mathematics"): "stem",
+    ("guidance", "office"): "guidance", ("guidance", "counselor"): "guidance",
+    ("office", "hours"): "hour", ("mag", "enroll"): "enrollment",
+    ("pag", "enroll"): "enrollment",
+}
+MAX_PHRASE = max(len(phrase) for phrase in PHRASES)
+PHRASE_STARTS = frozenset(phrase[0] for phrase in PHRASES)
+
+# Filipino prefixes, longest first; the root that remains must be at least MIN_ROOT letters
+FILIPINO_PREFIXES = ("pinakama", "nakaka", "makaka", "pinaka", "ipinag", "ipag", "naka", "maka", "paki",
+                     "pag", "mag", "nag", "ika")
+FILIPINO_SUFFIXES = ("han", "hin", "an", "in")
+MIN_ROOT = 4
+# English words that look like they carry a Filipino prefix
+PREFIX_EXCEPTIONS = frozenset("""
+magazine magnet magnetic magnificent magnitude maga page pages pageant nagging ikat
+""".split())
+VOWELS = frozenset('aeiou')
+
+ACCENTS = str.maketrans("áàâäéèêëíìîïóòôöúùûü", "aaaaeeeeiiiioooouuuu")
+# Words memoized by _normalize_word; cleared when full rather than tracked per entry
+WORD_CACHE_SIZE = 50000
+_word_cache = {}
+
+
+class NormalizedText:
+    """A message after normalization
+
+    `words` keeps every normalized word in order (stopwords included),
+    `terms` the content words, `vector` maps each term to its count and
+    `canonical` is the sorted distinct terms joined by spaces. Shared between
+    callers through the memo, so treat it as read-only.
+    """
+    __slots__ = ('text', 'words', 'terms', 'vector', 'canonical')
+
+    def __init__(self, text, words):
+        self.text = text
+        self.words = words
+        self.terms = tuple(word for word in words if word not in STOPWORDS)
+        vector = {}
+        for term in self.terms:
+            vector[term] = vector.get(term, 0) + 1
+        self.vector = vector
+        self.canonical = ' '.join(sorted(vector))
+
+    def __repr__(self):
+        return f"NormalizedText({self.canonical!r})"
+
+    def __add__(self, other):
+        """Both texts as one, e.g. a follow-up with the previous question"""
+        return NormalizedText(f"{self.text} {other.text}", self.words + other.words)
+
+
+def fold(text):
+    """Lowercase with accents removed (ñ is kept)"""
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = text.translate(ACCENTS)
+    if not all(c.isascii() or c == 'ñ' for c in text):
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c) or c == '̃')
+        text = unicodedata.normalize('NFC', text)
+    return text
+
+
+def strip_filipino_affixes(word):
+    """Root of an affixed Filipino word ("pagpapatala" -> "patala"), or the word unchanged"""
+    if word in PREFIX_EXCEPTIONS:
+        return word
+    for prefix in FILIPINO_PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= MIN_ROOT:
+            root = word[len(prefix):]
+            # Reduplicated first syllable: papatala -> patala, babasahin -> basahin
+            if len(root) >= MIN_ROOT + 2 and root[1] in VOWELS and root[:2] == root[2:4]:
+                root = root[2:]
+            for suffix in FILIPINO_SUFFIXES:
+                if root.endswith(suffix) and len(root) - len(suffix) >= MIN_ROOT:
+                    return root[:-len(suffix)]
+            return root
+    return word
+
+
+def stem_english(word):
+    """Plural and -ing/-ed endings removed, conservatively"""
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    if word.endswith('ing') and len(word) > 5:
+        stem = word[:-3]
+        return stem[:-1] if len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in 'ls' else stem
+    if word.endswith('ed') and len(word) > 4 and not word.endswith('eed'):
+        return word[:-2]
+    return word
+
+
+def _normalize_word(word):
+    """Terms for one word (a tuple, usually of one)"""
+    cached = _word_cache.get(word)
+    if cached is not None:
+        return cached
+    mapped = SYNONYMS.get(word)
+    if mapped is None and word in STOPWORDS:
+        # "does" stays a stopword instead of becoming the content term "doe"
+        mapped = word
+    if mapped is None:
+        if '-' in word:
+            terms = tuple(term for part in word.split('-') if part for term in _normalize_word(part))
+        else:
+            root = strip_filipino_affixes(word)
+            mapped = SYNONYMS.get(root)
+            if mapped is None:
+                stem = stem_english(root)
+                mapped = SYNONYMS.get(stem, stem)
+            terms = tuple(mapped.split())
+    else:
+        terms = tuple(mapped.split())
+    if len(_word_cache) >= WORD_CACHE_SIZE:
+        _word_cache.clear()
+    _word_cache[word] = terms
+    return terms
+
+
+def tokenize(text):
+    """Folded words of text, apostrophes dropped ("what's" -> "whats")"""
+    return [word.replace("'", '') for word in TOKEN_PATTERN.findall(fold(text))]
+
+
+def normalize_words(text):
+    """Normalized words of text in order, stopwords included"""
+    raw = tokenize(text)
+    words = []
+    i, n = 0, len(raw)
+    while i < n:
+        word = raw[i]
+        if word in PHRASE_STARTS:
+            for size in range(min(MAX_PHRASE, n - i), 1, -1):
+                phrase = PHRASES.get(tuple(raw[i:i + size]))
+                if phrase is not None:
+                    words.append(phrase)
+                    i += size
+                    break
+            else:
+                words.extend(_normalize_word(word))
+                i += 1
+            continue
+        words.extend(_normalize_word(word))
+        i += 1
+    return tuple(words)
+
+
+def normalize_uncached(text):
+    return NormalizedText(text, normalize_words(text))
+
+
+@lru_cache(maxsize=4096)
+def _normalize_cached(text):
+    return normalize_uncached(text)
+
+
+def normalize(text):
+    """NormalizedText for a message (memoized); a NormalizedText is returned as is"""
+    if isinstance(text, NormalizedText):
+        return text
+    return _normalize_cached(text)
+
+
+def terms(text):
+    """Content terms of text, for indexing documents (not memoized per text)"""
+    if isinstance(text, NormalizedText):
+        return text.terms
+    return normalize_uncached(text).terms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show how messages are normalized")
+    parser.add_argument('messages', nargs='+', help="Messages to normalize")
+    args = parser.parse_args()
+    for message in args.messages:
+        normalized = normalize(message)
+        print(f"{message!r}\n  words:     {' '.join(normalized.words)}\n  canonical: {normalized.canonical}")
+
+
+if __name__ == '__main__':
+    main()
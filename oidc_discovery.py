@@ -0,0 +1,72 @@
+"""
+Disk cache for the OpenID Connect discovery document.
+
+Authlib fetches https://accounts.google.com/.well-known/openid-configuration
+the first time each process starts a login, so every serverless cold start
+paid a round trip to Google before redirecting. The document changes very
+rarely: `load_metadata` keeps it in DATA_DIR for `ttl` seconds, shares it
+between workers, and falls back to the stale copy if Google can't be reached.
+"""
+import json
+import logging
+import os
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 3600
+FETCH_TIMEOUT = 5
+
+
+def fetch_metadata(url, timeout=FETCH_TIMEOUT):
+    """Download a discovery document"""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def read_cache(cache_path, url):
+    """(metadata, fetched_at) from the cache file, or None if it is missing or for another URL"""
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("url") != url or not isinstance(cached.get("metadata"), dict):
+        return None
+    return cached["metadata"], cached.get("fetched_at", 0)
+
+
+def write_cache(cache_path, url, metadata):
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"url": url, "fetched_at": time.time(), "metadata": metadata}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def load_metadata(url, cache_path, ttl=DEFAULT_TTL, fetch=fetch_metadata):
+    """Discovery document for url, read from the cache while it is younger than ttl
+
+    Returns None if it can neither be read from the cache nor fetched; the
+    OAuth client then fetches it itself on first use.
+    """
+    cached = read_cache(cache_path, url)
+    if cached is not None and time.time() - cached[1] < ttl:
+        return cached[0]
+
+    try:
+        metadata = fetch(url)
+    except (OSError, ValueError) as e:
+        if cached is not None:
+            logger.warning(f"Could not refresh {url} ({str(e)}), using the cached copy from "
+                           f"{round((time.time() - cached[1]) / 3600, 1)}h ago")
+            return cached[0]
+        logger.warning(f"Could not fetch {url}: {str(e)}")
+        return None
+
+    try:
+        write_cache(cache_path, url, metadata)
+    except OSError as e:
+        logger.warning(f"Could not cache {url}: {str(e)}")
+    return metadata
@@ -0,0 +1,232 @@
+"""
+Background prefetch of suggested follow-up answers.
+
+Replies carry a few suggested follow-up questions (follow_ups.py). The top
+ones are answered on a small background pool and stored in the answer cache,
+so clicking a suggestion returns the cached answer instead of waiting for a
+cold model call. Prefetching only uses spare capacity: the app's answer
+function skips questions that are already cached or answered from the
+knowledge tables, and gives up when no generation slot is idle.
+
+A prefetched answer nobody clicks is wasted quota. A ledger records the
+tokens each prefetch cost; the first click on a prefetched answer within the
+use window claims its entry (a hit), and entries still unclaimed after the
+window are swept out as waste. Like the answer cache, the ledger is either
+in-process or a SQLite table shared by every worker on the machine, so a
+prefetch made by one worker and clicked on another still counts as a hit.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from answer_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 2
+# Questions waiting for the pool beyond this are dropped; they would be stale by the time they run
+DEFAULT_MAX_PENDING = 32
+# A prefetch clicked within this many seconds is a hit, after that it is waste
+DEFAULT_USE_WINDOW = 1800
+# How often (seconds) unclaimed prefetches are swept out as waste
+SWEEP_INTERVAL = 60
+
+
+class MemoryPrefetchLedger:
+    """Tokens spent per prefetched answer, in process"""
+    backend = 'memory'
+
+    def __init__(self, window=DEFAULT_USE_WINDOW):
+        self.window = window
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, tokens):
+        with self._lock:
+            self._entries[key] = (tokens, time.time())
+
+    def claim(self, key):
+        """Tokens of the prefetch behind key, or None when it was not prefetched (or already claimed)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time() - self.window:
+                # Too late: left for expire() to count as waste
+                return None
+            del self._entries[key]
+        return entry[0]
+
+    def expire(self):
+        """Remove prefetches left unclaimed for the whole window; returns their token counts"""
+        cutoff = time.time() - self.window
+        with self._lock:
+            expired = [key for key, (_, created_at) in self._entries.items() if created_at <= cutoff]
+            return [self._entries.pop(key)[0] for key in expired]
+
+    def pending(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLitePrefetchLedger:
+    """Tokens spent per prefetched answer, shared by workers through SQLite"""
+    backend = 'sqlite'
+
+    def __init__(self, db_path, window=DEFAULT_USE_WINDOW):
+        self.db_path = db_path
+        self.window = window
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prefetches ("
+                " key TEXT PRIMARY KEY, tokens INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS prefetches_created_at ON prefetches (created_at)")
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def record(self, key, tokens):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO prefetches VALUES (?, ?, ?)", (key, tokens, time.time()))
+
+    def claim(self, key):
+        # Deleting the row is what claims it, so two workers can't both count the same hit
+        with self._connect() as conn:
+            row = conn.execute("DELETE FROM prefetches WHERE key = ? AND created_at > ? RETURNING tokens",
+                               (key, time.time() - self.window)).fetchone()
+        return row[0] if row else None
+
+    def expire(self):
+        with self._connect() as conn:
+            rows = conn.execute("DELETE FROM prefetches WHERE created_at <= ? RETURNING tokens",
+                                (time.time() - self.window,)).fetchall()
+        return [row[0] for row in rows]
+
+    def pending(self):
+        return self._connect().execute("SELECT COUNT(*) FROM prefetches").fetchone()[0]
+
+
+class Prefetcher:
+    """Answers suggested questions on a small background pool, each question at most once at a time
+
+    answer(question) runs on the pool and returns (result, key, tokens):
+    'generated' with the answer cache key and the tokens spent when it called
+    the model, or the reason it didn't ('cached', 'local', 'busy', ...).
+    listener(kind, value, amount=1) is told about every 'prefetch' result, and
+    about tokens 'spent', 'used' or 'wasted' as kind 'prefetch_tokens'.
+    """
+
+    def __init__(self, answer, ledger, threads=DEFAULT_THREADS, max_pending=DEFAULT_MAX_PENDING, listener=None):
+        self.answer = answer
+        self.ledger = ledger
+        self.max_pending = max_pending
+        self.listener = listener or (lambda kind, value, amount=1: None)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='prefetch')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.results = {}
+        self.used = 0
+        self.wasted = 0
+
+    def submit(self, question):
+        """Queue a question for prefetching; returns False when it is already queued or the pool is full"""
+        canonical = normalize_question(question)
+        with self._lock:
+            refused = 'duplicate' if canonical in self._pending else (
+                'dropped' if len(self._pending) >= self.max_pending else None)
+            if refused is None:
+                self._pending.add(canonical)
+            sweep = time.monotonic() - self._last_sweep >= SWEEP_INTERVAL
+            if sweep:
+                self._last_sweep = time.monotonic()
+        if sweep:
+            self._pool.submit(self._sweep)
+        if refused is not None:
+            self._count(refused)
+            return False
+        self._pool.submit(self._run, canonical, question)
+        return True
+
+    def claim(self, key):
+        """Note a click served from the answer cache; True when the answer was prefetched"""
+        try:
+            tokens = self.ledger.claim(key)
+        except sqlite3.Error as e:
+            logger.warning(f"Prefetch ledger unavailable: {str(e)}")
+            return False
+        if tokens is None:
+            return False
+        with self._lock:
+            self.used += 1
+        self.listener('prefetch_tokens', 'used', tokens)
+        return True
+
+    def stats(self):
+        try:
+            pending = self.ledger.pending()
+        except sqlite3.Error:
+            pending = None
+        resolved = self.used + self.wasted
+        return {
+            "backend": self.ledger.backend,
+            "results": dict(self.results),
+            "queued": len(self._pending),
+            "unclaimed": pending,
+            "used": self.used,
+            "wasted": self.wasted,
+            "hit_rate": round(self.used / resolved, 4) if resolved else 0.0
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, canonical, question):
+        try:
+            result, key, tokens = self.answer(question)
+            if result == 'generated':
+                self.ledger.record(key, tokens)
+                self.listener('prefetch_tokens', 'spent', tokens)
+            self._count(result)
+        except Exception as e:
+            logger.warning(f"Prefetch of a suggested question failed: {str(e)}")
+            self._count('failed')
+        finally:
+            with self._lock:
+                self._pending.discard(canonical)
+
+    def _count(self, result):
+        with self._lock:
+            self.results[result] = self.results.get(result, 0) + 1
+        self.listener('prefetch', result)
+
+    def _sweep(self):
+        try:
+            expired = self.ledger.expire()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not sweep the prefetch ledger: {str(e)}")
+            return
+        if expired:
+            with self._lock:
+                self.wasted += len(expired)
+            self.listener('prefetch_tokens', 'wasted', sum(expired))
+
+
+def create_prefetch_ledger(backend, data_dir, window=DEFAULT_USE_WINDOW):
+    """Ledger next to the answer cache: 'sqlite' (shared by workers) or 'memory'"""
+    if backend == 'sqlite':
+        try:
+            return SQLitePrefetchLedger(os.path.join(data_dir, 'prefetch.sqlite3'), window)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not open prefetch ledger in {data_dir} ({str(e)}), tracking per process")
+    return MemoryPrefetchLedger(window)
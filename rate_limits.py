@@ -0,0 +1,299 @@
+"""
+Per-user token-bucket rate limits on requests and model tokens.
+
+Every identity (a logged-in user's email, or the session for anonymous
+visitors) has up to four buckets: requests per minute and per day, and model
+tokens per minute and per day. A bucket holds at most its limit and refills
+continuously at limit / window, so a user can burst up to the limit and then
+continues at the average rate.
+
+Requests are paid for up front: a message is refused while any request bucket
+is empty. Tokens are only known once the model answers, so they are charged
+afterwards and a bucket may go into debt; the next message is refused until
+the debt has been refilled. Refusals carry the seconds until the next message
+would be accepted.
+
+Two backends share the same interface: an in-process one, and a SQLite table
+(in DATA_DIR) whose transactions make the limits hold across all workers on
+the machine. Both also count requests, tokens and refusals per identity and
+day for the admin view of top consumers.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+DAY = 24 * 3600
+# Token debt is capped at one full bucket, so a single huge answer can't lock a user out for days
+MAX_DEBT_BUCKETS = 1.0
+# Days of per-identity usage kept for the admin view
+USAGE_RETENTION_DAYS = 7
+# Prune idle buckets and old usage every this many operations
+PRUNE_EVERY = 1000
+
+
+class RateLimited(Exception):
+    """An identity has used up one of its budgets"""
+
+    def __init__(self, bucket, retry_after):
+        super().__init__(f"Rate limit {bucket} exceeded, retry in {retry_after}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+class Limits:
+    """Budgets per identity; 0 disables a limit"""
+    __slots__ = ('buckets',)
+
+    def __init__(self, requests_per_minute=0, requests_per_day=0, tokens_per_minute=0, tokens_per_day=0):
+        self.buckets = {
+            name: (limit, window)
+            for name, limit, window in (
+                ('requests_minute', requests_per_minute, MINUTE),
+                ('requests_day', requests_per_day, DAY),
+                ('tokens_minute', tokens_per_minute, MINUTE),
+                ('tokens_day', tokens_per_day, DAY),
+            )
+            if limit > 0
+        }
+
+    def to_dict(self):
+        return {name: limit for name, (limit, _) in self.buckets.items()}
+
+
+def usage_day(now):
+    return time.strftime('%Y-%m-%d', time.localtime(now))
+
+
+class _RateLimiter:
+    """Bucket arithmetic shared by both backends
+
+    Backends provide _transaction() (exclusive access for one identity
+    update), _load, _store, _count_usage, top_consumers and _prune.
+    """
+    backend = None
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._operations = 0
+
+    def take(self, identity):
+        """Admit one request for identity or raise RateLimited; returns the remaining budgets"""
+        now = time.time()
+        with self._transaction() as tx:
+            levels = self._refilled(self._load(tx, identity), now)
+            refused = []
+            for name, level in levels.items():
+                limit, window = self.limits.buckets[name]
+                needed = 1.0 if name.startswith('requests') else 1e-9
+                if level < needed:
+                    refused.append((name, (needed - level) * window / limit))
+            if refused:
+                self._count_usage(tx, identity, now, requests=0, tokens=0, limited=1)
+            else:
+                for name in levels:
+                    if name.startswith('requests'):
+                        levels[name] -= 1.0
+                self._store(tx, identity, levels, now)
+                self._count_usage(tx, identity, now, requests=1, tokens=0, limited=0)
+        self._maybe_prune(now)
+        if refused:
+            bucket, wait = max(refused, key=lambda item: item[1])
+            raise RateLimited(bucket, max(1, math.ceil(wait)))
+        return {name: int(level) for name, level in levels.items()}
+
+    def charge(self, identity, tokens):
+        """Charge model tokens used by an admitted request"""
+        if tokens <= 0:
+            return
+        now = time.time()
+        with self._transaction() as tx:
+            levels = self._refilled(self._load(tx, identity), now)
+            for name in levels:
+                if name.startswith('tokens'):
+                    limit = self.limits.buckets[name][0]
+                    levels[name] = max(-limit * MAX_DEBT_BUCKETS, levels[name] - tokens)
+            self._store(tx, identity, levels, now)
+            self._count_usage(tx, identity, now, requests=0, tokens=tokens, limited=0)
+
+    def remaining(self, identity):
+        """Current level of each of identity's buckets"""
+        with self._transaction() as tx:
+            levels = self._refilled(self._load(tx, identity), time.time())
+        return {name: int(level) for name, level in levels.items()}
+
+    def _refilled(self, stored, now):
+        levels = {}
+        for name, (limit, window) in self.limits.buckets.items():
+            if name not in stored:
+                levels[name] = float(limit)
+                continue
+            level, updated_at = stored[name]
+            levels[name] = min(float(limit), level + max(0.0, now - updated_at) * limit / window)
+        return levels
+
+    def _maybe_prune(self, now):
+        self._operations += 1
+        if self._operations % PRUNE_EVERY == 0:
+            try:
+                self._prune(now)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not prune rate limit state: {str(e)}")
+
+    def stats(self):
+        return {"backend": self.backend, "limits": self.limits.to_dict()}
+
+
+class MemoryRateLimiter(_RateLimiter):
+    """Buckets in this process only"""
+    backend = 'memory'
+
+    def __init__(self, limits):
+        super().__init__(limits)
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._usage = {}
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            yield None
+
+    def _load(self, tx, identity):
+        return self._buckets.get(identity, {})
+
+    def _store(self, tx, identity, levels, now):
+        self._buckets[identity] = {name: (level, now) for name, level in levels.items()}
+
+    def _count_usage(self, tx, identity, now, requests, tokens, limited):
+        key = (identity, usage_day(now))
+        usage = self._usage.setdefault(key, [0, 0, 0, now])
+        usage[0] += requests
+        usage[1] += tokens
+        usage[2] += limited
+        usage[3] = now
+
+    def top_consumers(self, limit=20, day=None):
+        day = day or usage_day(time.time())
+        with self._lock:
+            rows = [(identity, *usage) for (identity, key_day), usage in self._usage.items() if key_day == day]
+        rows.sort(key=lambda row: (-row[2], -row[1]))
+        return [_usage_row(row) for row in rows[:limit]]
+
+    def stats(self):
+        return dict(super().stats(), identities=len(self._buckets))
+
+    def _prune(self, now):
+        with self._lock:
+            # Buckets untouched for a day are full again; dropping them changes nothing
+            for identity in [i for i, b in self._buckets.items() if all(now - t >= DAY for _, t in b.values())]:
+                del self._buckets[identity]
+            oldest = usage_day(now - USAGE_RETENTION_DAYS * DAY)
+            for key in [key for key in self._usage if key[1] < oldest]:
+                del self._usage[key]
+
+
+class SQLiteRateLimiter(_RateLimiter):
+    """Buckets shared by workers through SQLite; each update is one IMMEDIATE transaction"""
+    backend = 'sqlite'
+
+    def __init__(self, db_path, limits):
+        super().__init__(limits)
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " identity TEXT NOT NULL, bucket TEXT NOT NULL, level REAL NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (identity, bucket))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " identity TEXT NOT NULL, day TEXT NOT NULL, requests INTEGER NOT NULL, tokens INTEGER NOT NULL,"
+            " limited INTEGER NOT NULL, last_seen REAL NOT NULL, PRIMARY KEY (identity, day))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS usage_day_tokens ON usage (day, tokens)")
+
+    def _connect(self):
+        # One connection per thread, in autocommit mode so transactions are explicit
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        # Take the write lock up front so two workers can't both spend the last token
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _load(self, conn, identity):
+        rows = conn.execute("SELECT bucket, level, updated_at FROM buckets WHERE identity = ?", (identity,))
+        return {bucket: (level, updated_at) for bucket, level, updated_at in rows}
+
+    def _store(self, conn, identity, levels, now):
+        conn.executemany(
+            "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)",
+            [(identity, name, level, now) for name, level in levels.items()]
+        )
+
+    def _count_usage(self, conn, identity, now, requests, tokens, limited):
+        conn.execute(
+            "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (identity, day) DO UPDATE SET"
+            " requests = requests + excluded.requests, tokens = tokens + excluded.tokens,"
+            " limited = limited + excluded.limited, last_seen = excluded.last_seen",
+            (identity, usage_day(now), requests, tokens, limited, now)
+        )
+
+    def top_consumers(self, limit=20, day=None):
+        day = day or usage_day(time.time())
+        rows = self._connect().execute(
+            "SELECT identity, requests, tokens, limited, last_seen FROM usage WHERE day = ?"
+            " ORDER BY tokens DESC, requests DESC LIMIT ?", (day, limit)
+        ).fetchall()
+        return [_usage_row(row) for row in rows]
+
+    def _prune(self, now):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - DAY,))
+            conn.execute("DELETE FROM usage WHERE day < ?", (usage_day(now - USAGE_RETENTION_DAYS * DAY),))
+
+    def stats(self):
+        identities = self._connect().execute("SELECT COUNT(DISTINCT identity) FROM buckets").fetchone()[0]
+        return dict(super().stats(), identities=identities)
+
+
+def _usage_row(row):
+    identity, requests, tokens, limited, last_seen = row
+    return {"identity": identity, "requests": requests, "tokens": tokens, "limited": limited,
+            "last_seen": round(last_seen, 1)}
+
+
+def create_rate_limiter(backend, data_dir, limits):
+    """Build the configured rate limiter ('sqlite', 'memory' or 'off'), or None when off"""
+    if backend in ('off', 'none', '') or not limits.buckets:
+        return None
+    if backend == 'sqlite':
+        try:
+            return SQLiteRateLimiter(os.path.join(data_dir, 'rate_limits.sqlite3'), limits)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not open rate limit store in {data_dir} ({str(e)}), limiting per process")
+            return MemoryRateLimiter(limits)
+    if backend != 'memory':
+        logger.warning(f"Unknown RATE_LIMITS backend '{backend}', using memory")
+    return MemoryRateLimiter(limits)
@@ -0,0 +1,344 @@
+"""
+Deadlines, retries, hedging and a circuit breaker around model calls.
+
+`ResilientModel` wraps a model backend:
+
+- every attempt gets a deadline, passed to the backend as a request timeout
+- retryable failures (429, 5xx, timeouts, dropped connections) are retried
+  with full-jitter exponential backoff
+- optionally, a second "hedged" request is sent when the first has not
+  answered after the recent p95 latency, and the faster answer wins
+- a circuit breaker stops upstream traffic after repeated failures and lets a
+  single probe through once the reset timeout has passed
+
+Events (retries, hedges, breaker transitions) are reported to an optional
+listener so the app can export them as metrics.
+
+`generate_content_async` applies the same deadlines, retries and breaker on
+an event loop, for the async chat endpoint. It doesn't hedge.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+# Numeric breaker states for the gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Successful latencies kept for the hedge delay, and how many are needed first
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+
+class CircuitOpen(Exception):
+    """Upstream calls are suspended while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Circuit breaker open, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class UpstreamTimeout(Exception):
+    """A model call ran past its deadline"""
+
+
+def is_retryable(error):
+    """True for failures worth retrying: rate limits, server errors, timeouts and dropped connections"""
+    if isinstance(error, (UpstreamTimeout, TimeoutError, ConnectionError)):
+        return True
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (exceptions.TooManyRequests, exceptions.ServerError, exceptions.DeadlineExceeded))
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; one probe is let through after `reset_timeout`"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, listener=None):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._listener = listener
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def check(self):
+        """Raise CircuitOpen if a call would be refused right now (does not take the probe)"""
+        with self._lock:
+            if self._current_state() == OPEN or (self._state == HALF_OPEN and self._probing):
+                raise CircuitOpen(self._retry_after())
+
+    def allow(self):
+        """Admit a call, or raise CircuitOpen; in half-open state only one probe is admitted"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probing:
+                if self._state != HALF_OPEN:
+                    self._transition(HALF_OPEN)
+                self._probing = True
+                return
+            raise CircuitOpen(self._retry_after())
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != CLOSED:
+                self._transition(CLOSED)
+
+    def release(self):
+        """End a call that says nothing about upstream health (a bad request): frees the probe, keeps the state"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self._transition(OPEN)
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def _retry_after(self):
+        if self._state != OPEN:
+            return 1
+        return max(1, round(self.reset_timeout - (time.monotonic() - self._opened_at)))
+
+    def _transition(self, state):
+        logger.warning(f"Circuit breaker {self._state} -> {state}")
+        self._state = state
+        if self._listener is not None:
+            self._listener('breaker', state)
+
+
+class PrefetchedStream:
+    """A streamed response whose first chunk was already received (inside the retry loop)"""
+
+    def __init__(self, response, iterator, first):
+        self._response = response
+        self._iterator = iterator
+        self._first = first
+
+    def __iter__(self):
+        if self._first is not None:
+            yield self._first
+        yield from self._iterator
+
+    @property
+    def usage_metadata(self):
+        return getattr(self._response, 'usage_metadata', None)
+
+
+class AsyncPrefetchedStream:
+    """Async counterpart of PrefetchedStream, iterated with `async for`"""
+
+    def __init__(self, response, iterator, first):
+        self._response = response
+        self._iterator = iterator
+        self._first = first
+
+    async def __aiter__(self):
+        if self._first is not None:
+            yield self._first
+        async for chunk in self._iterator:
+            yield chunk
+
+    @property
+    def usage_metadata(self):
+        return getattr(self._response, 'usage_metadata', None)
+
+
+async def _iterate_in_thread(iterable):
+    """Iterate a blocking stream without blocking the event loop"""
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+class ResilientModel:
+    """Model backend wrapper with deadlines, jittered retries, hedging and a circuit breaker"""
+
+    def __init__(self, backend, timeout=30.0, retries=2, backoff_base=0.25, backoff_max=4.0,
+                 hedge=False, hedge_min_delay=0.5, breaker=None, listener=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker(listener=listener)
+        self._listener = listener
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._latency_lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='hedge') if hedge else None
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def upload_file(self, file_path, mime_type):
+        return self.backend.upload_file(file_path, mime_type)
+
+    def generate_content(self, contents, system_instruction=None, stream=False):
+        """Call the backend, retrying retryable failures until attempts or the breaker run out"""
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            started = time.perf_counter()
+            try:
+                if stream:
+                    response = self._stream(contents, system_instruction)
+                elif self.hedge:
+                    response = self._hedged(contents, system_instruction)
+                else:
+                    response = self._call(contents, system_instruction, self.timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    # A bad request is neither an outage nor a sign of recovery
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                self._emit('retry', type(e).__name__)
+                logger.warning(f"Model call failed ({type(e).__name__}: {str(e)}), "
+                               f"retry {attempt}/{self.retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            if not stream:
+                with self._latency_lock:
+                    self._latencies.append(time.perf_counter() - started)
+            return response
+
+    async def generate_content_async(self, contents, system_instruction=None, stream=False):
+        """Await the backend, with the same deadline, retries and breaker as generate_content"""
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            started = time.perf_counter()
+            try:
+                if stream:
+                    call = self._stream_async(contents, system_instruction)
+                else:
+                    call = self._call_async(contents, system_instruction, self.timeout)
+                try:
+                    response = await asyncio.wait_for(call, self.timeout)
+                except asyncio.TimeoutError:
+                    raise UpstreamTimeout(f"No answer within {self.timeout:.0f}s")
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                self._emit('retry', type(e).__name__)
+                logger.warning(f"Model call failed ({type(e).__name__}: {str(e)}), "
+                               f"retry {attempt}/{self.retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            if not stream:
+                with self._latency_lock:
+                    self._latencies.append(time.perf_counter() - started)
+            return response
+
+    def hedge_delay(self):
+        """p95 of recent successful call latency, or None until enough calls were seen"""
+        with self._latency_lock:
+            if len(self._latencies) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95) - 1])
+
+    def _call(self, contents, system_instruction, timeout, stream=False):
+        return self.backend.generate_content(contents, system_instruction, stream=stream, timeout=timeout)
+
+    def _stream(self, contents, system_instruction):
+        # Failures usually surface with the first chunk; fetch it here so they can still be retried
+        response = self._call(contents, system_instruction, self.timeout, stream=True)
+        iterator = iter(response)
+        first = next(iterator, None)
+        return PrefetchedStream(response, iterator, first)
+
+    async def _call_async(self, contents, system_instruction, timeout, stream=False):
+        generate = getattr(self.backend, 'generate_content_async', None)
+        if generate is None:
+            response = await asyncio.to_thread(self.backend.generate_content, contents, system_instruction,
+                                               stream=stream, timeout=timeout)
+            return AsyncPrefetchedStream(response, _iterate_in_thread(response), None) if stream else response
+        return await generate(contents, system_instruction, stream=stream, timeout=timeout)
+
+    async def _stream_async(self, contents, system_instruction):
+        response = await self._call_async(contents, system_instruction, self.timeout, stream=True)
+        iterator = response.__aiter__()
+        first = await anext(iterator, None)
+        return AsyncPrefetchedStream(response, iterator, first)
+
+    def _hedged(self, contents, system_instruction):
+        delay = self.hedge_delay()
+        if delay is None or delay >= self.timeout:
+            return self._call(contents, system_instruction, self.timeout)
+
+        deadline = time.perf_counter() + self.timeout
+        pending = {self._hedge_pool.submit(self._call, contents, system_instruction, self.timeout)}
+        done, pending = wait(pending, timeout=delay)
+        if done:
+            return done.pop().result()
+
+        hedge = self._hedge_pool.submit(self._call, contents, system_instruction, self.timeout - delay)
+        pending.add(hedge)
+        self._emit('hedge', 'launched')
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.perf_counter()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._emit('hedge', 'won')
+                    return future.result()
+                error = future.exception()
+        raise error or UpstreamTimeout(f"No answer within {self.timeout:.0f}s")
+
+    def _emit(self, kind, value):
+        if self._listener is not None:
+            self._listener(kind, value)
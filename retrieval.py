@@ -0,0 +1,141 @@
+"""
+Local passage retrieval: PDF extraction, chunking and BM25 scoring.
+
+Documents are extracted and chunked once (offline) into overlapping passages
+and searched with a BM25 inverted index. At request time only the top-k
+passages for the current question are put into the Gemini prompt instead of
+attaching the whole document. knowledge_base.py keeps the passages of every
+knowledge document and builds the index from them; index and query it with:
+
+    python knowledge_base.py --query "What are the enrollment requirements?"
+"""
+import hashlib
+import heapq
+import math
+import re
+from collections import Counter
+
+from normalization import normalize, terms as index_terms
+
+# Passage size and overlap in words
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[0-9a-zà-öø-ÿñ]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it me my of on or the
+this to what when where which who why will with you your about there their
+ang ng sa mga na ay si ni ano saan sino paano bakit kailan ba po ko ako mo ka
+kayo natin namin ito iyan iyon at o para may mayroon din rin lang
+""".split())
+
+
+def tokenize(text):
+    """Lowercase and split text into words, dropping stopwords (BM25 terms come from normalization.py)"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def file_sha256(path):
+    """Content hash of a file: detects changed documents and keys their uploads"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pdf_pages(pdf_path):
+    """Extract cleaned text for each page of the PDF"""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_path)
+    pages = []
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        # The school PDF puts every word on its own line; fold it back into prose
+        text = re.sub(r'\s+', ' ', text).strip()
+        pages.append(text)
+    return pages
+
+
+def chunk_pages(pages, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Split page texts into overlapping word windows that keep their page number"""
+    words = []
+    for page_no, text in enumerate(pages, start=1):
+        words.extend((word, page_no) for word in text.split())
+
+    passages = []
+    step = max(1, chunk_words - overlap)
+    for start in range(0, len(words), step):
+        window = words[start:start + chunk_words]
+        if not window:
+            break
+        passages.append({
+            "page": window[0][1],
+            "text": ' '.join(word for word, _ in window)
+        })
+        if start + chunk_words >= len(words):
+            break
+    return passages
+
+
+class BM25Index:
+    """Inverted index over passages with BM25 scoring"""
+
+    def __init__(self, passages, postings, doc_lengths, source=None):
+        self.passages = passages
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.source = source or {}
+        self.avg_doc_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+        n_docs = len(doc_lengths)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in postings.items()
+        }
+
+    @classmethod
+    def build(cls, passages, source=None):
+        """Build an index from a list of passage dicts"""
+        postings = {}
+        doc_lengths = []
+        for doc_id, passage in enumerate(passages):
+            terms = index_terms(passage["text"])
+            doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).append([doc_id, tf])
+        return cls(passages, postings, doc_lengths, source)
+
+    def search(self, query, k=4):
+        """Return the top-k (score, passage) pairs for a query (text or NormalizedText)"""
+        scores = {}
+        for term in normalize(query).vector:
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in plist:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_doc_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self.passages[doc_id]) for doc_id, score in best]
+
+
+def format_passages(results, show_document=False):
+    """Render retrieved passages as a prompt block"""
+    return '\n\n'.join(
+        f"[{n}] ({passage_source(passage, show_document)}) {passage['text']}"
+        for n, (_, passage) in enumerate(results, start=1)
+    )
+
+
+def passage_source(passage, show_document=False):
+    """Where a passage comes from: "page 3", or "fees.pdf, page 3" across several documents"""
+    if show_document and passage.get("doc"):
+        return f"{passage['doc']}, page {passage['page']}"
+    return f"page {passage['page']}"
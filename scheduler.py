@@ -0,0 +1,211 @@
+"""
+Bounded scheduler for model calls.
+
+At most `max_concurrent` generations run at once per process. Further requests
+wait in a queue of at most `max_queue` entries for up to `queue_timeout`
+seconds. A request that finds the queue full is rejected immediately with 429,
+and one whose wait runs past the deadline is rejected with 503. Both carry a
+Retry-After estimate based on the recent generation time. That way a burst of
+students gets a fast "try again" instead of piling onto the API rate limit and
+failing with 500s.
+
+The queue is weighted-fair across flows (one flow per user): each waiter gets
+a virtual finish time of max(now, its flow's last finish) + 1 / weight, and
+the earliest finish goes next. A user with ten queued requests therefore
+takes turns with a user who has one, instead of holding the head of a FIFO,
+and no flow may hold more than `max_queue_per_flow` places in the queue.
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Weight of the latest call in the moving average of generation time
+SERVICE_TIME_ALPHA = 0.2
+
+
+def parse_weights(spec):
+    """Parse fair-queue weights like 'user:1,anonymous:0.5,batch:0.25'"""
+    weights = {}
+    for item in (spec or '').split(','):
+        if item.strip():
+            name, _, value = item.partition(':')
+            weights[name.strip()] = float(value)
+    return weights
+
+
+class Overloaded(Exception):
+    """No generation slot could be given to a request"""
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(f"Generation scheduler overloaded ({reason})")
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('flow', 'start', 'finish', 'cancelled')
+
+    def __init__(self, flow, start, finish):
+        self.flow = flow
+        self.start = start
+        self.finish = finish
+        self.cancelled = False
+
+
+class Slot:
+    """A held generation slot; release() is idempotent"""
+    __slots__ = ('_scheduler', '_started', 'wait_ms')
+
+    def __init__(self, scheduler, wait_ms):
+        self._scheduler = scheduler
+        self._started = time.perf_counter()
+        self.wait_ms = wait_ms
+
+    def release(self):
+        scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler._release(time.perf_counter() - self._started)
+
+
+class GenerationScheduler:
+    """Concurrency limit with a bounded, deadline-aware, weighted-fair wait queue"""
+
+    def __init__(self, max_concurrent=8, max_queue=32, queue_timeout=10.0, max_queue_per_flow=0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.max_queue_per_flow = max(0, max_queue_per_flow)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._queued = 0
+        self._flow_queued = Counter()
+        self._flow_finish = {}
+        self._virtual_time = 0.0
+        self._active = 0
+        self._service_time = None
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "flow_queue_full": 0, "queue_timeout": 0}
+
+    def acquire(self, timeout=None, flow=None, weight=1.0):
+        """Wait for a slot, raising Overloaded when the queue is full or the wait times out
+
+        Waiters of different flows are admitted in weighted-fair order; a
+        flow with twice the weight gets twice the turns while both wait.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.perf_counter()
+        with self._cond:
+            if self._active < self.max_concurrent and not self._queued:
+                return self._admit(started)
+            if self._queued >= self.max_queue:
+                self.rejected["queue_full"] += 1
+                raise Overloaded("queue_full", 429, self._retry_after())
+            if self.max_queue_per_flow and self._flow_queued[flow] >= self.max_queue_per_flow:
+                self.rejected["flow_queue_full"] += 1
+                raise Overloaded("flow_queue_full", 429, self._retry_after())
+
+            waiter = self._enqueue(flow, weight)
+            deadline = started + timeout
+            try:
+                while self._head() is not waiter or self._active >= self.max_concurrent:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.rejected["queue_timeout"] += 1
+                        raise Overloaded("queue_timeout", 503, self._retry_after())
+                    self._cond.wait(remaining)
+                heapq.heappop(self._heap)
+                self._virtual_time = max(self._virtual_time, waiter.start)
+            finally:
+                self._dequeue(waiter)
+                # The next waiter may now be at the head of the queue
+                self._cond.notify_all()
+            return self._admit(started)
+
+    def try_acquire(self, spare=0):
+        """A slot right away if nobody waits and `spare` more stay free afterwards, else None
+
+        For optional work such as prefetching, which should only use idle capacity.
+        """
+        with self._cond:
+            if self._queued or self._active + 1 + spare > self.max_concurrent:
+                return None
+            return self._admit(time.perf_counter())
+
+    @contextmanager
+    def slot(self, timeout=None, flow=None, weight=1.0):
+        held = self.acquire(timeout, flow, weight)
+        try:
+            yield held
+        finally:
+            held.release()
+
+    def retry_after(self):
+        """Seconds a rejected client should wait before trying again"""
+        with self._cond:
+            return self._retry_after()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "queued_flows": len(self._flow_queued),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "service_time_s": round(self._service_time, 3) if self._service_time is not None else None
+            }
+
+    def _enqueue(self, flow, weight):
+        start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        waiter = _Waiter(flow, start, start + 1.0 / max(weight, 1e-3))
+        self._flow_finish[flow] = waiter.finish
+        self._flow_queued[flow] += 1
+        self._queued += 1
+        heapq.heappush(self._heap, (waiter.finish, next(self._sequence), waiter))
+        return waiter
+
+    def _head(self):
+        # Waiters that gave up stay in the heap until they reach the top
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0][2] if self._heap else None
+
+    def _dequeue(self, waiter):
+        waiter.cancelled = True
+        self._queued -= 1
+        self._flow_queued[waiter.flow] -= 1
+        if not self._flow_queued[waiter.flow]:
+            del self._flow_queued[waiter.flow]
+            # An idle flow starts from the current virtual time next time
+            if self._flow_finish.get(waiter.flow, 0.0) <= self._virtual_time:
+                self._flow_finish.pop(waiter.flow, None)
+        if not self._queued:
+            self._flow_finish.clear()
+
+    def _admit(self, started):
+        self._active += 1
+        self.admitted += 1
+        return Slot(self, (time.perf_counter() - started) * 1000)
+
+    def _release(self, service_time):
+        with self._cond:
+            self._active -= 1
+            if self._service_time is None:
+                self._service_time = service_time
+            else:
+                self._service_time += SERVICE_TIME_ALPHA * (service_time - self._service_time)
+            self._cond.notify_all()
+
+    def _retry_after(self):
+        """Seconds until the queue has likely drained enough to admit a new request"""
+        service_time = self._service_time or 1.0
+        rounds = (self._queued + self._active) / self.max_concurrent
+        return max(1, math.ceil(service_time * rounds))
@@ -0,0 +1,273 @@
+"""
+Single-flight coalescing of identical model calls.
+
+When many students send the same first question at once, the assembled
+contents (PDF, system instruction, empty history, question) are identical.
+The first request for a contents hash becomes the leader and calls the model;
+requests that arrive while it is in flight wait for its answer instead of
+making their own call.
+
+Within a process, followers wait on an event. Across workers on the same
+machine, a SQLite table records which process leads each key and, once done,
+its answer or error. One request per process polls the table for a remote
+leader and then hands the result to its local followers. Finished results are
+kept for a few seconds so stragglers of the same burst still share them.
+
+Followers on an event loop (the async chat endpoint) use wait_async(), which
+polls instead of holding a thread for the whole wait.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# How long a finished answer is shared with late arrivals of the same burst
+DEFAULT_RESULT_TTL = 5.0
+# Followers give up (and a stuck leader's claim is dropped) after this many seconds
+DEFAULT_WAIT_TIMEOUT = 60.0
+POLL_INTERVAL_MIN = 0.02
+POLL_INTERVAL_MAX = 0.25
+
+
+class FlightFailed(Exception):
+    """The leader of a coalesced call failed or disappeared"""
+
+
+def contents_key(contents, *parts):
+    """Hash of the full assembled contents plus anything else sent with them"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(contents, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    for part in parts:
+        digest.update(b'\0')
+        digest.update(str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Flight:
+    """One request's part in a coalesced call
+
+    A leader must call publish() or fail(); everyone else calls wait().
+    """
+    __slots__ = ('_group', 'key', 'role', '_call')
+
+    def __init__(self, group, key, role, call):
+        self._group = group
+        self.key = key
+        self.role = role
+        self._call = call
+
+    @property
+    def leader(self):
+        return self.role == 'leader'
+
+    def publish(self, result):
+        self._group._settle(self, result, None)
+
+    def fail(self, error):
+        self._group._settle(self, None, error)
+
+    def wait(self, timeout=None):
+        """Result of the leader's call; raises FlightFailed if it failed"""
+        timeout = self._group.wait_timeout if timeout is None else timeout
+        if self.role == 'remote_follower':
+            # This request polls the shared store on behalf of its local followers
+            try:
+                result = self._group._poll(self.key, timeout)
+            except FlightFailed as e:
+                self._group._settle(self, None, e, shared=False)
+                raise
+            self._group._settle(self, result, None, shared=False)
+            return result
+
+        if not self._call.done.wait(timeout):
+            raise FlightFailed(f"Timed out after {timeout:.0f}s waiting for a coalesced call")
+        if self._call.error is not None:
+            raise FlightFailed(str(self._call.error))
+        return self._call.result
+
+    async def wait_async(self, timeout=None):
+        """wait() for coroutines: local followers poll the leader's event with backoff"""
+        timeout = self._group.wait_timeout if timeout is None else timeout
+        if self.role == 'remote_follower':
+            # At most one per key and process
+            return await asyncio.to_thread(self.wait, timeout)
+
+        deadline = time.monotonic() + timeout
+        interval = POLL_INTERVAL_MIN
+        while not self._call.done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise FlightFailed(f"Timed out after {timeout:.0f}s waiting for a coalesced call")
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(POLL_INTERVAL_MAX, interval * 2)
+        if self._call.error is not None:
+            raise FlightFailed(str(self._call.error))
+        return self._call.result
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key, in-process and optionally across workers"""
+
+    def __init__(self, db_path=None, result_ttl=DEFAULT_RESULT_TTL, wait_timeout=DEFAULT_WAIT_TIMEOUT):
+        self.db_path = db_path
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.counts = {"leader": 0, "follower": 0, "remote_follower": 0}
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS flights ("
+                    " key TEXT PRIMARY KEY, owner TEXT NOT NULL, started_at REAL NOT NULL,"
+                    " finished_at REAL, result TEXT, error TEXT)"
+                )
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def join(self, key):
+        """Flight for key: the leader if nobody is computing it yet, else a follower"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.counts["follower"] += 1
+                return Flight(self, key, 'follower', call)
+            call = _Call()
+            self._calls[key] = call
+
+        role = 'leader' if self.db_path is None else self._claim(key)
+        with self._lock:
+            self.counts[role] += 1
+        return Flight(self, key, role, call)
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with the same key; returns (result, role)"""
+        flight = self.join(key)
+        if not flight.leader:
+            return flight.wait(), flight.role
+        try:
+            result = fn()
+        except Exception as e:
+            flight.fail(e)
+            raise
+        flight.publish(result)
+        return result, flight.role
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            in_flight = len(self._calls)
+        total = sum(counts.values())
+        shared = counts["follower"] + counts["remote_follower"]
+        return dict(counts, in_flight=in_flight, requests=total,
+                    coalescing_ratio=round(shared / total, 4) if total else 0.0)
+
+    def _settle(self, flight, result, error, shared=True):
+        if flight._call.done.is_set():
+            return
+        if shared and self.db_path is not None:
+            try:
+                self._store_result(flight.key, result, error)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not share coalesced result: {str(e)}")
+        with self._lock:
+            if self._calls.get(flight.key) is flight._call:
+                del self._calls[flight.key]
+        flight._call.result = result
+        flight._call.error = error
+        flight._call.done.set()
+
+    def _claim(self, key):
+        """'leader' if this process now owns key in the shared store, else 'remote_follower'"""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                # Drop failures, shared results past their TTL and claims abandoned by crashed workers
+                conn.execute(
+                    "DELETE FROM flights WHERE error IS NOT NULL OR (finished_at IS NOT NULL AND finished_at < ?)"
+                    " OR (finished_at IS NULL AND started_at < ?)",
+                    (now - self.result_ttl, now - self.wait_timeout)
+                )
+                claimed = conn.execute(
+                    "INSERT OR IGNORE INTO flights (key, owner, started_at) VALUES (?, ?, ?)",
+                    (key, self._owner, now)
+                ).rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Coalescing store unavailable, not coalescing across workers: {str(e)}")
+            return 'leader'
+        return 'leader' if claimed else 'remote_follower'
+
+    def _store_result(self, key, result, error):
+        with self._connect() as conn:
+            if error is None:
+                conn.execute(
+                    "UPDATE flights SET finished_at = ?, result = ? WHERE key = ? AND owner = ?",
+                    (time.time(), result, key, self._owner)
+                )
+            else:
+                conn.execute(
+                    "UPDATE flights SET finished_at = ?, error = ? WHERE key = ? AND owner = ?",
+                    (time.time(), str(error) or error.__class__.__name__, key, self._owner)
+                )
+
+    def _poll(self, key, timeout):
+        deadline = time.time() + timeout
+        interval = POLL_INTERVAL_MIN
+        while True:
+            try:
+                row = self._connect().execute(
+                    "SELECT finished_at, result, error FROM flights WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                raise FlightFailed(f"Coalescing store unavailable: {str(e)}")
+            if row is None:
+                raise FlightFailed("The leading worker abandoned the call")
+            if row[0] is not None:
+                if row[2] is not None:
+                    raise FlightFailed(row[2])
+                return row[1]
+            if time.time() >= deadline:
+                raise FlightFailed(f"Timed out after {timeout:.0f}s waiting for another worker")
+            time.sleep(interval)
+            interval = min(interval * 2, POLL_INTERVAL_MAX)
+
+
+def create_single_flight(backend, data_dir, wait_timeout=DEFAULT_WAIT_TIMEOUT):
+    """Build the configured coalescing backend ('sqlite', 'memory' or 'off')"""
+    if backend == 'off':
+        return None
+    if backend == 'sqlite':
+        try:
+            return SingleFlight(os.path.join(data_dir, 'single_flight.sqlite3'), wait_timeout=wait_timeout)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not open coalescing store in {data_dir} ({str(e)}), coalescing per process")
+            return SingleFlight(wait_timeout=wait_timeout)
+    if backend != 'memory':
+        logger.warning(f"Unknown COALESCE_REQUESTS '{backend}', using memory")
+    return SingleFlight(wait_timeout=wait_timeout)
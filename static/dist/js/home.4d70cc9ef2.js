@@ -0,0 +1,61 @@
+const hamburger=document.querySelector('.hamburger');
+const navMenu=document.querySelector('.nav-menu');
+if(hamburger){
+hamburger.addEventListener('click',()=>{
+hamburger.classList.toggle('active');
+navMenu.classList.toggle('active');
+});
+}
+document.querySelectorAll('.nav-link').forEach(link=>{
+link.addEventListener('click',()=>{
+hamburger.classList.remove('active');
+navMenu.classList.remove('active');
+});
+});
+document.querySelectorAll('a[href^="#"]').forEach(anchor=>{
+anchor.addEventListener('click',function(e){
+e.preventDefault();
+const target=document.querySelector(this.getAttribute('href'));
+if(target){
+target.scrollIntoView({
+behavior:'smooth',
+block:'start'
+});
+}
+});
+});
+window.addEventListener('scroll',()=>{
+const sections=document.querySelectorAll('section[id]');
+const scrollY=window.pageYOffset;
+sections.forEach(section=>{
+const sectionHeight=section.offsetHeight;
+const sectionTop=section.offsetTop-100;
+const sectionId=section.getAttribute('id');
+const navLink=document.querySelector(`.nav-link[href="#${sectionId}"]`);
+if(navLink){
+if(scrollY>sectionTop&&scrollY<=sectionTop+sectionHeight){
+navLink.classList.add('active');
+}else{
+navLink.classList.remove('active');
+}
+}
+});
+});
+const observerOptions={
+threshold:0.1,
+rootMargin:'0px 0px -100px 0px'
+};
+const observer=new IntersectionObserver((entries)=>{
+entries.forEach(entry=>{
+if(entry.isIntersecting){
+entry.target.style.opacity='1';
+entry.target.style.transform='translateY(0)';
+}
+});
+},observerOptions);
+document.querySelectorAll('.about-card, .program-card').forEach(card=>{
+card.style.opacity='0';
+card.style.transform='translateY(20px)';
+card.style.transition='opacity 0.6s ease, transform 0.6s ease';
+observer.observe(card);
+});
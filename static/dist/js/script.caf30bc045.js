@@ -0,0 +1,552 @@
+document.addEventListener('DOMContentLoaded',function(){
+const sendButton=document.getElementById('send-button');
+const userInput=document.getElementById('user-input');
+const messagesContainer=document.querySelector('.messages-container');
+const chatList=document.getElementById('chat-list');
+const chatListSentinel=document.getElementById('chat-list-sentinel');
+const welcomeHTML=messagesContainer.innerHTML;
+let currentConversationId=null;
+let conversationsCursor=null;
+let conversationsDone=false;
+let loadingConversations=false;
+let olderMessagesCursor=null;
+let loadingMessages=false;
+function formatActivity(updatedAt){
+const date=new Date(updatedAt);
+if(date.toDateString()===new Date().toDateString()){
+return formatTime(date);
+}
+return date.toLocaleDateString();
+}
+function conversationItem(conversation){
+const item=document.createElement('div');
+item.className='chat-item';
+item.dataset.id=conversation.id;
+item.innerHTML=`
+            <div class="chat-item-text">
+                <span class="chat-title"></span>
+                <span class="chat-time">${formatActivity(conversation.updated_at)}</span>
+            </div>
+            <div class="chat-actions"><i class="fas fa-trash" title="Delete"></i></div>
+        `;
+item.querySelector('.chat-title').textContent=conversation.title;
+item.classList.toggle('active',conversation.id===currentConversationId);
+return item;
+}
+function setActiveItem(){
+chatList.querySelectorAll('.chat-item').forEach(item=>{
+item.classList.toggle('active',item.dataset.id===currentConversationId);
+});
+}
+function loadConversations(){
+if(loadingConversations||conversationsDone)return Promise.resolve(null);
+loadingConversations=true;
+chatListSentinel.textContent='Loading…';
+const query=conversationsCursor?`?cursor=${encodeURIComponent(conversationsCursor)}`:'';
+return fetch(`/conversations${query}`)
+.then(response=>response.json())
+.then(data=>{
+(data.conversations||[]).forEach(conversation=>{
+chatList.insertBefore(conversationItem(conversation),chatListSentinel);
+});
+conversationsCursor=data.next_cursor;
+conversationsDone=!data.next_cursor;
+chatListSentinel.textContent='';
+return data;
+})
+.then(data=>{
+loadingConversations=false;
+if(data&&!conversationsDone&&chatList.scrollHeight<=chatList.clientHeight){
+loadConversations();
+}
+return data;
+})
+.catch(error=>{
+console.error('Error loading conversations:',error);
+chatListSentinel.textContent='';
+loadingConversations=false;
+return null;
+});
+}
+function loadMessages(conversationId,cursor){
+loadingMessages=true;
+const query=cursor?`?cursor=${encodeURIComponent(cursor)}`:'';
+return fetch(`/conversations/${encodeURIComponent(conversationId)}/messages${query}`)
+.then(response=>response.ok?response.json():null)
+.then(data=>{
+if(!data||conversationId!==currentConversationId)return;
+if(!cursor&&!data.messages.length){
+messagesContainer.innerHTML=welcomeHTML;
+return;
+}
+const previousHeight=messagesContainer.scrollHeight;
+data.messages.slice().reverse().forEach(message=>{
+const role=message.role==='model'?'assistant':'user';
+addMessage(message.content,role,formatTime(new Date(message.timestamp*1000)),true);
+});
+if(cursor){
+messagesContainer.scrollTop+=messagesContainer.scrollHeight-previousHeight;
+}else{
+messagesContainer.scrollTop=messagesContainer.scrollHeight;
+}
+olderMessagesCursor=data.next_cursor;
+})
+.catch(error=>{
+console.error('Error loading messages:',error);
+})
+.finally(()=>{
+loadingMessages=false;
+});
+}
+function openConversation(conversationId){
+currentConversationId=conversationId;
+olderMessagesCursor=null;
+setActiveItem();
+messagesContainer.innerHTML='';
+return loadMessages(conversationId,null);
+}
+function startNewConversation(){
+currentConversationId=null;
+olderMessagesCursor=null;
+setActiveItem();
+messagesContainer.innerHTML=welcomeHTML;
+}
+function markActivity(conversationId,message){
+if(!chatList)return;
+currentConversationId=conversationId;
+let item=chatList.querySelector(`.chat-item[data-id="${CSS.escape(conversationId)}"]`);
+if(!item){
+item=conversationItem({id:conversationId,title:message,updated_at:Date.now()});
+}else{
+item.querySelector('.chat-time').textContent=formatActivity(Date.now());
+}
+chatList.insertBefore(item,chatList.firstChild);
+setActiveItem();
+}
+function setupConversations(){
+document.getElementById('new-chat').addEventListener('click',startNewConversation);
+chatList.addEventListener('click',function(e){
+const item=e.target.closest('.chat-item');
+if(!item)return;
+if(e.target.classList.contains('fa-trash')){
+fetch(`/conversations/${encodeURIComponent(item.dataset.id)}`,{method:'DELETE'})
+.then(response=>{
+if(!response.ok)return;
+item.classList.add('deleting');
+setTimeout(()=>{
+item.remove();
+},300);
+if(item.dataset.id===currentConversationId){
+startNewConversation();
+}
+});
+}else if(item.dataset.id!==currentConversationId){
+openConversation(item.dataset.id);
+}
+});
+new IntersectionObserver(entries=>{
+if(entries[0].isIntersecting){
+loadConversations();
+}
+},{root:chatList}).observe(chatListSentinel);
+messagesContainer.addEventListener('scroll',function(){
+if(messagesContainer.scrollTop<80&&olderMessagesCursor&&!loadingMessages){
+loadMessages(currentConversationId,olderMessagesCursor);
+}
+});
+loadConversations().then(data=>{
+if(data&&data.current&&!currentConversationId){
+openConversation(data.current);
+}
+});
+}
+function addMessage(content,role,timestamp,prepend){
+const messageDiv=document.createElement('div');
+messageDiv.className=`message ${role}-message`;
+let messageHTML='';
+if(role==='assistant'){
+messageHTML=`
+                <div class="message-avatar">
+                    <img src="/assets/images/bot_avatar.51c39ab005.png" alt="User">
+                </div>
+                <div class="message-content">
+                    <div class="text-content"></div>
+                    <div class="message-timestamp">${timestamp}</div>
+                </div>
+            `;
+}else{
+messageHTML=`
+                <div class="message-content">
+                    <div class="text-content"></div>
+                    <div class="message-timestamp">${timestamp}</div>
+                </div>
+                <div class="user-avatar">
+                    <img src="/assets/images/user_avatar.ebf29a9f78.png" alt="User">
+                </div>
+            `;
+}
+messageDiv.innerHTML=messageHTML;
+messageDiv.querySelector('.text-content').textContent=content;
+if(prepend){
+messagesContainer.insertBefore(messageDiv,messagesContainer.firstChild);
+return;
+}
+messagesContainer.appendChild(messageDiv);
+messagesContainer.scrollTop=messagesContainer.scrollHeight;
+}
+function showTypingEffect(message,element){
+const textContentDiv=element.querySelector('.text-content');
+textContentDiv.textContent='';
+const typingIndicator=document.createElement('div');
+typingIndicator.className='typing-indicator';
+typingIndicator.innerHTML='<span></span><span></span><span></span>';
+textContentDiv.appendChild(typingIndicator);
+setTimeout(()=>{
+textContentDiv.removeChild(typingIndicator);
+const characters=message.split('');
+let currentIndex=0;
+const totalTypingTime=1000;
+const baseDelay=totalTypingTime/characters.length;
+function typeNextCharacter(){
+if(currentIndex<characters.length){
+textContentDiv.textContent+=characters[currentIndex];
+currentIndex++;
+const randomDelay=Math.floor(Math.random()*3)+baseDelay;
+setTimeout(typeNextCharacter,randomDelay);
+}
+}
+typeNextCharacter();
+},1000);
+}
+function getCurrentTime(){
+return formatTime(new Date());
+}
+function formatTime(date){
+const hours=date.getHours().toString().padStart(2,'0');
+const minutes=date.getMinutes().toString().padStart(2,'0');
+return`${hours}:${minutes}`;
+}
+function renderSuggestions(element,suggestions){
+if(!suggestions||!suggestions.length)return;
+const container=document.createElement('div');
+container.className='suggestions';
+suggestions.forEach(question=>{
+const chip=document.createElement('button');
+chip.type='button';
+chip.className='suggestion-chip';
+chip.textContent=question;
+chip.addEventListener('click',()=>sendMessage(question));
+container.appendChild(chip);
+});
+const messageContent=element.querySelector('.message-content');
+messageContent.insertBefore(container,messageContent.querySelector('.message-timestamp'));
+messagesContainer.scrollTop=messagesContainer.scrollHeight;
+}
+function sendMessage(suggestion){
+const message=suggestion||userInput.value.trim();
+if(!message)return;
+const currentTime=getCurrentTime();
+messagesContainer.querySelectorAll('.suggestions').forEach(element=>element.remove());
+addMessage(message,'user',currentTime);
+if(!suggestion){
+userInput.value='';
+}
+const thinkingDiv=document.createElement('div');
+thinkingDiv.className='message assistant-message';
+thinkingDiv.innerHTML=`
+            <div class="message-avatar">
+                <img src="/assets/images/bot_avatar.51c39ab005.png" alt="Profile">
+            </div>
+            <div class="message-content">
+                <div class="thinking-animation">
+                    <div class="thinking-bubble"></div>
+                    <div class="thinking-bubble"></div>
+                    <div class="thinking-bubble"></div>
+                </div>
+                <div class="text-content"></div>
+                <div class="message-timestamp">${currentTime}</div>
+            </div>
+        `;
+messagesContainer.appendChild(thinkingDiv);
+messagesContainer.scrollTop=messagesContainer.scrollHeight;
+const payload={message:message,stream:true};
+if(chatList){
+payload.conversation_id=currentConversationId;
+}
+fetch('/send_message',{
+method:'POST',
+headers:{
+'Content-Type':'application/json',
+},
+body:JSON.stringify(payload),
+})
+.then(response=>{
+const conversationId=response.headers.get('X-Conversation-Id');
+if(conversationId){
+markActivity(conversationId,message);
+}
+const contentType=response.headers.get('Content-Type')||'';
+if(response.body&&contentType.includes('application/x-ndjson')){
+return renderStream(response,thinkingDiv);
+}
+return response.json().then(data=>{
+removeThinkingAnimation(thinkingDiv);
+showTypingEffect(data.response||data.error,thinkingDiv);
+renderSuggestions(thinkingDiv,data.suggestions);
+});
+})
+.catch(error=>{
+console.error('Error:',error);
+removeThinkingAnimation(thinkingDiv);
+showTypingEffect('Sorry, I encountered an error while processing your request.',thinkingDiv);
+});
+}
+function removeThinkingAnimation(element){
+const thinkingAnimation=element.querySelector('.thinking-animation');
+if(thinkingAnimation){
+thinkingAnimation.remove();
+}
+}
+function renderStream(response,element){
+const textContentDiv=element.querySelector('.text-content');
+const reader=response.body.getReader();
+const decoder=new TextDecoder();
+let buffer='';
+function handleLine(line){
+if(!line.trim())return;
+const event=JSON.parse(line);
+if(event.type==='chunk'){
+removeThinkingAnimation(element);
+textContentDiv.textContent+=event.text;
+messagesContainer.scrollTop=messagesContainer.scrollHeight;
+}else if(event.type==='done'){
+renderSuggestions(element,event.suggestions);
+}else if(event.type==='error'){
+removeThinkingAnimation(element);
+textContentDiv.textContent=event.error;
+}
+}
+function readNext(){
+return reader.read().then(({done,value})=>{
+if(done){
+handleLine(buffer);
+removeThinkingAnimation(element);
+return;
+}
+buffer+=decoder.decode(value,{stream:true});
+const lines=buffer.split('\n');
+buffer=lines.pop();
+lines.forEach(handleLine);
+return readNext();
+});
+}
+return readNext();
+}
+sendButton.addEventListener('click',()=>sendMessage());
+userInput.addEventListener('keypress',function(e){
+if(e.key==='Enter'){
+sendMessage();
+}
+});
+const themeToggle=document.querySelector('.theme-toggle');
+if(themeToggle){
+themeToggle.addEventListener('click',function(){
+document.body.classList.toggle('dark-mode');
+});
+}
+const tabs=document.querySelectorAll('.tab');
+tabs.forEach(tab=>{
+tab.addEventListener('click',function(){
+tabs.forEach(t=>t.classList.remove('active'));
+this.classList.add('active');
+});
+});
+const navItems=document.querySelectorAll('.nav-item');
+navItems.forEach(item=>{
+item.addEventListener('click',function(){
+navItems.forEach(i=>i.classList.remove('active'));
+this.classList.add('active');
+});
+});
+const sectionItems=document.querySelectorAll('.section-item');
+sectionItems.forEach(item=>{
+item.addEventListener('click',function(){
+sectionItems.forEach(i=>i.classList.remove('active'));
+this.classList.add('active');
+});
+});
+if(chatList){
+setupConversations();
+}
+function setupPlaceholderImages(){
+const profilePic=document.querySelector('.profile-pic img');
+const userAvatars=document.querySelectorAll('.user-avatar img');
+profilePic.src="/assets/images/user_avatar.ebf29a9f78.png";
+profilePic.onerror=function(){
+const canvas=document.createElement('canvas');
+canvas.width=100;
+canvas.height=100;
+const ctx=canvas.getContext('2d');
+ctx.fillStyle='#4a69bd';
+ctx.fillRect(0,0,100,100);
+ctx.fillStyle='#ffffff';
+ctx.font='40px Arial';
+ctx.textAlign='center';
+ctx.textBaseline='middle';
+ctx.fillText('G',50,50);
+profilePic.src=canvas.toDataURL();
+};
+userAvatars.forEach(avatar=>{
+avatar.src="/static/images/user.png";
+avatar.onerror=function(){
+const userCanvas=document.createElement('canvas');
+userCanvas.width=100;
+userCanvas.height=100;
+const userCtx=userCanvas.getContext('2d');
+userCtx.fillStyle='#6ab04c';
+userCtx.fillRect(0,0,100,100);
+userCtx.fillStyle='#ffffff';
+userCtx.font='40px Arial';
+userCtx.textAlign='center';
+userCtx.textBaseline='middle';
+userCtx.fillText('U',50,50);
+avatar.src=userCanvas.toDataURL();
+};
+});
+}
+setupPlaceholderImages();
+function animateMessages(){
+const messages=document.querySelectorAll('.message');
+messages.forEach((message,index)=>{
+message.style.opacity='0';
+message.style.transform='translateY(20px)';
+message.style.transition='opacity 0.3s ease, transform 0.3s ease';
+setTimeout(()=>{
+message.style.opacity='1';
+message.style.transform='translateY(0)';
+},index*100);
+});
+}
+animateMessages();
+});
+function setupDarkMode(){
+const prefersDarkMode=window.matchMedia('(prefers-color-scheme: dark)').matches;
+if(prefersDarkMode){
+document.body.classList.add('dark-mode');
+}
+const darkModeStyles=document.createElement('style');
+darkModeStyles.textContent=`
+        body.dark-mode {
+            --bg-color: #2d3436;
+            --sidebar-color: #3b4a4d;
+            --header-color: #3b4a4d;
+            --text-color: #b2bec3;
+            --accent-color: #6ab04c;
+            --white-color: #2d3436;
+            --black-color: #dfe6e9;
+            --gray-light: #636e72;
+            --shadow-color: rgba(0, 0, 0, 0.3);
+        }
+
+        body.dark-mode .assistant-message .message-content {
+            background-color: #3b4a4d;
+            color: #dfe6e9;
+        }
+
+        body.dark-mode .message-input,
+        body.dark-mode .chat-item {
+            background-color: #3b4a4d;
+        }
+
+        body.dark-mode .input-container input {
+            color: #dfe6e9;
+        }
+
+        /* Dark mode support for typing and thinking animations */
+        body.dark-mode .thinking-bubble {
+            background-color: #636e72;
+        }
+
+        body.dark-mode .typing-indicator span {
+            background-color: #6ab04c;
+        }
+    `;
+document.head.appendChild(darkModeStyles);
+const animationStyles=document.createElement('style');
+animationStyles.textContent=`
+        /* Thinking animation (shown before typing starts) */
+        .thinking-animation {
+            display: flex;
+            padding: 6px 0;
+        }
+
+        .thinking-bubble {
+            background-color: #e2e2e2;
+            width: 8px;
+            height: 8px;
+            border-radius: 50%;
+            margin: 0 2px;
+            opacity: 0.6;
+            animation: thinking 1.4s infinite ease-in-out both;
+        }
+
+        .thinking-bubble:nth-child(1) {
+            animation-delay: -0.32s;
+        }
+
+        .thinking-bubble:nth-child(2) {
+            animation-delay: -0.16s;
+        }
+
+        @keyframes thinking {
+            0%, 80%, 100% {
+                transform: scale(0.6);
+            }
+            40% {
+                transform: scale(1);
+            }
+        }
+
+        /* Typing indicator shown briefly before characters appear */
+        .typing-indicator {
+            display: flex;
+            padding: 6px 0;
+        }
+
+        .typing-indicator span {
+            height: 8px;
+            width: 8px;
+            background-color: #6ab04c;
+            border-radius: 50%;
+            display: inline-block;
+            margin: 0 2px;
+            animation: typingBounce 1.4s infinite ease-in-out both;
+        }
+
+        .typing-indicator span:nth-child(1) {
+            animation-delay: -0.32s;
+        }
+
+        .typing-indicator span:nth-child(2) {
+            animation-delay: -0.16s;
+        }
+
+        @keyframes typingBounce {
+            0%, 80%, 100% {
+                transform: scale(0);
+            }
+            40% {
+                transform: scale(1);
+            }
+        }
+
+        /* Ensure the text-content div has proper styling for the typing effect */
+        .message-content .text-content {
+            min-height: 20px;
+            white-space: pre-wrap;
+            word-break: break-word;
+        }
+    `;
+document.head.appendChild(animationStyles);
+}
+setupDarkMode();
@@ -3,8 +3,194 @@ document.addEventListener('DOMContentLoaded', function() {
     const userInput = document.getElementById('user-input');
     const messagesContainer = document.querySelector('.messages-container');
 
-    // Function to add new message to the chat
-    function addMessage(content, role, timestamp) {
+    // Saved conversations in the sidebar (absent when the server doesn't keep them)
+    const chatList = document.getElementById('chat-list');
+    const chatListSentinel = document.getElementById('chat-list-sentinel');
+    const welcomeHTML = messagesContainer.innerHTML;
+    let currentConversationId = null;  // null: the next message starts a new conversation
+    let conversationsCursor = null;
+    let conversationsDone = false;
+    let loadingConversations = false;
+    let olderMessagesCursor = null;
+    let loadingMessages = false;
+
+    // Function to format a conversation's last activity: the time today, else the date
+    function formatActivity(updatedAt) {
+        const date = new Date(updatedAt);
+        if (date.toDateString() === new Date().toDateString()) {
+            return formatTime(date);
+        }
+        return date.toLocaleDateString();
+    }
+
+    function conversationItem(conversation) {
+        const item = document.createElement('div');
+        item.className = 'chat-item';
+        item.dataset.id = conversation.id;
+        item.innerHTML = `
+            <div class="chat-item-text">
+                <span class="chat-title"></span>
+                <span class="chat-time">${formatActivity(conversation.updated_at)}</span>
+            </div>
+            <div class="chat-actions"><i class="fas fa-trash" title="Delete"></i></div>
+        `;
+        item.querySelector('.chat-title').textContent = conversation.title;
+        item.classList.toggle('active', conversation.id === currentConversationId);
+        return item;
+    }
+
+    function setActiveItem() {
+        chatList.querySelectorAll('.chat-item').forEach(item => {
+            item.classList.toggle('active', item.dataset.id === currentConversationId);
+        });
+    }
+
+    // Function to load the next page of conversations (the sidebar pages as it is scrolled)
+    function loadConversations() {
+        if (loadingConversations || conversationsDone) return Promise.resolve(null);
+        loadingConversations = true;
+        chatListSentinel.textContent = 'Loading…';
+        const query = conversationsCursor ? `?cursor=${encodeURIComponent(conversationsCursor)}` : '';
+
+        return fetch(`/conversations${query}`)
+            .then(response => response.json())
+            .then(data => {
+                (data.conversations || []).forEach(conversation => {
+                    chatList.insertBefore(conversationItem(conversation), chatListSentinel);
+                });
+                conversationsCursor = data.next_cursor;
+                conversationsDone = !data.next_cursor;
+                chatListSentinel.textContent = '';
+                return data;
+            })
+            .then(data => {
+                // The observer only fires on changes, so keep going while the list doesn't fill the sidebar
+                loadingConversations = false;
+                if (data && !conversationsDone && chatList.scrollHeight <= chatList.clientHeight) {
+                    loadConversations();
+                }
+                return data;
+            })
+            .catch(error => {
+                console.error('Error loading conversations:', error);
+                chatListSentinel.textContent = '';
+                loadingConversations = false;
+                return null;
+            });
+    }
+
+    // Function to load one page of a conversation's messages, newest first
+    function loadMessages(conversationId, cursor) {
+        loadingMessages = true;
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+
+        return fetch(`/conversations/${encodeURIComponent(conversationId)}/messages${query}`)
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                if (!data || conversationId !== currentConversationId) return;
+                if (!cursor && !data.messages.length) {
+                    messagesContainer.innerHTML = welcomeHTML;
+                    return;
+                }
+
+                // Keep the visible messages in place while older ones are added above
+                const previousHeight = messagesContainer.scrollHeight;
+                data.messages.slice().reverse().forEach(message => {
+                    const role = message.role === 'model' ? 'assistant' : 'user';
+                    addMessage(message.content, role, formatTime(new Date(message.timestamp * 1000)), true);
+                });
+                if (cursor) {
+                    messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+                } else {
+                    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                }
+                olderMessagesCursor = data.next_cursor;
+            })
+            .catch(error => {
+                console.error('Error loading messages:', error);
+            })
+            .finally(() => {
+                loadingMessages = false;
+            });
+    }
+
+    function openConversation(conversationId) {
+        currentConversationId = conversationId;
+        olderMessagesCursor = null;
+        setActiveItem();
+        messagesContainer.innerHTML = '';
+        return loadMessages(conversationId, null);
+    }
+
+    function startNewConversation() {
+        currentConversationId = null;
+        olderMessagesCursor = null;
+        setActiveItem();
+        messagesContainer.innerHTML = welcomeHTML;
+    }
+
+    // Function to move the conversation a message went to to the top of the list
+    function markActivity(conversationId, message) {
+        if (!chatList) return;
+        currentConversationId = conversationId;
+        let item = chatList.querySelector(`.chat-item[data-id="${CSS.escape(conversationId)}"]`);
+        if (!item) {
+            item = conversationItem({ id: conversationId, title: message, updated_at: Date.now() });
+        } else {
+            item.querySelector('.chat-time').textContent = formatActivity(Date.now());
+        }
+        chatList.insertBefore(item, chatList.firstChild);
+        setActiveItem();
+    }
+
+    function setupConversations() {
+        document.getElementById('new-chat').addEventListener('click', startNewConversation);
+
+        chatList.addEventListener('click', function(e) {
+            const item = e.target.closest('.chat-item');
+            if (!item) return;
+
+            if (e.target.classList.contains('fa-trash')) {
+                fetch(`/conversations/${encodeURIComponent(item.dataset.id)}`, { method: 'DELETE' })
+                    .then(response => {
+                        if (!response.ok) return;
+                        item.classList.add('deleting');
+                        setTimeout(() => {
+                            item.remove();
+                        }, 300);
+                        if (item.dataset.id === currentConversationId) {
+                            startNewConversation();
+                        }
+                    });
+            } else if (item.dataset.id !== currentConversationId) {
+                openConversation(item.dataset.id);
+            }
+        });
+
+        // Load more conversations when the end of the list scrolls into view
+        new IntersectionObserver(entries => {
+            if (entries[0].isIntersecting) {
+                loadConversations();
+            }
+        }, { root: chatList }).observe(chatListSentinel);
+
+        // Load older messages when the top of the conversation is reached
+        messagesContainer.addEventListener('scroll', function() {
+            if (messagesContainer.scrollTop < 80 && olderMessagesCursor && !loadingMessages) {
+                loadMessages(currentConversationId, olderMessagesCursor);
+            }
+        });
+
+        // Resume the session's conversation, if it has one
+        loadConversations().then(data => {
+            if (data && data.current && !currentConversationId) {
+                openConversation(data.current);
+            }
+        });
+    }
+
+    // Function to add new message to the chat (or, with prepend, above the messages shown)
+    function addMessage(content, role, timestamp, prepend) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${role}-message`;
 
@@ -16,14 +202,14 @@ document.addEventListener('DOMContentLoaded', function() {
                     <img src="/static/images/bot_avatar.png" alt="User">
                 </div>
                 <div class="message-content">
-                    <div class="text-content">${content}</div>
+                    <div class="text-content"></div>
                     <div class="message-timestamp">${timestamp}</div>
                 </div>
             `;
         } else {
             messageHTML = `
                 <div class="message-content">
-                    <div class="text-content">${content}</div>
+                    <div class="text-content"></div>
                     <div class="message-timestamp">${timestamp}</div>
                 </div>
                 <div class="user-avatar">
@@ -33,6 +219,11 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         messageDiv.innerHTML = messageHTML;
+        messageDiv.querySelector('.text-content').textContent = content;
+        if (prepend) {
+            messagesContainer.insertBefore(messageDiv, messagesContainer.firstChild);
+            return;
+        }
         messagesContainer.appendChild(messageDiv);
         messagesContainer.scrollTop = messagesContainer.scrollHeight;
     }
@@ -79,24 +270,51 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Function to get current time in HH:MM format
     function getCurrentTime() {
-        const now = new Date();
-        const hours = now.getHours().toString().padStart(2, '0');
-        const minutes = now.getMinutes().toString().padStart(2, '0');
+        return formatTime(new Date());
+    }
+
+    function formatTime(date) {
+        const hours = date.getHours().toString().padStart(2, '0');
+        const minutes = date.getMinutes().toString().padStart(2, '0');
         return `${hours}:${minutes}`;
     }
 
-    // Function to handle message sending
-    function sendMessage() {
-        const message = userInput.value.trim();
+    // Function to show suggested follow-up questions under a bot message
+    function renderSuggestions(element, suggestions) {
+        if (!suggestions || !suggestions.length) return;
+
+        const container = document.createElement('div');
+        container.className = 'suggestions';
+        suggestions.forEach(question => {
+            const chip = document.createElement('button');
+            chip.type = 'button';
+            chip.className = 'suggestion-chip';
+            chip.textContent = question;
+            chip.addEventListener('click', () => sendMessage(question));
+            container.appendChild(chip);
+        });
+        const messageContent = element.querySelector('.message-content');
+        messageContent.insertBefore(container, messageContent.querySelector('.message-timestamp'));
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+
+    // Function to handle message sending (typed, or a clicked suggestion)
+    function sendMessage(suggestion) {
+        const message = suggestion || userInput.value.trim();
         if (!message) return;
 
         const currentTime = getCurrentTime();
 
+        // Suggestions belong to the latest answer only
+        messagesContainer.querySelectorAll('.suggestions').forEach(element => element.remove());
+
         // Add user message to the chat
         addMessage(message, 'user', currentTime);
 
         // Clear input
-        userInput.value = '';
+        if (!suggestion) {
+            userInput.value = '';
+        }
 
         // Show thinking/loading effect
         const thinkingDiv = document.createElement('div');
@@ -118,37 +336,96 @@ document.addEventListener('DOMContentLoaded', function() {
         messagesContainer.appendChild(thinkingDiv);
         messagesContainer.scrollTop = messagesContainer.scrollHeight;
 
-        // Send message to the backend
+        // Send message to the backend (to the open saved conversation, or a new one)
+        const payload = { message: message, stream: true };
+        if (chatList) {
+            payload.conversation_id = currentConversationId;
+        }
         fetch('/send_message', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ message: message }),
+            body: JSON.stringify(payload),
         })
-        .then(response => response.json())
-        .then(data => {
-            // Remove thinking animation
-            const thinkingAnimation = thinkingDiv.querySelector('.thinking-animation');
-            if (thinkingAnimation) {
-                thinkingAnimation.remove();
+        .then(response => {
+            const conversationId = response.headers.get('X-Conversation-Id');
+            if (conversationId) {
+                markActivity(conversationId, message);
             }
 
-            // Start typing effect for the response
-            showTypingEffect(data.response, thinkingDiv);
+            const contentType = response.headers.get('Content-Type') || '';
+            if (response.body && contentType.includes('application/x-ndjson')) {
+                return renderStream(response, thinkingDiv);
+            }
+
+            return response.json().then(data => {
+                removeThinkingAnimation(thinkingDiv);
+
+                // Start typing effect for the response
+                showTypingEffect(data.response || data.error, thinkingDiv);
+                renderSuggestions(thinkingDiv, data.suggestions);
+            });
         })
         .catch(error => {
             console.error('Error:', error);
-            const thinkingAnimation = thinkingDiv.querySelector('.thinking-animation');
-            if (thinkingAnimation) {
-                thinkingAnimation.remove();
-            }
+            removeThinkingAnimation(thinkingDiv);
             showTypingEffect('Sorry, I encountered an error while processing your request.', thinkingDiv);
         });
     }
 
+    // Function to remove the thinking animation from a bot message
+    function removeThinkingAnimation(element) {
+        const thinkingAnimation = element.querySelector('.thinking-animation');
+        if (thinkingAnimation) {
+            thinkingAnimation.remove();
+        }
+    }
+
+    // Function to render a streamed (NDJSON) response as chunks arrive
+    function renderStream(response, element) {
+        const textContentDiv = element.querySelector('.text-content');
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        function handleLine(line) {
+            if (!line.trim()) return;
+            const event = JSON.parse(line);
+
+            if (event.type === 'chunk') {
+                removeThinkingAnimation(element);
+                textContentDiv.textContent += event.text;
+                messagesContainer.scrollTop = messagesContainer.scrollHeight;
+            } else if (event.type === 'done') {
+                renderSuggestions(element, event.suggestions);
+            } else if (event.type === 'error') {
+                removeThinkingAnimation(element);
+                textContentDiv.textContent = event.error;
+            }
+        }
+
+        function readNext() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    handleLine(buffer);
+                    removeThinkingAnimation(element);
+                    return;
+                }
+
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.forEach(handleLine);
+                return readNext();
+            });
+        }
+
+        return readNext();
+    }
+
     // Event listeners
-    sendButton.addEventListener('click', sendMessage);
+    sendButton.addEventListener('click', () => sendMessage());
 
     userInput.addEventListener('keypress', function(e) {
         if (e.key === 'Enter') {
@@ -158,9 +435,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Theme toggle functionality
     const themeToggle = document.querySelector('.theme-toggle');
-    themeToggle.addEventListener('click', function() {
-        document.body.classList.toggle('dark-mode');
-    });
+    if (themeToggle) {
+        themeToggle.addEventListener('click', function() {
+            document.body.classList.toggle('dark-mode');
+        });
+    }
 
     // Tabs functionality
     const tabs = document.querySelectorAll('.tab');
@@ -189,35 +468,9 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
-    // Recent chats dropdown
-    const recentHeader = document.querySelector('.recent-header');
-    const chatList = document.querySelector('.chat-list');
-
-    recentHeader.addEventListener('click', function() {
-        chatList.classList.toggle('hidden');
-        const icon = recentHeader.querySelector('i');
-        icon.classList.toggle('fa-chevron-down');
-        icon.classList.toggle('fa-chevron-up');
-    });
-
-    // Chat actions
-    const chatActions = document.querySelectorAll('.chat-actions i');
-    chatActions.forEach(action => {
-        action.addEventListener('click', function(e) {
-            e.stopPropagation();
-            const chatItem = this.closest('.chat-item');
-
-            if (this.classList.contains('fa-trash')) {
-                chatItem.classList.add('deleting');
-                setTimeout(() => {
-                    chatItem.remove();
-                }, 300);
-            } else if (this.classList.contains('fa-edit')) {
-                // Edit functionality would go here
-                console.log('Edit chat');
-            }
-        });
-    });
+    if (chatList) {
+        setupConversations();
+    }
 
     // Add placeholder profile images for demonstration
     function setupPlaceholderImages() {
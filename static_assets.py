@@ -0,0 +1,335 @@
+"""
+Fingerprinted, minified and precompressed static assets.
+
+`python static_assets.py` builds `static/dist/` from the `static/` tree:
+
+- CSS and JS are minified, images are downsized to the size they are shown at
+- every file gets a content hash in its name (css/style.3f2a9c01be.css)
+- text assets also get .gz and .br (if the `brotli` package is installed)
+  variants, kept only when smaller
+- `/static/...` references inside CSS and JS are rewritten to hashed URLs
+- `manifest.json` maps each source path to its hashed file and encodings
+
+Image downsizing needs Pillow and Brotli output needs `brotli`; both are build
+tools only (`pip install pillow brotli`). Without them those steps are skipped.
+
+At runtime `AssetManifest.url()` (the `asset_url` template helper) emits the
+hashed URL, and the app serves those files with immutable cache headers,
+picking the precompressed variant from Accept-Encoding. Files without a
+current manifest entry fall back to the plain /static URL.
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are skipped
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Images are copied unchanged
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STATIC_DIR = os.path.join(ROOT, 'static')
+DEFAULT_DIST_DIR = os.path.join(DEFAULT_STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+HASH_LENGTH = 10
+URL_PREFIX = '/assets/'
+
+TEXT_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt'}
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Largest width/height each image is shown at, doubled for high-density screens
+IMAGE_MAX_SIZE = {
+    'images/bot_avatar.png': 400,  # hero image on the home page
+    'images/user_avatar.png': 96,
+    'images/lagro_logo.png': 96,
+}
+DEFAULT_IMAGE_MAX_SIZE = 1024
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hashed_name(path, data):
+    base, ext = os.path.splitext(path)
+    return f"{base}.{content_hash(data)[:HASH_LENGTH]}{ext}"
+
+
+# ---------------------------------------------------------------------------
+# Minification
+# ---------------------------------------------------------------------------
+
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+CSS_SPACE_AROUND = re.compile(r"\s*([{};,>])\s*")
+# Space before ":" is a descendant combinator in selectors (".a :hover"); only the space after it can go
+CSS_SPACE_AFTER = re.compile(r":\s+")
+
+
+def minify_css(text):
+    """Drop comments and whitespace the CSS grammar doesn't need"""
+    text = CSS_COMMENT.sub('', text)
+    text = re.sub(r"\s+", ' ', text)
+    text = CSS_SPACE_AROUND.sub(r"\1", text)
+    text = CSS_SPACE_AFTER.sub(':', text)
+    return text.replace(';}', '}').strip()
+
+
+# Characters after which a "/" starts a regular expression rather than a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+
+
+def minify_js(text):
+    """Strip comments and collapse whitespace outside strings, template literals and regexes
+
+    Newlines are kept (one per run) so automatic semicolon insertion still
+    sees the same statement boundaries.
+    """
+    out = []
+    i, n = 0, len(text)
+    last_significant = ''
+    while i < n:
+        c = text[i]
+        nxt = text[i + 1] if i + 1 < n else ''
+        if c in '"\'`':
+            # Copy the string or template literal verbatim
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' else 1
+            out.append(text[i:j + 1])
+            last_significant = c
+            i = j + 1
+        elif c == '/' and nxt == '/':
+            while i < n and text[i] != '\n':
+                i += 1
+        elif c == '/' and nxt == '*':
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif c == '/' and (last_significant in REGEX_PRECEDERS or not last_significant):
+            j, in_class = i + 1, False
+            while j < n and (text[j] != '/' or in_class):
+                if text[j] == '\\':
+                    j += 1
+                elif text[j] == '[':
+                    in_class = True
+                elif text[j] == ']':
+                    in_class = False
+                j += 1
+            out.append(text[i:j + 1])
+            last_significant = '/'
+            i = j + 1
+        elif c.isspace():
+            j = i
+            while j < n and text[j].isspace():
+                j += 1
+            prev = out[-1][-1:] if out else ''
+            following = text[j:j + 1]
+            if '\n' in text[i:j]:
+                if prev and prev != '\n':
+                    out.append('\n')
+            elif (_is_word(prev) and _is_word(following)) or (prev in '+-' and following == prev):
+                # "return x", "a + +b": the space is significant
+                out.append(' ')
+            i = j
+        else:
+            out.append(c)
+            last_significant = c
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def _is_word(char):
+    return char.isalnum() or char in '_$'
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def downsize_image(path, data):
+    """Image data scaled down to its display size, or unchanged without Pillow"""
+    if Image is None:
+        return data
+    limit = IMAGE_MAX_SIZE.get(path, DEFAULT_IMAGE_MAX_SIZE)
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        fmt = image.format
+        if max(image.size) > limit:
+            image.thumbnail((limit, limit), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if fmt == 'PNG':
+            image.save(buffer, 'PNG', optimize=True)
+        else:
+            image.save(buffer, fmt, quality=85, optimize=True)
+    resized = buffer.getvalue()
+    return resized if len(resized) < len(data) else data
+
+
+def compress(data):
+    """Smaller precompressed variants of data, by encoding"""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def _source_files(static_dir, dist_dir):
+    for folder, dirs, files in os.walk(static_dir):
+        if os.path.abspath(folder).startswith(os.path.abspath(dist_dir)):
+            continue
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(folder, name), static_dir).replace(os.sep, '/')
+            yield path
+
+
+def _rewrite_urls(text, manifest):
+    """Point /static/<path> references at their hashed URLs"""
+    def replace(match):
+        entry = manifest.get(match.group(1))
+        return URL_PREFIX + entry["path"] if entry else match.group(0)
+    return re.sub(r"/static/([\w./-]+)", replace, text)
+
+
+def build_assets(static_dir=DEFAULT_STATIC_DIR, dist_dir=DEFAULT_DIST_DIR):
+    """Write fingerprinted, minified and precompressed copies of static_dir into dist_dir"""
+    tmp_dir = f"{dist_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    paths = list(_source_files(static_dir, dist_dir))
+    # Images first, so CSS and JS can reference their hashed names
+    paths.sort(key=lambda p: os.path.splitext(p)[1] in TEXT_EXTENSIONS)
+    assets = {}
+    for path in paths:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            source = f.read()
+        ext = os.path.splitext(path)[1].lower()
+        data = source
+        if ext == '.css':
+            data = minify_css(_rewrite_urls(source.decode('utf-8'), assets)).encode('utf-8')
+        elif ext == '.js':
+            data = minify_js(_rewrite_urls(source.decode('utf-8'), assets)).encode('utf-8')
+        elif ext in IMAGE_EXTENSIONS:
+            data = downsize_image(path, source)
+
+        target = hashed_name(path, data)
+        os.makedirs(os.path.dirname(os.path.join(tmp_dir, target)), exist_ok=True)
+        with open(os.path.join(tmp_dir, target), 'wb') as f:
+            f.write(data)
+        entry = {"path": target, "source_sha256": content_hash(source),
+                 "source_bytes": len(source), "bytes": len(data), "encodings": {}}
+        if ext in TEXT_EXTENSIONS:
+            for encoding, body in compress(data).items():
+                with open(os.path.join(tmp_dir, target + ENCODING_SUFFIXES[encoding]), 'wb') as f:
+                    f.write(body)
+                entry["encodings"][encoding] = len(body)
+        assets[path] = entry
+
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump({"version": MANIFEST_VERSION, "assets": assets}, f, indent=1, sort_keys=True)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.replace(tmp_dir, dist_dir)
+    return assets
+
+
+# ---------------------------------------------------------------------------
+# Runtime
+# ---------------------------------------------------------------------------
+
+class AssetManifest:
+    """Hashed asset URLs from the build manifest, loaded on first use"""
+
+    def __init__(self, dist_dir=DEFAULT_DIST_DIR, static_dir=DEFAULT_STATIC_DIR):
+        self.dist_dir = dist_dir
+        self.static_dir = static_dir
+        self._assets = None
+        self._by_hashed_path = None
+
+    def _load(self):
+        assets = {}
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST_NAME), encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                assets = manifest["assets"]
+        except (OSError, ValueError) as e:
+            logger.info(f"No static asset manifest ({str(e)}), serving unhashed /static files")
+
+        # An entry whose source changed since the build would serve stale content
+        stale = []
+        for path, entry in assets.items():
+            try:
+                with open(os.path.join(self.static_dir, path), 'rb') as f:
+                    if content_hash(f.read()) != entry["source_sha256"]:
+                        stale.append(path)
+            except OSError:
+                stale.append(path)
+        if stale:
+            logger.warning(f"Static assets changed since the last build, run static_assets.py: {', '.join(stale)}")
+            assets = {path: entry for path, entry in assets.items() if path not in stale}
+
+        self._by_hashed_path = {entry["path"]: entry for entry in assets.values()}
+        self._assets = assets
+
+    def entry(self, path):
+        if self._assets is None:
+            self._load()
+        return self._assets.get(path)
+
+    def hashed_entry(self, hashed_path):
+        if self._by_hashed_path is None:
+            self._load()
+        return self._by_hashed_path.get(hashed_path)
+
+    def url(self, path):
+        """Hashed URL for a static path, or None if it isn't in the manifest"""
+        entry = self.entry(path)
+        return URL_PREFIX + entry["path"] if entry else None
+
+
+def choose_encoding(accept_encodings, available):
+    """Best precompressed variant the client accepts: Brotli, then gzip, else identity"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets")
+    parser.add_argument('--static', default=DEFAULT_STATIC_DIR, help="Source static directory")
+    parser.add_argument('--out', default=DEFAULT_DIST_DIR, help="Where to write the built assets")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    if Image is None:
+        logger.warning("Pillow is not installed, images are copied without resizing")
+    if brotli is None:
+        logger.warning("brotli is not installed, only gzip variants are written")
+
+    assets = build_assets(args.static, args.out)
+    for path, entry in sorted(assets.items()):
+        sizes = ', '.join(f"{encoding} {size // 1024} kB" for encoding, size in entry["encodings"].items())
+        print(f"{path:<28} {entry['source_bytes'] // 1024:>6} kB -> {entry['bytes'] // 1024:>5} kB"
+              f"{f' ({sizes})' if sizes else ''}  {entry['path']}")
+    before = sum(entry["source_bytes"] for entry in assets.values())
+    after = sum(min([entry["bytes"]] + list(entry["encodings"].values())) for entry in assets.values())
+    print(f"Total {before // 1024} kB -> {after // 1024} kB over the wire")
+
+
+if __name__ == '__main__':
+    main()